@@ -1,4 +1,3 @@
-
 import os, random, string
 
 class Config(object):
@@ -24,6 +23,118 @@ class Config(object):
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # IDS scoring: directory holding scaler.pkl and the ids_* model artifacts
+    MODEL_DIR = os.getenv('MODEL_DIR', '.')
+
+    # IDS scoring: load the sklearn/LightGBM artifacts at import time, so that
+    # gunicorn --preload shares them copy-on-write across workers
+    PRELOAD_MODELS = (os.getenv('PRELOAD_MODELS', 'False') == 'True')
+
+    # IDS scoring: serving backend of the DNN/CNN, 'keras' (the .h5 files, through
+    # TensorFlow), 'tflite' or 'tflite_int8' (exports from python -m apps.ids.export,
+    # no TensorFlow import)
+    MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'keras')
+
+    # IDS scoring: precision of the feature matrix, 'float64' or 'float32' (half the
+    # memory; check it with python -m apps.ids.parity before switching)
+    SCORING_PRECISION = os.getenv('SCORING_PRECISION', 'float64')
+
+    # IDS scoring: TensorFlow intra/inter-op threads (or TFLite interpreter threads)
+    # per worker (0 = backend default)
+    TF_THREADS = int(os.getenv('TF_THREADS', 0))
+
+    # IDS scoring: coalesce concurrent /predict requests into micro-batches
+    PREDICT_BATCHING       = (os.getenv('PREDICT_BATCHING', 'False') == 'True')
+    PREDICT_MAX_BATCH_SIZE = int(os.getenv('PREDICT_MAX_BATCH_SIZE', 64))
+    PREDICT_MAX_LATENCY_MS = float(os.getenv('PREDICT_MAX_LATENCY_MS', 5))
+
+    # IDS scoring: maximum flows accepted by one /predict/batch request
+    PREDICT_MAX_FLOWS = int(os.getenv('PREDICT_MAX_FLOWS', 10000))
+
+    # IDS scoring: rows handed to each model per call
+    SCORING_CHUNK_SIZE = int(os.getenv('SCORING_CHUNK_SIZE', 8192))
+
+    # IDS scoring: score identical rows of a batch once, and optionally keep the
+    # scores of up to SCORE_CACHE_ENTRIES flow vectors across requests (0 = disabled)
+    SCORING_DEDUP       = (os.getenv('SCORING_DEDUP', 'True') == 'True')
+    SCORE_CACHE_ENTRIES = int(os.getenv('SCORE_CACHE_ENTRIES', 0))
+
+    # IDS scoring: cascade mode, members run cheapest first (comma-separated
+    # registry names) and only on the flows the remaining ones could still flip.
+    # Labels are those of the full ensemble, but the confidence of a flow that
+    # exits early (stored records included) averages only the members that ran
+    SCORING_CASCADE = (os.getenv('SCORING_CASCADE', 'False') == 'True')
+    CASCADE_ORDER   = tuple(os.getenv('CASCADE_ORDER', 'group,dnn,cnn').split(','))
+
+    # IDS scoring: routed mode, iso_forest passes clear inliers (decision_function
+    # above ISO_FOREST_THRESHOLD) as benign, then web flows (ROUTING_WEB_PORTS) and
+    # the others are scored with the web / non-web specialist LightGBM models
+    SCORING_ROUTING      = (os.getenv('SCORING_ROUTING', 'False') == 'True')
+    ROUTING_WEB_PORTS    = tuple(int(port) for port in os.getenv('ROUTING_WEB_PORTS', '80,443,8000,8080,8443').split(','))
+    ISO_FOREST_PREFILTER = (os.getenv('ISO_FOREST_PREFILTER', 'True') == 'True')
+    ISO_FOREST_THRESHOLD = float(os.getenv('ISO_FOREST_THRESHOLD', 0.0))
+
+    # IDS scoring: process-pool mode, batches above SCORING_SHARD_ROWS rows are split
+    # into shards scored by SCORING_WORKERS processes (0 = disabled), each with its
+    # own models and SCORING_WORKER_THREADS LightGBM / TensorFlow threads
+    SCORING_WORKERS        = int(os.getenv('SCORING_WORKERS', 0))
+    SCORING_SHARD_ROWS     = int(os.getenv('SCORING_SHARD_ROWS', 16384))
+    SCORING_WORKER_THREADS = int(os.getenv('SCORING_WORKER_THREADS', 1))
+
+    # IDS scoring: /predict/stream, NDJSON flow records scored in micro-batches of up
+    # to STREAM_MAX_BATCH_SIZE records or STREAM_MAX_LATENCY_MS; at most STREAM_MAX_QUEUE
+    # parsed records wait per stream (the request body is then no longer read, which
+    # throttles the sensor), at most STREAM_MAX_SESSIONS streams per worker
+    STREAM_MAX_BATCH_SIZE = int(os.getenv('STREAM_MAX_BATCH_SIZE', 1024))
+    STREAM_MAX_LATENCY_MS = float(os.getenv('STREAM_MAX_LATENCY_MS', 200))
+    STREAM_MAX_QUEUE      = int(os.getenv('STREAM_MAX_QUEUE', 8192))
+    STREAM_MAX_SESSIONS   = int(os.getenv('STREAM_MAX_SESSIONS', 16))
+    STREAM_MAX_LINE_BYTES = int(os.getenv('STREAM_MAX_LINE_BYTES', 65536))
+
+    # IDS scoring: CSV rows read per chunk by /analyze_csv/stream
+    CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', 50000))
+
+    # IDS scoring: background threads running /analyze_csv/jobs
+    ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', 2))
+
+    # IDS scoring: DetectionRecord rows per bulk insert / commit
+    DETECTION_INSERT_BATCH = int(os.getenv('DETECTION_INSERT_BATCH', 10000))
+
+    # IDS scoring: keep an Arrow IPC copy of each distinct upload (needs pyarrow)
+    # so re-analysing the same capture maps it instead of parsing the CSV again
+    COLUMNAR_CACHE = (os.getenv('COLUMNAR_CACHE', 'True') == 'True')
+
+    # IDS scoring: disk budget of the uploads the app saved (raw CSVs recorded on
+    # an analysis and columnar copies), least recently used files are deleted
+    # first (0 = unbounded)
+    UPLOADS_MAX_MB = int(os.getenv('UPLOADS_MAX_MB', 2048))
+
+    # IDS scoring: /analyze_csv results kept per worker, keyed by upload content
+    # and invalidated when a model file changes (0 entries = disabled)
+    RESULT_CACHE_ENTRIES = int(os.getenv('RESULT_CACHE_ENTRIES', 32))
+    RESULT_CACHE_MB      = int(os.getenv('RESULT_CACHE_MB', 256))
+
+    # IDS audit (opt-in): verdicts of /predict and /analyze_csv written in batches by a
+    # background thread to AUDIT_LOG (JSONL, one file per process, {pid} is replaced, e.g.
+    # logs/audit-{pid}.jsonl; '' = no file), gzip-compressed with AUDIT_LOG_COMPRESS,
+    # and/or to the AuditRecord table (AUDIT_DB)
+    AUDIT_LOG          = os.getenv('AUDIT_LOG', '')
+    AUDIT_LOG_COMPRESS = (os.getenv('AUDIT_LOG_COMPRESS', 'False') == 'True')
+    AUDIT_DB           = (os.getenv('AUDIT_DB', 'False') == 'True')
+
+    # IDS audit: a batch is written every AUDIT_FLUSH_ROWS verdicts or AUDIT_FLUSH_SECONDS;
+    # at most AUDIT_MAX_QUEUE requests wait for the writer, later ones are not audited
+    # (and counted) rather than slowed down
+    AUDIT_FLUSH_ROWS    = int(os.getenv('AUDIT_FLUSH_ROWS', 5000))
+    AUDIT_FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', 2))
+    AUDIT_MAX_QUEUE     = int(os.getenv('AUDIT_MAX_QUEUE', 1000))
+
+    # IDS audit: the log file is rotated past AUDIT_ROTATE_MB or AUDIT_ROTATE_HOURS,
+    # the newest AUDIT_BACKUPS rotated files (those of every process together) are kept
+    AUDIT_ROTATE_MB    = int(os.getenv('AUDIT_ROTATE_MB', 100))
+    AUDIT_ROTATE_HOURS = float(os.getenv('AUDIT_ROTATE_HOURS', 24))
+    AUDIT_BACKUPS      = int(os.getenv('AUDIT_BACKUPS', 10))
+
     DB_ENGINE   = os.getenv('DB_ENGINE'   , None)
     DB_USERNAME = os.getenv('DB_USERNAME' , None)
     DB_PASS     = os.getenv('DB_PASS'     , None)
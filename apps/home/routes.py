@@ -4,16 +4,25 @@ Copyright (c) 2019 - present AppSeed.us
 """
 
 from apps.home import blueprint
-from flask import render_template, request, jsonify
+from flask import render_template, request, jsonify, current_app, Response, stream_with_context
 from flask_login import login_required, current_user
 from jinja2 import TemplateNotFound
 import pandas as pd
 import pickle
 import os
+import uuid
 from werkzeug.utils import secure_filename
 
+from apps import db
 from apps.config import API_GENERATOR
 from apps.authentication.forms_change_password import ChangePasswordForm
+from apps.ids.columnar import content_hash, enforce_disk_budget, files_under
+from apps.ids.ingest import load_features, result_columns, results_from_columns, stream_csv_analysis
+from apps.ids.jobs import job_status
+from apps.ids.persistence import load_detections, query_analyses, query_detections, save_detections
+from apps.ids.schema import preview_records
+from apps.ids.scoring import dedup_ratio, early_exit_ratio
+from apps.models import AnalysisResult
 
 @blueprint.route('/index')
 @login_required
@@ -56,162 +65,92 @@ def route_template(template):
 @login_required
 def analyze_csv():
     try:
-        if 'csvFile' not in request.files:
-            return jsonify({'success': False, 'error': 'No file uploaded'})
+        # Stored on the analysis: a name of its own, never overwritten by another upload
+        upload_path, error = save_upload(request, unique=True)
+        if error:
+            return jsonify({'success': False, 'error': error})
+        filename = secure_filename(request.files['csvFile'].filename)
         
-        file = request.files['csvFile']
-        if file.filename == '':
-            return jsonify({'success': False, 'error': 'No file selected'})
+        # Same content scored by the same models: reuse the stored results
+        key = content_hash(upload_path)
+        cached = current_app.result_cache.get(key) if current_app.result_cache else None
         
-        if not file.filename.lower().endswith('.csv'):
-            return jsonify({'success': False, 'error': 'Please upload a CSV file'})
-        
-        # Save uploaded file
-        filename = secure_filename(file.filename)
-        upload_path = os.path.join('uploads', filename)
-        file.save(upload_path)
-        
-        # Read CSV file from saved location
-        df = pd.read_csv(upload_path)
-        
-        # Access models from Flask app context
-        from flask import current_app
-        import numpy as np
-        
-        # Expected model features in correct order
-        expected_features = [
-            'Destination Port', 'Flow Duration', 'Total Fwd Packets', 'Total Backward Packets',
-            'Total Length of Fwd Packets', 'Total Length of Bwd Packets', 'Fwd Packet Length Max',
-            'Fwd Packet Length Min', 'Fwd Packet Length Mean', 'Fwd Packet Length Std',
-            'Bwd Packet Length Max', 'Bwd Packet Length Min', 'Bwd Packet Length Mean',
-            'Bwd Packet Length Std', 'Flow Bytes/s', 'Flow Packets/s', 'Flow IAT Mean',
-            'Flow IAT Std', 'Flow IAT Max', 'Flow IAT Min', 'Fwd IAT Total', 'Fwd IAT Mean',
-            'Fwd IAT Std', 'Fwd IAT Max', 'Fwd IAT Min', 'Bwd IAT Total', 'Bwd IAT Mean',
-            'Bwd IAT Std', 'Bwd IAT Max', 'Bwd IAT Min', 'Fwd PSH Flags', 'Bwd PSH Flags',
-            'Fwd URG Flags', 'Bwd URG Flags', 'Fwd Header Length', 'Bwd Header Length',
-            'Fwd Packets/s', 'Bwd Packets/s', 'Min Packet Length', 'Max Packet Length',
-            'Packet Length Mean', 'Packet Length Std', 'Packet Length Variance', 'FIN Flag Count',
-            'SYN Flag Count', 'RST Flag Count', 'PSH Flag Count', 'ACK Flag Count',
-            'URG Flag Count', 'CWE Flag Count', 'ECE Flag Count', 'Down/Up Ratio',
-            'Average Packet Size', 'Avg Fwd Segment Size', 'Avg Bwd Segment Size',
-            'Fwd Header Length.1', 'Fwd Avg Bytes/Bulk', 'Fwd Avg Packets/Bulk',
-            'Fwd Avg Bulk Rate', 'Bwd Avg Bytes/Bulk', 'Bwd Avg Packets/Bulk',
-            'Bwd Avg Bulk Rate', 'Subflow Fwd Packets', 'Subflow Fwd Bytes',
-            'Subflow Bwd Packets', 'Subflow Bwd Bytes', 'Init_Win_bytes_forward',
-            'Init_Win_bytes_backward', 'act_data_pkt_fwd', 'min_seg_size_forward'
-        ]
-        
-        # Remove non-feature columns
-        exclude_cols = ['Unnamed: 0', 'Label', 'label', 'Label_encoded', 'Attack_Type']
-        for col in exclude_cols:
-            if col in df.columns:
-                df = df.drop(col, axis=1)
-        
-        # Check if we have numbered columns
-        numbered_cols_available = [col for col in df.columns if col.isdigit()]
-        has_numbered_cols = len(numbered_cols_available) >= 70
-        
-        if has_numbered_cols:
-            # Sort numbered columns and take first 70
-            numbered_cols_sorted = sorted([int(col) for col in numbered_cols_available])
-            selected_numbered_cols = [str(i) for i in numbered_cols_sorted[:70]]
-            X = df[selected_numbered_cols]
-            print(f"Using numbered columns {selected_numbered_cols[0]}-{selected_numbered_cols[-1]}: {len(X.columns)} features")
-        else:
-            # Try to match feature names with expected features
-            matched_features = []
-            missing_features = []
-            
-            for expected_feature in expected_features:
-                if expected_feature in df.columns:
-                    matched_features.append(expected_feature)
-                else:
-                    missing_features.append(expected_feature)
-                    # Add zero column for missing features
-                    df[expected_feature] = 0
-                    matched_features.append(expected_feature)
-            
-            print(f"Matched features: {len(matched_features)}")
-            if missing_features:
-                print(f"Missing features (filled with zeros): {len(missing_features)}")
-            
-            # Select only the matched features in correct order
-            X = df[matched_features]
+        if cached is None:
+            # Check if models are loaded
+            if not current_app.scorer.ready():
+                os.remove(upload_path)
+                return jsonify({'success': False, 'error': 'Models not loaded'})
             
-            # Remove any extra columns not in expected features  
-            extra_cols = set(df.columns) - set(expected_features)
-            if extra_cols:
-                print(f"Available columns: {len(df.columns)}, Using: {len(matched_features)}, Discarding: {len(extra_cols)}")
-        
-        # Ensure exactly 70 features
-        if len(X.columns) != 70:
-            return jsonify({'success': False, 'error': f'Feature count mismatch: got {len(X.columns)}, expected 70. Available columns: {list(df.columns)[:10]}...'})
-        
-        print(f"Final feature set: {len(X.columns)} features ready for model")
-        
-        # Check if models are loaded
-        if not hasattr(current_app, 'models_loaded') or not current_app.models_loaded:
-            return jsonify({'success': False, 'error': 'Models not loaded'})
-        
-        # Get models from app context
-        scaler = current_app.scaler
-        model_dnn = current_app.model_dnn
-        model_cnn = current_app.model_cnn
-        model_group = current_app.model_group
-        
-        # Convert DataFrame to numpy array before scaling to avoid sklearn warnings
-        print(f"Converting to numpy array: {X.shape}")
-        X_array = X.values
-        X_scaled = scaler.transform(X_array)
-        predictions = []
-        confidences = []
-        
-        for i in range(len(X_scaled)):
-            x_sample = X_scaled[i:i+1]
+            # Model features in schema order: parsed once per distinct file, then
+            # memory-mapped from its columnar copy
+            X, protocols = load_features(upload_path, cache=current_app.columnar, key=key,
+                                         dtype=current_app.scorer.dtype)
+            scores = current_app.scorer.score_batch(X, protocols)
+            columns = result_columns(X, scores, protocols)
             
-            # Get predictions from each model
-            pred_dnn = model_dnn.predict(x_sample, verbose=0)[0][0]
-            pred_cnn = model_cnn.predict(x_sample.reshape(1, -1, 1), verbose=0)[0][0]
-            pred_group = model_group.predict_proba(x_sample)[0][1]
-            
-            # Ensemble prediction
-            ensemble_pred = (pred_dnn * 0.4 + pred_cnn * 0.3 + pred_group * 0.3)
-            final_pred = 1 if ensemble_pred > 0.5 else 0
-            
-            predictions.append(final_pred)
-            confidences.append(ensemble_pred)
+            # Share of the rows served without running the models (duplicate flows)
+            # and of the scored rows that exited the cascade early
+            extra_stats = {'dedup_ratio': dedup_ratio(scores['dedup']),
+                           'early_exit_ratio': early_exit_ratio(scores['cascade'])}
+            analysis = None
+        else:
+            columns, analysis_id, extra_stats = cached
+            analysis = get_user_analysis(analysis_id)
+            if analysis is not None:
+                # Same content as the stored analysis: keep a single copy of the file
+                if analysis.upload_path and os.path.exists(analysis.upload_path):
+                    os.remove(upload_path)
+                    upload_path = analysis.upload_path
+                else:
+                    analysis.upload_path = upload_path
+                    db.session.commit()
         
         # Prepare results
-        results = []
-        for i, (pred, conf) in enumerate(zip(predictions, confidences)):
-            result = {
-                'prediction': int(pred),
-                'confidence': float(conf),
-                'protocol': df.iloc[i].get('Protocol', 'N/A'),
-                'flow_duration': X.iloc[i].get('Flow Duration', 'N/A'),
-                'total_packets': (X.iloc[i].get('Total Fwd Packets', 0) + X.iloc[i].get('Total Backward Packets', 0)) if 'Total Fwd Packets' in X.columns else 'N/A'
-            }
-            results.append(result)
+        results = results_from_columns(columns)
         
         # Calculate statistics
-        total_records = len(predictions)
-        attacks_detected = sum(predictions)
+        total_records = len(results)
+        attacks_detected = int(columns['prediction'].sum())
         benign_traffic = total_records - attacks_detected
         
         stats = {
             'total': total_records,
             'threats': attacks_detected,
-            'normal': benign_traffic
+            'normal': benign_traffic,
+            **extra_stats
         }
         
-        # Prepare file content for preview (first 10 rows)
-        file_content = df.head(10).to_dict('records')
+        if analysis is None:
+            # Persist the analysis and its records (bulk inserts, batched commits)
+            analysis = AnalysisResult(filename=filename,
+                                      total_records=total_records,
+                                      attacks_detected=attacks_detected,
+                                      benign_traffic=benign_traffic,
+                                      processed_records=total_records,
+                                      upload_path=upload_path,
+                                      user_id=current_user.id)
+            db.session.add(analysis)
+            db.session.commit()
+            save_detections(analysis.id, results, batch_size=current_app.config['DETECTION_INSERT_BATCH'])
+            
+            if current_app.result_cache:
+                current_app.result_cache.put(key, columns, analysis.id, extra_stats)
+        
+        # Audit trail of the verdicts served (queued, written in the background)
+        if current_app.audit:
+            current_app.audit.log_analysis(analysis.id, filename, columns,
+                                           user_id=current_user.id, cached=cached is not None)
+        
+        # Prepare file content for preview (first 10 rows, all columns)
+        file_content = preview_records(pd.read_csv(upload_path, nrows=10))
         
         return jsonify({
             'success': True,
+            'analysis_id': analysis.id,
             'results': results,
             'stats': stats,
-            'file_content': file_content
+            'file_content': file_content,
+            'cached': cached is not None
         })
         
     except Exception as e:
@@ -220,6 +159,192 @@ def analyze_csv():
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)})
 
+@blueprint.route('/analyze_csv/stream', methods=['POST'])
+@login_required
+def analyze_csv_stream():
+    # Same analysis as /analyze_csv, streamed as NDJSON one chunk of rows at a time
+    upload_path, error = save_upload(request)
+    if error:
+        return jsonify({'success': False, 'error': error})
+
+    if not current_app.scorer.ready():
+        return jsonify({'success': False, 'error': 'Models not loaded'})
+
+    # Audit trail of the streamed verdicts, one entry per chunk (the analysis is not stored)
+    on_chunk = None
+    if current_app.audit:
+        audit, filename, user_id = current_app.audit, os.path.basename(upload_path), current_user.id
+        def on_chunk(columns, offset):
+            audit.log_analysis(None, filename, columns, offset=offset,
+                               endpoint='/analyze_csv/stream', user_id=user_id)
+
+    lines = stream_csv_analysis(upload_path, current_app.scorer,
+                                chunk_rows=current_app.config['CSV_CHUNK_ROWS'],
+                                cache=current_app.columnar, on_chunk=on_chunk)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+@blueprint.route('/analyze_csv/jobs', methods=['POST'])
+@login_required
+def submit_analysis_job():
+    # Score the upload in the background; poll /analyze_csv/jobs/<job_id> for progress
+    upload_path, error = save_upload(request, unique=True)
+    if error:
+        return jsonify({'success': False, 'error': error})
+
+    if not current_app.scorer.ready():
+        return jsonify({'success': False, 'error': 'Models not loaded'})
+
+    filename = secure_filename(request.files['csvFile'].filename)
+    job_id = current_app.jobs.submit(upload_path, filename, user_id=current_user.id)
+    return jsonify({'success': True, 'job_id': job_id}), 202
+
+@blueprint.route('/analyze_csv/jobs/<int:job_id>')
+@login_required
+def analysis_job_status(job_id):
+    job = get_user_analysis(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+
+    return jsonify({'success': True, **job_status(job)})
+
+@blueprint.route('/analyze_csv/jobs/<int:job_id>/results')
+@login_required
+def analysis_job_results(job_id):
+    job = get_user_analysis(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+
+    if job.status != 'done':
+        return jsonify({'success': False, 'error': f'Job is {job.status}', **job_status(job)}), 409
+
+    # Preview of the uploaded file (first 10 rows), as returned by /analyze_csv
+    preview = []
+    if job.upload_path and os.path.exists(job.upload_path):
+        preview = preview_records(pd.read_csv(job.upload_path, nrows=10))
+
+    return jsonify({
+        'success': True,
+        'results': load_detections(job.id),
+        'stats': job_status(job)['stats'],
+        'file_content': preview
+    })
+
+@blueprint.route('/analyses')
+@login_required
+def list_analyses():
+    # Past analyses of the current user, newest first (keyset pagination on id)
+    try:
+        analyses, next_cursor = query_analyses(current_user.id,
+                                               cursor=request.args.get('cursor'),
+                                               limit=request.args.get('limit', 20, type=int))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'analyses': [job_status(analysis) for analysis in analyses],
+        'next_cursor': next_cursor
+    })
+
+@blueprint.route('/analyses/<int:analysis_id>')
+@login_required
+def analysis_summary(analysis_id):
+    analysis = get_user_analysis(analysis_id)
+    if analysis is None:
+        return jsonify({'success': False, 'error': 'Analysis not found'}), 404
+
+    summary = job_status(analysis)
+    if analysis.upload_path and os.path.exists(analysis.upload_path):
+        # Preview of the uploaded file (first 10 rows), as returned by /analyze_csv
+        summary['file_content'] = preview_records(pd.read_csv(analysis.upload_path, nrows=10))
+
+    return jsonify({'success': True, **summary})
+
+@blueprint.route('/analyses/<int:analysis_id>/records')
+@login_required
+def analysis_records(analysis_id):
+    # One page of stored records, filtered and sorted server-side:
+    # ?prediction=0|1&min_confidence=&max_confidence=&protocol=&sort=record|confidence&order=asc|desc&cursor=&limit=
+    # (with SCORING_CASCADE, early-exit records hold a partial-ensemble confidence, see query_detections)
+    analysis = get_user_analysis(analysis_id)
+    if analysis is None:
+        return jsonify({'success': False, 'error': 'Analysis not found'}), 404
+
+    args = request.args
+    try:
+        records, next_cursor = query_detections(
+            analysis.id,
+            prediction=args.get('prediction', type=int),
+            min_confidence=args.get('min_confidence', type=float),
+            max_confidence=args.get('max_confidence', type=float),
+            protocol=args.get('protocol'),
+            sort=args.get('sort', 'record'),
+            descending=(args.get('order', 'asc') == 'desc'),
+            cursor=args.get('cursor'),
+            limit=args.get('limit', 50, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({'success': True, 'records': records, 'next_cursor': next_cursor})
+
+# Helper - Fetch an analysis (or job) owned by the current user
+def get_user_analysis(analysis_id):
+
+    analysis = db.session.get(AnalysisResult, analysis_id)
+    if analysis is None or analysis.user_id != current_user.id:
+        return None
+    return analysis
+
+# Helper - Save the uploaded CSV, returns (upload_path, error)
+def save_upload(request, unique=False):
+
+    if 'csvFile' not in request.files:
+        return None, 'No file uploaded'
+
+    file = request.files['csvFile']
+    if file.filename == '':
+        return None, 'No file selected'
+
+    if not file.filename.lower().endswith('.csv'):
+        return None, 'Please upload a CSV file'
+
+    # Save uploaded file
+    filename = secure_filename(file.filename)
+    if unique:
+        # Recorded on an analysis (and read by background jobs after the request returns)
+        filename = f'{uuid.uuid4().hex}_{filename}'
+    upload_path = os.path.join('uploads', filename)
+    file.save(upload_path)
+    enforce_upload_budget(upload_path)
+
+    return upload_path, None
+
+# Helper - Keep the uploads saved by save_upload and their columnar copies within UPLOADS_MAX_MB
+def enforce_upload_budget(upload_path):
+
+    # Only files the app wrote are evicted: the columnar copies and the raw
+    # uploads recorded on an analysis (never e.g. the samples shipped in uploads/)
+    recorded = {os.path.abspath(path): path for path, in
+                db.session.query(AnalysisResult.upload_path).filter(AnalysisResult.upload_path.isnot(None)).distinct()}
+    candidates = list(recorded) + [upload_path]
+    if current_app.columnar is not None:
+        candidates += files_under(current_app.columnar.root)
+
+    # Never delete the new upload or one a background job has yet to read
+    active = AnalysisResult.query.filter(AnalysisResult.status.in_(('queued', 'running'))) \
+                                 .with_entities(AnalysisResult.upload_path)
+    keep = [upload_path] + [path for path, in active]
+
+    deleted = enforce_disk_budget(candidates, current_app.config['UPLOADS_MAX_MB'] * 2**20, keep)
+
+    # Analyses whose upload is gone no longer offer a file preview
+    evicted = [recorded[path] for path in deleted if path in recorded]
+    if evicted:
+        AnalysisResult.query.filter(AnalysisResult.upload_path.in_(evicted)) \
+                            .update({'upload_path': None}, synchronize_session=False)
+        db.session.commit()
+
 # Helper - Extract current page name from request
 def get_segment(request):
 
@@ -0,0 +1,4 @@
+# -*- encoding: utf-8 -*-
+"""
+IDS inference engine shared by the /predict and /analyze_csv endpoints.
+"""
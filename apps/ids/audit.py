@@ -0,0 +1,326 @@
+# -*- encoding: utf-8 -*-
+"""
+Audit log of the verdicts served by /predict and /analyze_csv (and their batch, stream and job variants),
+written in batches by a background thread.
+"""
+
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+
+from apps import db
+from apps.ids.ingest import results_from_columns
+from apps.ids.schema import FEATURES
+from apps.ids.scoring import result_at
+from apps.models import AuditRecord
+
+# Lines written (and rows inserted) per batch
+DEFAULT_FLUSH_ROWS = 5000
+
+# Seconds a verdict may wait for its batch to fill
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+# Requests waiting for the writer; beyond it their entries are dropped (and
+# counted) so that a slow disk never slows the requests down
+DEFAULT_MAX_QUEUE = 1000
+
+# The log file is rotated past this size (bytes on disk) or age (seconds)
+DEFAULT_ROTATE_BYTES = 100 * 2**20
+DEFAULT_ROTATE_SECONDS = 24 * 3600
+
+# Rotated files kept (across all processes)
+DEFAULT_BACKUPS = 10
+
+# Seconds close() waits for the queued entries to be written
+CLOSE_TIMEOUT = 10.0
+
+# Queued by close() after the last entry
+STOP = object()
+
+
+def timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+class AuditLog:
+    """Queues verdicts on the request path and writes them from a background thread.
+
+    ``log_prediction``, ``log_batch`` and ``log_analysis`` only enqueue
+    references to values the request already holds (feature matrices,
+    score arrays and /analyze_csv result columns are expanded into one
+    line per flow by the writer). The writer collects
+    entries until flush_rows lines are pending or flush_interval seconds
+    have passed, then appends them with one write to the JSONL file at
+    path (gzip members when compress) and/or one executemany into
+    AuditRecord.
+
+    Each process writes its own file: ``{pid}`` in path is replaced by the
+    process id. The file is renamed to ``<name>.<UTC time><ext>`` once it
+    holds rotate_bytes bytes or is rotate_seconds old, and only the newest
+    backups rotated files are kept, counting those of every process (the
+    files of exited workers included).
+    """
+
+    def __init__(self, path=None, compress=False, app=None, flush_rows=DEFAULT_FLUSH_ROWS,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, max_queue=DEFAULT_MAX_QUEUE,
+                 rotate_bytes=DEFAULT_ROTATE_BYTES, rotate_seconds=DEFAULT_ROTATE_SECONDS,
+                 backups=DEFAULT_BACKUPS):
+        self.path_template = path
+        self.compress = compress
+        self.app = app
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backups = backups
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._raw = None
+        self._opened_at = None
+        # Once per log; close() returns at once when no writer is running
+        atexit.register(self.close)
+
+        # Metrics
+        self.entries = 0
+        self.dropped = 0
+        self.lines = 0
+        self.db_rows = 0
+        self.batches = 0
+        self.rotations = 0
+        self.write_errors = 0
+
+    @property
+    def path(self):
+        if not self.path_template:
+            return None
+        return self._path_for(str(os.getpid()))
+
+    def _path_for(self, pid):
+        path = self.path_template.replace('{pid}', pid)
+        return path + '.gz' if self.compress and not path.endswith('.gz') else path
+
+    def log_prediction(self, features, verdict, **context):
+        """Audit one /predict verdict along with the submitted features."""
+        self._submit(('prediction', time.time(), (features, verdict), context))
+
+    def log_batch(self, endpoint, X, scores, records=None, protocols=None, **context):
+        """Audit the verdicts of several flows (a score_batch result) along with their feature rows.
+
+        records are the numbers reported for the rows (default 0 to n - 1).
+        """
+        self._submit(('batch', time.time(), (endpoint, X, scores, records, protocols), context))
+
+    def log_analysis(self, analysis_id, filename, columns, offset=0, endpoint='/analyze_csv', **context):
+        """Audit the verdicts of one /analyze_csv analysis, or of its chunk starting at record offset.
+
+        columns is a result_columns output; analysis_id is None for a
+        streamed analysis, which is not stored.
+        """
+        self._submit(('analysis', time.time(), (endpoint, analysis_id, filename, columns, offset), context))
+
+    def _submit(self, entry):
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait(entry)
+            self.entries += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_worker(self):
+        # Started on first use, so it is never created in a gunicorn master before fork
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            entries = [self.queue.get()]
+            pending = entry_rows(entries[0])
+            deadline = time.monotonic() + self.flush_interval
+
+            while entries[-1] is not STOP and pending < self.flush_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entries.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                pending += entry_rows(entries[-1])
+
+            stop = entries[-1] is STOP
+            if stop:
+                entries.pop()
+            if entries:
+                self._write(entries)
+            if stop:
+                self._close_file()
+                return
+
+    def _write(self, entries):
+        records = [record for entry in entries for record in expand_entry(entry)]
+        try:
+            if self.path:
+                self._write_file(records)
+            if self.app is not None:
+                self._write_db(records)
+            self.batches += 1
+        except Exception as e:
+            # Never let a full disk or a locked database kill the writer
+            print(f"Error in audit log: {str(e)}")
+            traceback.print_exc()
+            self.write_errors += 1
+
+    def _write_file(self, records):
+        if self._file is not None and (self._raw.tell() >= self.rotate_bytes
+                                       or time.time() - self._opened_at >= self.rotate_seconds):
+            self._rotate()
+        if self._file is None:
+            self._open()
+
+        self._file.write(''.join(json.dumps(record) + '\n' for record in records).encode())
+        # One gzip sync point per batch: the file is readable up to the last batch
+        self._file.flush()
+        self.lines += len(records)
+
+    def _open(self):
+        path = self.path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._raw = open(path, 'ab')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='ab') if self.compress else self._raw
+        self._opened_at = time.time()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = self._raw = None
+
+    def _rotate(self):
+        self._close_file()
+        path = self.path
+        base, ext = split_extension(path)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        target, n = f'{base}.{stamp}{ext}', 1
+        while os.path.exists(target):
+            target, n = f'{base}.{stamp}-{n}{ext}', n + 1
+        os.replace(path, target)
+        self.rotations += 1
+
+        # Rotated files of any process, never the live file of another worker
+        base, ext = split_extension(self._path_for('{pid}'))
+        pattern = '*'.join(glob.escape(part) for part in base.split('{pid}'))
+        rotated = sorted(glob.glob(f'{pattern}.*{glob.escape(ext)}'), key=os.path.getmtime)
+        for old in rotated[:max(len(rotated) - self.backups, 0)]:
+            os.remove(old)
+
+    def _write_db(self, records):
+        with self.app.app_context():
+            insert = db.insert(AuditRecord)
+            for start in range(0, len(records), self.flush_rows):
+                db.session.execute(insert, [audit_mapping(record) for record in records[start:start + self.flush_rows]])
+                db.session.commit()
+        self.db_rows += len(records)
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """Write the queued entries and close the file (also run at interpreter exit)."""
+
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def metrics(self):
+        return {
+            'path': self.path,
+            'database': self.app is not None,
+            'queue_depth': self.queue.qsize(),
+            'entries': self.entries,
+            'dropped': self.dropped,
+            'lines': self.lines,
+            'db_rows': self.db_rows,
+            'batches': self.batches,
+            'rotations': self.rotations,
+            'write_errors': self.write_errors
+        }
+
+
+def split_extension(path):
+    """``(base, ext)`` of a log path, ext covering a compression suffix (``.jsonl.gz``)."""
+    base, ext = os.path.splitext(path)
+    if ext == '.gz':
+        base, inner = os.path.splitext(base)
+        ext = inner + ext
+    return base, ext
+
+
+def entry_rows(entry):
+    """Lines an entry expands to."""
+    if entry is STOP:
+        return 0
+    if entry[0] == 'analysis':
+        return len(entry[2][3]['prediction'])
+    if entry[0] == 'batch':
+        return len(entry[2][1])
+    return 1
+
+
+def expand_entry(entry):
+    """Audit records (dicts, one per verdict) of a queued entry."""
+
+    kind, seconds, payload, context = entry
+    ts = timestamp(seconds)
+    if kind == 'prediction':
+        features, verdict = payload
+        return [{'ts': ts, 'endpoint': '/predict', **context, 'features': features, **verdict}]
+
+    if kind == 'batch':
+        endpoint, X, scores, numbers, protocols = payload
+        head = {'ts': ts, 'endpoint': endpoint, **context}
+        if hasattr(protocols, 'tolist'):
+            protocols = protocols.tolist()
+        records = []
+        for i, row in enumerate(X.tolist()):
+            record = {**head, 'record': i if numbers is None else numbers[i], 'features': dict(zip(FEATURES, row))}
+            if protocols is not None:
+                record['protocol'] = protocols[i]
+            records.append({**record, **result_at(scores, i)})
+        return records
+
+    endpoint, analysis_id, filename, columns, offset = payload
+    head = {'ts': ts, 'endpoint': endpoint, **context, 'analysis_id': analysis_id, 'filename': filename}
+    return [{**head, **result} for result in results_from_columns(columns, offset)]
+
+
+def audit_mapping(record):
+    """AuditRecord column mapping of an audit record."""
+
+    protocol = record.get('protocol')
+    return {
+        'created_at': datetime.fromisoformat(record['ts']).replace(tzinfo=None),
+        'endpoint': record['endpoint'],
+        'user_id': record.get('user_id'),
+        'analysis_id': record.get('analysis_id'),
+        'record_index': record.get('record'),
+        'prediction': record['prediction'],
+        'confidence': record['confidence'],
+        'protocol': None if protocol in (None, 'N/A') else str(protocol),
+        'features': json.dumps(record['features']) if 'features' in record else None
+    }
@@ -0,0 +1,107 @@
+# -*- encoding: utf-8 -*-
+"""
+Micro-batching for /predict: concurrent single-flow requests are scored as one batch.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from apps.ids.scoring import result_at, row_from_features
+
+
+class MicroBatcher:
+    """Coalesces concurrent ``score_one`` calls into ``score_batch`` calls.
+
+    A background thread waits for the first queued flow, then keeps
+    collecting for up to max_latency_ms or until max_batch_size flows are
+    queued, scores them in one call and hands each caller its own result.
+    Only useful when a worker serves requests concurrently (threaded
+    server, gunicorn gthread workers).
+    """
+
+    def __init__(self, scorer, max_batch_size=64, max_latency_ms=5.0):
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.batches = 0
+        self.items = 0
+        self.max_queue_depth = 0
+
+    def ready(self):
+        return self.scorer.ready()
+
+    def score_one(self, features, protocol=None, timeout=None):
+        """Queue one flow (and its Protocol value, if known) and block until its batch has been scored."""
+
+        # Validate before queueing so one bad request cannot fail a whole batch
+        row = row_from_features(features)
+        future = Future()
+
+        self._ensure_worker()
+        self.queue.put((row, protocol, future))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+        return future.result(timeout)
+
+    def _ensure_worker(self):
+        # Started on first use, so it is never created in a gunicorn master before fork
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='predict-batcher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_latency
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._score(batch)
+
+    def _score(self, batch):
+        # Protocols are only passed when every flow of the batch has one, as for streams
+        protocols = [protocol for _, protocol, _ in batch]
+        if None in protocols:
+            protocols = None
+        try:
+            scores = self.scorer.score_batch(np.vstack([row for row, _, _ in batch]), protocols)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for i, (_, _, future) in enumerate(batch):
+            future.set_result(result_at(scores, i))
+
+        self.batches += 1
+        self.items += len(batch)
+
+    def metrics(self):
+        return {
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': (self.items / self.batches) if self.batches else 0.0,
+            'max_batch_size': self.max_batch_size,
+            'max_latency_ms': self.max_latency * 1000.0
+        }
@@ -0,0 +1,143 @@
+# -*- encoding: utf-8 -*-
+"""
+Near-real-time detection: packets -> flow table -> batches of completed flows -> ensemble.
+
+Run from the repository root; one JSON verdict per completed flow is printed:
+
+    python -m apps.ids.capture --pcap capture.pcap
+    python -m apps.ids.capture --tail /var/run/ids/live.pcap     # tcpdump -U -w live.pcap
+    python -m apps.ids.capture --interface eth0 --attacks-only   # needs CAP_NET_RAW
+
+Flows are scored as the app scores them: the scorer is built from the same
+settings (SCORING_PRECISION, SCORING_CASCADE, SCORING_ROUTING, ... see
+apps/config.py), read from the environment.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from apps.ids.flows import ACTIVE_TIMEOUT, IDLE_TIMEOUT, MAX_FLOWS, FlowBatch, FlowTable
+from apps.ids.packets import capture_interface, read_pcap
+from apps.ids.engine import build_scorer, config_settings
+from apps.ids.registry import BACKENDS
+from apps.ids.scoring import result_at
+
+# Completed flows scored per ensemble call
+DEFAULT_FLOW_BATCH = 256
+
+# Seconds a completed flow may wait for its batch to fill
+DEFAULT_MAX_LATENCY = 1.0
+
+
+class FlowDetector:
+    """Feeds a packet stream through a FlowTable and scores the completed flows in batches.
+
+    A batch is scored when it holds batch_size flows, when its oldest flow
+    has waited max_latency seconds (wall clock, checked on every packet and
+    source heartbeat) and when the stream ends. Packet sources yield None as
+    a heartbeat while idle; the table is then swept at the current time, so
+    live flows still time out without traffic.
+    """
+
+    def __init__(self, scorer, table=None, batch_size=DEFAULT_FLOW_BATCH, max_latency=DEFAULT_MAX_LATENCY):
+        self.scorer = scorer
+        self.table = table if table is not None else FlowTable()
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.pending = []
+        self.pending_flows = 0
+        self.pending_since = None
+
+        # Metrics
+        self.batches = 0
+        self.scored_flows = 0
+
+    def score_pending(self):
+        """Verdicts of the pending flows, as ``{**flow info, **result}`` dicts."""
+
+        if not self.pending:
+            return []
+        flows = FlowBatch.concat(self.pending)
+        self.pending, self.pending_flows, self.pending_since = [], 0, None
+        verdicts = []
+        for start in range(0, len(flows), self.batch_size):
+            stop = min(start + self.batch_size, len(flows))
+            scores = self.scorer.score_batch(flows.X[start:stop], flows.protocols[start:stop])
+            self.batches += 1
+            self.scored_flows += stop - start
+            verdicts += [{**flows.info_at(i), **result_at(scores, i - start)} for i in range(start, stop)]
+        return verdicts
+
+    def run(self, packets):
+        """Yield one verdict per completed flow of a packet stream."""
+
+        for packet in packets:
+            if packet is None:
+                done = self.table.expire(time.time())
+            else:
+                done = self.table.add(packet)
+
+            if done and not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending += done
+            self.pending_flows += sum(len(batch) for batch in done)
+            if self.pending and (self.pending_flows >= self.batch_size
+                                 or time.monotonic() - self.pending_since >= self.max_latency):
+                yield from self.score_pending()
+
+        yield from self.finish()
+
+    def finish(self):
+        """Verdicts of every flow still open or pending (end of the stream)."""
+        self.pending += self.table.flush()
+        return self.score_pending()
+
+    def metrics(self):
+        return {**self.table.metrics(), 'batches': self.batches, 'scored_flows': self.scored_flows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--pcap', help='pcap file read once')
+    source.add_argument('--tail', help='pcap file followed as it grows')
+    source.add_argument('--interface', help='network interface captured live')
+    parser.add_argument('--model-dir', default=os.getenv('MODEL_DIR', '.'))
+    parser.add_argument('--backend', default=os.getenv('MODEL_BACKEND', 'keras'), choices=BACKENDS)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_FLOW_BATCH)
+    parser.add_argument('--max-latency', type=float, default=DEFAULT_MAX_LATENCY)
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT)
+    parser.add_argument('--active-timeout', type=float, default=ACTIVE_TIMEOUT)
+    parser.add_argument('--max-flows', type=int, default=MAX_FLOWS)
+    parser.add_argument('--attacks-only', action='store_true', help='only print flows flagged as attacks')
+    args = parser.parse_args()
+
+    if args.pcap:
+        packets = read_pcap(args.pcap)
+    elif args.tail:
+        packets = read_pcap(args.tail, follow=True)
+    else:
+        packets = capture_interface(args.interface)
+
+    scorer = build_scorer(config_settings(MODEL_DIR=args.model_dir, MODEL_BACKEND=args.backend))
+    table = FlowTable(idle_timeout=args.idle_timeout, active_timeout=args.active_timeout,
+                      max_flows=args.max_flows)
+    detector = FlowDetector(scorer, table, batch_size=args.batch_size, max_latency=args.max_latency)
+
+    try:
+        for verdict in detector.run(packets):
+            if verdict['prediction'] or not args.attacks_only:
+                print(json.dumps(verdict), flush=True)
+    except KeyboardInterrupt:
+        for verdict in detector.finish():
+            if verdict['prediction'] or not args.attacks_only:
+                print(json.dumps(verdict), flush=True)
+    print(json.dumps({'stats': detector.metrics()}), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+# -*- encoding: utf-8 -*-
+"""
+Columnar cache of uploads: each distinct CSV is parsed once into a memory-mappable Arrow IPC file.
+"""
+
+import hashlib
+import os
+import uuid
+
+import numpy as np
+
+from apps.ids.schema import FEATURES, N_FEATURES
+
+
+def content_hash(path):
+    """SHA-256 of the file at path, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def files_under(root):
+    """Paths of the files under root (none if it does not exist)."""
+    return [os.path.join(dirpath, filename) for dirpath, _, filenames in os.walk(root) for filename in filenames]
+
+
+def enforce_disk_budget(paths, max_bytes, keep=()):
+    """Delete the least recently used of paths until they hold at most max_bytes.
+
+    Only the given files are considered, so anything else living next to
+    them (e.g. sample captures shipped with the repository) is never
+    deleted; neither are the files in keep (e.g. uploads still queued for
+    analysis). Returns the list of deleted paths.
+    """
+
+    if not max_bytes:
+        return []
+
+    keep = {os.path.abspath(path) for path in keep if path}
+    files = []
+    for path in set(os.path.abspath(path) for path in paths if path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    used = sum(size for _, size, _ in files)
+    freed = 0
+    deleted = []
+    for _, size, path in sorted(files):
+        if used - freed <= max_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+            freed += size
+            deleted.append(path)
+        except OSError:
+            pass
+    return deleted
+
+
+class ColumnarWriter:
+    """Appends chunks of one upload to a temporary IPC file, published on a clean exit."""
+
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+        self.tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        self.writer = None
+        self.schema = None
+
+    def write(self, X, protocols=None):
+        if self.schema is False:
+            # A chunk could not be converted: the upload is not cached
+            return
+        try:
+            batch = self.cache.record_batch(X, protocols, self.schema)
+        except (TypeError, ValueError, self.cache.pa.ArrowException):
+            # e.g. a Protocol column changing type between chunks
+            self.schema = False
+            return
+
+        if self.writer is None:
+            self.schema = batch.schema
+            self.writer = self.cache.pa.ipc.new_file(self.tmp_path, batch.schema)
+        self.writer.write_batch(batch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.writer is not None:
+            self.writer.close()
+        if exc_type is None and self.schema:
+            os.replace(self.tmp_path, self.path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        return False
+
+
+class ColumnarCache:
+    """Arrow IPC copies of uploaded CSVs, keyed by content hash.
+
+    Each file holds the schema-ordered feature matrix as a fixed-size list
+    column (``features``, row-major float32, exactly the values the CSV
+    parser produced) and the ``Protocol`` column when the CSV has one.
+    Reading maps the file and exposes every record batch as an ``(n, 70)``
+    NumPy view without copying. Requires pyarrow (optional dependency);
+    without it the cache is disabled and uploads are parsed every time.
+    """
+
+    dtype = np.float32
+
+    def __init__(self, root):
+        self.root = root
+        try:
+            import pyarrow
+            import pyarrow.ipc  # noqa: F401
+        except ImportError:
+            pyarrow = None
+        self.pa = pyarrow
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.pa is not None
+
+    def path_for(self, key):
+        return os.path.join(self.root, f'{key}.arrow')
+
+    def record_batch(self, X, protocols=None, schema=None):
+        pa = self.pa
+        values = pa.array(np.ascontiguousarray(X, dtype=self.dtype).ravel())
+        arrays = [pa.FixedSizeListArray.from_arrays(values, N_FEATURES)]
+        names = ['features']
+        if protocols is not None:
+            protocol_type = schema.field('Protocol').type if schema is not None else None
+            arrays.append(pa.array(protocols, type=protocol_type))
+            names.append('Protocol')
+
+        batch = pa.RecordBatch.from_arrays(arrays, names=names)
+        if schema is not None and not batch.schema.equals(schema):
+            raise ValueError('Chunk schema differs from the first chunk')
+        return batch.replace_schema_metadata({'features': ','.join(FEATURES)})
+
+    def open(self, key):
+        """Memory-mapped ``[(X, protocols), ...]`` record batches of a cached upload, or None."""
+
+        if not self.enabled:
+            return None
+        path = self.path_for(key)
+        try:
+            reader = self.pa.ipc.open_file(self.pa.memory_map(path, 'r'))
+        except (OSError, self.pa.ArrowInvalid):
+            self.misses += 1
+            return None
+
+        # Recently used entries are evicted last
+        os.utime(path)
+        self.hits += 1
+
+        batches = []
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            features = batch.column(0).flatten().to_numpy(zero_copy_only=True)
+            X = features.reshape(-1, N_FEATURES)
+            protocols = batch.column(1).to_pylist() if batch.num_columns > 1 else None
+            batches.append((X, protocols))
+        return batches
+
+    def writer(self, key):
+        """Context manager storing the chunks written to it under key."""
+        os.makedirs(self.root, exist_ok=True)
+        return ColumnarWriter(self, self.path_for(key))
+
+    def metrics(self):
+        return {'enabled': self.enabled, 'hits': self.hits, 'misses': self.misses}
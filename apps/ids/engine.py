@@ -0,0 +1,59 @@
+# -*- encoding: utf-8 -*-
+"""
+Scorer assembled from the IDS scoring settings of apps.config, for the app and the command-line tools.
+"""
+
+from apps.ids.pool import PoolScorer
+from apps.ids.registry import ModelRegistry
+from apps.ids.result_cache import ScoreCache
+from apps.ids.routing import RoutedScorer
+from apps.ids.scoring import SCORE_FIELDS, EnsembleScorer
+
+
+def config_settings(config_class=None, **overrides):
+    """The settings of a config class (apps.config.Config by default) as a mapping like app.config."""
+
+    if config_class is None:
+        from apps.config import Config as config_class
+    settings = {name: getattr(config_class, name) for name in dir(config_class) if name.isupper()}
+    settings.update(overrides)
+    return settings
+
+
+def build_scorer(config, registry=None):
+    """The scorer the app serves with config (app.config or config_settings()).
+
+    Precision, chunk size, dedup, score cache, cascade and routing follow
+    the SCORING_* settings; with SCORING_WORKERS the scorer is a PoolScorer.
+    registry defaults to a new ModelRegistry on MODEL_DIR / MODEL_BACKEND.
+    """
+
+    if registry is None:
+        registry = ModelRegistry(config['MODEL_DIR'], backend=config['MODEL_BACKEND'])
+
+    # Scores per flow vector, shared by every batch of the process (optional)
+    score_cache = None
+    if config['SCORE_CACHE_ENTRIES']:
+        score_cache = ScoreCache(registry, SCORE_FIELDS, max_entries=config['SCORE_CACHE_ENTRIES'])
+
+    options = dict(chunk_size=config['SCORING_CHUNK_SIZE'],
+                   dedup=config['SCORING_DEDUP'], cache=score_cache,
+                   cascade=config['SCORING_CASCADE'],
+                   cascade_order=config['CASCADE_ORDER'],
+                   dtype=config['SCORING_PRECISION'])
+
+    scorer_class = EnsembleScorer
+    if config['SCORING_ROUTING']:
+        # iso_forest prefilter, then the web / non-web specialist LightGBM models
+        scorer_class = RoutedScorer
+        options.update(web_ports=config['ROUTING_WEB_PORTS'],
+                       prefilter_threshold=(config['ISO_FOREST_THRESHOLD']
+                                            if config['ISO_FOREST_PREFILTER'] else None))
+
+    if config['SCORING_WORKERS']:
+        # Large batches split into shards scored in parallel by a process pool
+        return PoolScorer(registry, scorer_class, options,
+                          workers=config['SCORING_WORKERS'],
+                          shard_rows=config['SCORING_SHARD_ROWS'],
+                          threads=config['SCORING_WORKER_THREADS'])
+    return scorer_class(registry, **options)
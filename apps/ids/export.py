@@ -0,0 +1,139 @@
+# -*- encoding: utf-8 -*-
+"""
+Export the Keras DNN/CNN to TFLite for the ``tflite`` serving backends, with a parity check.
+
+Run from the repository root (needs TensorFlow, unlike the serving side):
+
+    python -m apps.ids.export --reference uploads/sample_ddos_test.csv
+    python -m apps.ids.export --reference uploads/sample_ddos_test.csv --quantize int8
+
+Each model is written next to its .h5 (ids_dnn_model.tflite, or
+ids_dnn_model.int8.tflite when quantized) only if its outputs on the
+reference batch match Keras within --tolerance. Serve the exported models
+with MODEL_BACKEND=tflite (or tflite_int8).
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from apps.ids.registry import BACKENDS, KERAS_MODELS, ModelRegistry, stem
+from apps.ids.scoring import reshape_cnn
+from apps.ids.tflite import TFLiteModel
+
+# Batch sizes timed in the report: a single /predict flow and a scoring chunk
+TIMED_BATCHES = (1, 1024)
+
+# Default --tolerance: float32 conversion only rounds, int8 quantization is coarser
+DEFAULT_TOLERANCE = {None: 1e-4, 'int8': 5e-2}
+
+
+def reference_batch(registry, reference=None, rows=1024, seed=42):
+    """Scaled reference rows: the reference CSV (if any) plus uniform rows over the scaler's range."""
+
+    scaler = registry.get('scaler')
+    parts = []
+    if reference:
+        from apps.ids.ingest import load_features
+        X, _ = load_features(reference)
+        parts.append(scaler.transform(np.asarray(X, dtype=np.float64)))
+    rng = np.random.default_rng(seed)
+    parts.append(rng.uniform(0.0, 1.0, size=(rows, scaler.n_features_in_)))
+    return np.vstack(parts)
+
+
+def model_input(name, X_scaled):
+    return reshape_cnn(X_scaled) if name == 'cnn' else X_scaled
+
+
+def time_calls(model, x, repeat=20):
+    """Mean seconds per predict_on_batch call."""
+    model.predict_on_batch(x)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        model.predict_on_batch(x)
+    return (time.perf_counter() - start) / repeat
+
+
+def export_model(registry, name, X_scaled, tolerance, quantize=None):
+    """Convert one Keras model, check parity and write the .tflite file.
+
+    With quantize='int8', the weights are stored as int8 (dynamic-range
+    quantization: activations, inputs and outputs stay float32, so the
+    serving side is unchanged). Returns ``(passed, report)``.
+    """
+
+    import tensorflow as tf
+
+    keras_model = registry.get(name)
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantize == 'int8':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    content = converter.convert()
+
+    backend = 'tflite_int8' if quantize == 'int8' else 'tflite'
+    target = os.path.join(os.path.dirname(registry.paths[name]), stem(registry.paths[name]) + BACKENDS[backend])
+    tmp_path = target + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+
+    try:
+        lite_model = TFLiteModel(tmp_path)
+        x = model_input(name, X_scaled).astype(np.float32)
+        expected = np.asarray(keras_model.predict_on_batch(x))
+        got = lite_model.predict_on_batch(x)
+
+        # [:, 0] is the score the ensemble uses; argmax is the model's own class
+        max_diff = float(np.abs(expected[:, 0] - got[:, 0]).max())
+        class_agreement = float((expected.argmax(axis=1) == got.argmax(axis=1)).mean())
+        timings = {
+            batch: (time_calls(keras_model, x[:batch]), time_calls(lite_model, x[:batch]))
+            for batch in TIMED_BATCHES
+        }
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    passed = max_diff <= tolerance
+    if passed:
+        os.replace(tmp_path, target)
+    else:
+        os.remove(tmp_path)
+
+    lines = [f"{name}: {os.path.basename(target) if passed else 'NOT WRITTEN'} ({len(content) / 2**20:.2f} MB), "
+             f"max |score diff| = {max_diff:.2e} (tolerance {tolerance:.0e}), class agreement = {class_agreement:.4%}"]
+    for batch, (keras_seconds, lite_seconds) in timings.items():
+        lines.append(f"  batch {batch:>5}: keras {keras_seconds * 1000:8.2f} ms  tflite {lite_seconds * 1000:8.2f} ms  "
+                     f"({keras_seconds / lite_seconds:.1f}x)")
+    return passed, '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--model-dir', default=os.getenv('MODEL_DIR', '.'))
+    parser.add_argument('--models', nargs='+', default=list(KERAS_MODELS), choices=KERAS_MODELS)
+    parser.add_argument('--reference', help='CSV whose rows are added to the reference batch')
+    parser.add_argument('--rows', type=int, default=1024, help='random reference rows')
+    parser.add_argument('--quantize', choices=['int8'], help='store the weights as int8')
+    parser.add_argument('--tolerance', type=float, help='maximum |score difference| accepted '
+                                                        '(default 1e-4, 5e-2 with --quantize int8)')
+    args = parser.parse_args()
+    tolerance = args.tolerance if args.tolerance is not None else DEFAULT_TOLERANCE[args.quantize]
+
+    registry = ModelRegistry(args.model_dir, backend='keras')
+    X_scaled = reference_batch(registry, args.reference, args.rows)
+    print(f"Reference batch: {len(X_scaled)} rows")
+
+    ok = True
+    for name in args.models:
+        passed, report = export_model(registry, name, X_scaled, tolerance, args.quantize)
+        print(report)
+        ok &= passed
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,467 @@
+# -*- encoding: utf-8 -*-
+"""
+Flow assembler: bidirectional flows with running statistics, turned into the 70 CICIDS2017 features.
+"""
+
+import socket
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from apps.ids.packets import ACK, CWR, ECE, FIN, PSH, RST, SYN, URG
+from apps.ids.schema import FEATURE_INDEX, N_FEATURES
+
+# Seconds without packets after which a flow is complete (CICFlowMeter's flow timeout is 120 s)
+IDLE_TIMEOUT = 60.0
+
+# Seconds after which a long flow is cut, its next packets starting a new flow
+ACTIVE_TIMEOUT = 120.0
+
+# Seconds a TCP flow is kept after both FINs, for the last ACKs
+CLOSE_TIMEOUT = 1.0
+
+# Packet-time seconds between two sweeps of the table for expired flows
+SWEEP_INTERVAL = 1.0
+
+# Flow slots preallocated by a table (about 0.5 KB each); when they are all
+# in use the least recently active flows are completed early
+MAX_FLOWS = 100000
+
+# Share of the slots completed at once when the table is full (a SYN flood
+# evicts in batches instead of on every new flow)
+EVICT_FRACTION = 1 / 64
+
+# Buffered packets are folded into the flow arrays every COMMIT_ROWS packets
+# or COMMIT_INTERVAL wall-clock seconds, whichever comes first
+COMMIT_ROWS = 4096
+COMMIT_INTERVAL = 0.1
+
+FLAG_FEATURES = ((FIN, 'FIN Flag Count'), (SYN, 'SYN Flag Count'), (RST, 'RST Flag Count'),
+                 (PSH, 'PSH Flag Count'), (ACK, 'ACK Flag Count'), (URG, 'URG Flag Count'),
+                 (CWR, 'CWE Flag Count'), (ECE, 'ECE Flag Count'))
+
+# Running statistics kept per flow: payload lengths (both directions, forward,
+# backward) and inter-arrival times (same split, in seconds)
+LENGTHS, FWD_LENGTHS, BWD_LENGTHS, IATS, FWD_IATS, BWD_IATS = range(6)
+
+# Columns of the packet buffer
+P_SLOT, P_FORWARD, P_TS, P_PAYLOAD, P_HEADER, P_FLAGS, P_WINDOW = range(7)
+
+NO_SEGMENT = np.iinfo(np.int32).max
+
+ADDRESS_SIZE = {socket.AF_INET: 4, socket.AF_INET6: 16}
+
+
+def unpack_address(family, address):
+    """Text form of an address stored as 16 bytes."""
+    return socket.inet_ntop(family, address[:ADDRESS_SIZE[family]].tobytes())
+
+
+def merge_stats(store, group, slots, values):
+    """Fold values (one per slot occurrence) into the running statistics of a stats group.
+
+    Per-slot count, mean and sum of squared deviations of the new values are
+    merged with the stored ones (Chan et al.'s parallel form of Welford's
+    algorithm); min and max are updated in place.
+    """
+
+    if not len(slots):
+        return
+    uniq, inverse = np.unique(slots, return_inverse=True)
+    count = np.bincount(inverse)
+    total = np.bincount(inverse, values)
+    mean = total / count
+    m2 = np.bincount(inverse, (values - mean[inverse]) ** 2)
+
+    n_old, mean_old = store.n[uniq, group], store.mean[uniq, group]
+    n_new = n_old + count
+    delta = mean - mean_old
+    store.mean[uniq, group] = mean_old + delta * count / n_new
+    store.m2[uniq, group] += m2 + delta ** 2 * n_old * count / n_new
+    store.n[uniq, group] = n_new
+    store.total[uniq, group] += total
+    np.minimum.at(store.min[:, group], slots, values)
+    np.maximum.at(store.max[:, group], slots, values)
+
+
+class FlowBatch:
+    """Completed flows: their ``(n, 70)`` feature matrix, IP protocols and identification columns."""
+
+    __slots__ = ('X', 'protocols', 'info')
+
+    def __init__(self, X, protocols, info):
+        self.X = X
+        self.protocols = protocols
+        self.info = info
+
+    def __len__(self):
+        return len(self.X)
+
+    def info_at(self, i):
+        """Identification of flow i, reported next to its verdict."""
+        return {name: values[i] for name, values in self.info.items()}
+
+    @classmethod
+    def concat(cls, batches):
+        return cls(np.concatenate([batch.X for batch in batches]),
+                   np.concatenate([batch.protocols for batch in batches]),
+                   {name: [value for batch in batches for value in batch.info[name]]
+                    for name in batches[0].info})
+
+
+class FlowTable:
+    """Open flows in preallocated struct-of-arrays storage, indexed by 5-tuple hash.
+
+    ``add``, ``expire`` and ``flush`` return the flows they complete, as a
+    list of FlowBatch. A flow completes after idle_timeout seconds without
+    packets, after a RST, CLOSE_TIMEOUT seconds after FINs from both sides,
+    or when all max_flows slots are in use and it is among the least
+    recently active ones. A flow older than active_timeout is completed and
+    its next packet starts a new flow.
+
+    Per packet, only the flow lookup, the timeout / teardown decisions and
+    a row of the packet buffer are done in Python. Buffered packets are
+    folded into the per-flow running statistics (lengths, IATs, flags,
+    header sums...) with vectorized NumPy, and completed flows are turned
+    into features the same way. Memory is fixed by max_flows: the arrays,
+    an index of at most max_flows entries and a packet buffer of at most
+    COMMIT_ROWS rows. Flows are keyed by the 64-bit hash of their 5-tuple;
+    two flows whose 5-tuples collide are merged.
+    """
+
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, active_timeout=ACTIVE_TIMEOUT, max_flows=MAX_FLOWS):
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        size = max_flows
+
+        # Flow identity and the state the per-packet decisions need
+        self.keys = np.zeros(size, dtype=np.int64)
+        self.proto = np.zeros(size, dtype=np.uint8)
+        self.family = np.zeros(size, dtype=np.uint8)
+        self.src = np.zeros((size, 16), dtype=np.uint8)   # packed addresses, IPv4 in the first 4 bytes
+        self.dst = np.zeros((size, 16), dtype=np.uint8)
+        self.sport = np.zeros(size, dtype=np.uint16)
+        self.dport = np.zeros(size, dtype=np.uint16)
+        self.forward_lower = np.zeros(size, dtype=bool)  # forward endpoint sorts first in the key
+        self.start = np.zeros(size)
+        self.seen = np.zeros(size)                       # last packet, including buffered ones
+        self.fin_fwd = np.zeros(size, dtype=bool)
+        self.fin_bwd = np.zeros(size, dtype=bool)
+
+        # Running statistics, one column per stats group
+        self.n = np.zeros((size, 6), dtype=np.int64)
+        self.total = np.zeros((size, 6))
+        self.mean = np.zeros((size, 6))
+        self.m2 = np.zeros((size, 6))
+        self.min = np.zeros((size, 6))
+        self.max = np.zeros((size, 6))
+        self.last = np.zeros((size, 3))                  # last folded packet: any, forward, backward
+
+        # Counters
+        self.flags = np.zeros((size, len(FLAG_FEATURES)), dtype=np.int64)
+        self.fwd_psh = np.zeros(size, dtype=np.int64)
+        self.bwd_psh = np.zeros(size, dtype=np.int64)
+        self.fwd_urg = np.zeros(size, dtype=np.int64)
+        self.bwd_urg = np.zeros(size, dtype=np.int64)
+        self.fwd_header = np.zeros(size, dtype=np.int64)
+        self.bwd_header = np.zeros(size, dtype=np.int64)
+        self.act_data_fwd = np.zeros(size, dtype=np.int64)
+        self.min_seg_fwd = np.zeros(size, dtype=np.int32)
+        self.init_win_fwd = np.zeros(size, dtype=np.int32)
+        self.init_win_bwd = np.zeros(size, dtype=np.int32)
+
+        self.index = OrderedDict()                       # key -> slot, least recently active first
+        self.free = list(range(size - 1, -1, -1))
+        self.created = []                                # slots opened since the last commit
+        self.completing = []                             # slots to finalise at the next commit
+        self.buffer = []
+        self.buffer_since = None
+        self.ready = []
+        self.last_sweep = None
+
+        # Metrics
+        self.packets = 0
+        self.completed = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def nbytes(self):
+        return sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
+
+    def add(self, packet):
+        self.packets += 1
+        ts = packet.ts
+        if self.last_sweep is None:
+            self.last_sweep = ts
+        elif ts - self.last_sweep >= SWEEP_INTERVAL:
+            self.expire(ts, collect=False)
+
+        a, b = (packet.src, packet.sport), (packet.dst, packet.dport)
+        lower = a <= b
+        key = hash((packet.proto, a, b) if lower else (packet.proto, b, a))
+        slot = self.index.get(key)
+        if slot is not None:
+            if ts - self.seen[slot] > self.idle_timeout or ts - self.start[slot] > self.active_timeout:
+                self.complete(key)
+                slot = None
+            else:
+                self.index.move_to_end(key)
+        if slot is None:
+            slot = self.open(key, packet, lower)
+
+        forward = lower == self.forward_lower[slot] or a == b
+        self.seen[slot] = ts
+        if packet.flags & FIN:
+            (self.fin_fwd if forward else self.fin_bwd)[slot] = True
+        if not self.buffer:
+            self.buffer_since = time.monotonic()
+        self.buffer.append((slot, forward, ts, packet.payload, packet.header, packet.flags, packet.window))
+
+        if packet.flags & RST:
+            self.complete(key)
+        if len(self.buffer) >= COMMIT_ROWS or time.monotonic() - self.buffer_since >= COMMIT_INTERVAL:
+            self.commit()
+        return self.take_ready()
+
+    def open(self, key, packet, lower):
+        """Allocate a slot for a new flow, evicting the least recently active flows if none is free."""
+
+        if not self.free:
+            for _ in range(min(len(self.index), max(1, int(self.max_flows * EVICT_FRACTION)))):
+                self.completing.append(self.index.popitem(last=False)[1])
+                self.evicted += 1
+            # Completed slots are only reused once their buffered packets are folded in
+            self.commit()
+
+        slot = self.free.pop()
+        family = socket.AF_INET6 if ':' in packet.src else socket.AF_INET
+        self.keys[slot] = key
+        self.proto[slot] = packet.proto
+        self.family[slot] = family
+        self.src[slot, :ADDRESS_SIZE[family]] = np.frombuffer(socket.inet_pton(family, packet.src), dtype=np.uint8)
+        self.dst[slot, :ADDRESS_SIZE[family]] = np.frombuffer(socket.inet_pton(family, packet.dst), dtype=np.uint8)
+        self.sport[slot], self.dport[slot] = packet.sport, packet.dport
+        self.forward_lower[slot] = lower
+        self.start[slot] = packet.ts
+        self.fin_fwd[slot] = self.fin_bwd[slot] = False
+        self.created.append(slot)
+        self.index[key] = slot
+        return slot
+
+    def complete(self, key):
+        self.completing.append(self.index.pop(key))
+
+    def reset(self, slots):
+        """Initial statistics and counters of newly opened slots."""
+
+        for values in (self.n, self.total, self.mean, self.m2, self.flags, self.fwd_psh, self.bwd_psh,
+                       self.fwd_urg, self.bwd_urg, self.fwd_header, self.bwd_header, self.act_data_fwd):
+            values[slots] = 0
+        self.min[slots] = np.inf
+        self.max[slots] = -np.inf
+        self.last[slots] = np.nan
+        self.min_seg_fwd[slots] = NO_SEGMENT
+        self.init_win_fwd[slots] = self.init_win_bwd[slots] = -1
+
+    def commit(self):
+        """Fold the buffered packets into the flow arrays, then finalise the completed flows."""
+
+        if self.created:
+            self.reset(np.array(self.created))
+            self.created = []
+        if self.buffer:
+            self.fold(np.array(self.buffer, dtype=np.float64))
+            self.buffer = []
+        if self.completing:
+            slots = np.array(self.completing)
+            self.completing = []
+            self.ready.append(self.finalise(slots))
+            self.free.extend(slots.tolist())
+            self.completed += len(slots)
+
+    def fold(self, packets):
+        slot = packets[:, P_SLOT].astype(np.int64)
+        forward = packets[:, P_FORWARD].astype(bool)
+        ts = packets[:, P_TS]
+        payload = packets[:, P_PAYLOAD]
+        header = packets[:, P_HEADER].astype(np.int64)
+        flags = packets[:, P_FLAGS].astype(np.int64)
+        window = packets[:, P_WINDOW].astype(np.int32)
+        backward = ~forward
+
+        # Packets of a slot in arrival order: stable sort on the slot
+        order = np.argsort(slot, kind='stable')
+        for group, iat_group, mask in ((LENGTHS, IATS, None), (FWD_LENGTHS, FWD_IATS, forward),
+                                       (BWD_LENGTHS, BWD_IATS, backward)):
+            rows = order if mask is None else order[mask[order]]
+            slots, times = slot[rows], ts[rows]
+            merge_stats(self, group, slots, payload[rows])
+
+            if not len(rows):
+                continue
+            first = np.ones(len(rows), dtype=bool)
+            first[1:] = slots[1:] != slots[:-1]
+            previous = np.empty(len(rows))
+            previous[1:] = times[:-1]
+            last = iat_group - IATS
+            previous[first] = self.last[slots[first], last]
+            iats = times - previous
+            valid = ~np.isnan(iats)
+            merge_stats(self, iat_group, slots[valid], iats[valid])
+
+            final = np.ones(len(rows), dtype=bool)
+            final[:-1] = first[1:]
+            self.last[slots[final], last] = times[final]
+
+            # Window of the direction's first packet (-1 outside TCP)
+            if mask is not None:
+                init_win = self.init_win_fwd if mask is forward else self.init_win_bwd
+                unset = init_win[slots[first]] < 0
+                init_win[slots[first][unset]] = window[rows[first][unset]]
+
+        for bit, (flag, _) in enumerate(FLAG_FEATURES):
+            np.add.at(self.flags[:, bit], slot, (flags & flag) > 0)
+        np.add.at(self.fwd_psh, slot[forward], (flags[forward] & PSH) > 0)
+        np.add.at(self.bwd_psh, slot[backward], (flags[backward] & PSH) > 0)
+        np.add.at(self.fwd_urg, slot[forward], (flags[forward] & URG) > 0)
+        np.add.at(self.bwd_urg, slot[backward], (flags[backward] & URG) > 0)
+        np.add.at(self.fwd_header, slot[forward], header[forward])
+        np.add.at(self.bwd_header, slot[backward], header[backward])
+        np.add.at(self.act_data_fwd, slot[forward], payload[forward] > 0)
+        np.minimum.at(self.min_seg_fwd, slot[forward], header[forward].astype(np.int32))
+
+    def finalise(self, slots):
+        """FlowBatch of the given slots (durations and IATs in microseconds)."""
+
+        n = self.n[slots]
+        mean = self.mean[slots]
+        variance = np.divide(self.m2[slots], n - 1, out=np.zeros(n.shape), where=n > 1)
+        std = np.sqrt(variance)
+        low = np.where(n > 0, self.min[slots], 0.0)
+        high = np.where(n > 0, self.max[slots], 0.0)
+        total = self.total[slots]
+
+        duration = self.last[slots, 0] - self.start[slots]
+        packets = n[:, LENGTHS]
+        bytes_total = total[:, LENGTHS]
+
+        def per_second(count):
+            return np.divide(count, duration, out=np.zeros(len(slots)), where=duration > 0)
+
+        fwd_header = self.fwd_header[slots]
+        us = 1e6
+
+        columns = {
+            'Destination Port': self.dport[slots],
+            'Flow Duration': duration * us,
+            'Total Fwd Packets': n[:, FWD_LENGTHS],
+            'Total Backward Packets': n[:, BWD_LENGTHS],
+            'Total Length of Fwd Packets': total[:, FWD_LENGTHS],
+            'Total Length of Bwd Packets': total[:, BWD_LENGTHS],
+            'Fwd Packet Length Max': high[:, FWD_LENGTHS],
+            'Fwd Packet Length Min': low[:, FWD_LENGTHS],
+            'Fwd Packet Length Mean': mean[:, FWD_LENGTHS],
+            'Fwd Packet Length Std': std[:, FWD_LENGTHS],
+            'Bwd Packet Length Max': high[:, BWD_LENGTHS],
+            'Bwd Packet Length Min': low[:, BWD_LENGTHS],
+            'Bwd Packet Length Mean': mean[:, BWD_LENGTHS],
+            'Bwd Packet Length Std': std[:, BWD_LENGTHS],
+            'Flow Bytes/s': per_second(bytes_total),
+            'Flow Packets/s': per_second(packets),
+            'Flow IAT Mean': mean[:, IATS] * us,
+            'Flow IAT Std': std[:, IATS] * us,
+            'Flow IAT Max': high[:, IATS] * us,
+            'Flow IAT Min': low[:, IATS] * us,
+            'Fwd IAT Total': total[:, FWD_IATS] * us,
+            'Fwd IAT Mean': mean[:, FWD_IATS] * us,
+            'Fwd IAT Std': std[:, FWD_IATS] * us,
+            'Fwd IAT Max': high[:, FWD_IATS] * us,
+            'Fwd IAT Min': low[:, FWD_IATS] * us,
+            'Bwd IAT Total': total[:, BWD_IATS] * us,
+            'Bwd IAT Mean': mean[:, BWD_IATS] * us,
+            'Bwd IAT Std': std[:, BWD_IATS] * us,
+            'Bwd IAT Max': high[:, BWD_IATS] * us,
+            'Bwd IAT Min': low[:, BWD_IATS] * us,
+            'Fwd PSH Flags': self.fwd_psh[slots],
+            'Bwd PSH Flags': self.bwd_psh[slots],
+            'Fwd URG Flags': self.fwd_urg[slots],
+            'Bwd URG Flags': self.bwd_urg[slots],
+            'Fwd Header Length': fwd_header,
+            'Bwd Header Length': self.bwd_header[slots],
+            'Fwd Packets/s': per_second(n[:, FWD_LENGTHS]),
+            'Bwd Packets/s': per_second(n[:, BWD_LENGTHS]),
+            'Min Packet Length': low[:, LENGTHS],
+            'Max Packet Length': high[:, LENGTHS],
+            'Packet Length Mean': mean[:, LENGTHS],
+            'Packet Length Std': std[:, LENGTHS],
+            'Packet Length Variance': variance[:, LENGTHS],
+            'Down/Up Ratio': np.floor_divide(n[:, BWD_LENGTHS], np.maximum(n[:, FWD_LENGTHS], 1)),
+            'Average Packet Size': np.divide(bytes_total, packets, out=np.zeros(len(slots)), where=packets > 0),
+            'Avg Fwd Segment Size': mean[:, FWD_LENGTHS],
+            'Avg Bwd Segment Size': mean[:, BWD_LENGTHS],
+            'Fwd Header Length.1': fwd_header,
+            # A flow is one subflow; bulk transfer features are left at 0
+            'Subflow Fwd Packets': n[:, FWD_LENGTHS],
+            'Subflow Fwd Bytes': total[:, FWD_LENGTHS],
+            'Subflow Bwd Packets': n[:, BWD_LENGTHS],
+            'Subflow Bwd Bytes': total[:, BWD_LENGTHS],
+            'Init_Win_bytes_forward': self.init_win_fwd[slots],
+            'Init_Win_bytes_backward': self.init_win_bwd[slots],
+            'act_data_pkt_fwd': self.act_data_fwd[slots],
+            'min_seg_size_forward': np.where(self.min_seg_fwd[slots] == NO_SEGMENT, 0, self.min_seg_fwd[slots]),
+        }
+        for bit, (_, feature) in enumerate(FLAG_FEATURES):
+            columns[feature] = self.flags[slots, bit]
+
+        X = np.zeros((len(slots), N_FEATURES))
+        for feature, values in columns.items():
+            X[:, FEATURE_INDEX[feature]] = values
+
+        family = self.family[slots].tolist()
+        info = {
+            'src': [unpack_address(f, address) for f, address in zip(family, self.src[slots])],
+            'dst': [unpack_address(f, address) for f, address in zip(family, self.dst[slots])],
+            'sport': self.sport[slots].tolist(),
+            'dport': self.dport[slots].tolist(),
+            'protocol': self.proto[slots].tolist(),
+            'start': self.start[slots].tolist(),
+            'duration': duration.tolist(),
+            'packets': packets.tolist(),
+        }
+        return FlowBatch(X, self.proto[slots].astype(np.int64), info)
+
+    def take_ready(self):
+        ready, self.ready = self.ready, []
+        return ready
+
+    def expire(self, now, collect=True):
+        """Complete the flows that timed out by time now."""
+
+        self.last_sweep = now
+        used = np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+        if len(used):
+            idle = now - self.seen[used]
+            closed = self.fin_fwd[used] & self.fin_bwd[used]
+            expired = used[(idle > np.where(closed, CLOSE_TIMEOUT, self.idle_timeout))
+                           | (now - self.start[used] > self.active_timeout)]
+            for slot in expired.tolist():
+                self.complete(int(self.keys[slot]))
+        if self.completing:
+            self.commit()
+        return self.take_ready() if collect else []
+
+    def flush(self):
+        """Complete every open flow (end of the capture)."""
+
+        self.completing.extend(self.index.values())
+        self.index.clear()
+        self.commit()
+        return self.take_ready()
+
+    def metrics(self):
+        return {'open_flows': len(self.index), 'capacity': self.max_flows, 'table_mb': self.nbytes() / 2**20,
+                'packets': self.packets, 'completed_flows': self.completed, 'evicted_flows': self.evicted}
@@ -0,0 +1,253 @@
+# -*- encoding: utf-8 -*-
+"""
+Chunked CSV ingestion: score uploads in bounded memory and emit results incrementally.
+"""
+
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from apps.ids.columnar import content_hash
+from apps.ids.schema import FEATURE_INDEX, N_FEATURES, get_mapper
+from apps.ids.scoring import dedup_ratio, early_exit_ratio
+
+# Rows read from the CSV per chunk
+DEFAULT_CSV_CHUNK_ROWS = 50000
+
+# Feature columns are parsed straight to this dtype (half the memory of float64)
+CSV_FEATURE_DTYPE = np.float32
+
+
+
+def fastest_engine(path):
+    """pandas' pyarrow CSV engine (multithreaded) when it can read the CSV at path, else the C engine.
+
+    The pyarrow engine needs pyarrow installed and cannot tell apart
+    duplicated header names, which the C engine renames ('Fwd Header Length.1').
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return 'c'
+
+    with open(path, newline='', encoding='utf-8', errors='replace') as f:
+        header = next(csv.reader(f), [])
+    return 'pyarrow' if len(set(header)) == len(header) else 'c'
+
+
+def csv_read_options(path, dtype=CSV_FEATURE_DTYPE):
+    """read_csv arguments loading only the columns the analysis uses from the CSV at path.
+
+    The header is read first and mapped once (get_mapper); labels, indexes and
+    unknown columns are never parsed, and feature columns get a fixed dtype
+    instead of being inferred. Both engines parse 'inf' / 'Infinity' (common
+    in 'Flow Bytes/s') straight to floats, so no na_values lookup is needed;
+    SchemaMapper.transform zeroes them with the missing values.
+    """
+
+    header = pd.read_csv(path, nrows=0).columns
+    mapper = get_mapper(header)
+    features = set(mapper.positions[mapper.present].tolist())
+    # Protocol keeps its inferred (integer) type, it is reported as is
+    features.discard(mapper.protocol_position)
+
+    return {
+        'usecols': [header[pos] for pos in mapper.usecols],
+        'dtype': {header[pos]: dtype for pos in sorted(features)},
+    }
+
+
+def read_csv_features(path, dtype=CSV_FEATURE_DTYPE):
+    """Read the model's columns of the CSV at path in one go, with the fastest engine."""
+    return pd.read_csv(path, engine=fastest_engine(path), **csv_read_options(path, dtype))
+
+
+def iter_csv_chunks(path, chunk_rows=DEFAULT_CSV_CHUNK_ROWS, dtype=CSV_FEATURE_DTYPE):
+    """Yield the model's columns of the CSV at path as DataFrames of at most chunk_rows rows."""
+    # The pyarrow engine cannot read in chunks
+    with pd.read_csv(path, chunksize=chunk_rows, engine='c', memory_map=True,
+                     **csv_read_options(path, dtype)) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def count_csv_rows(path):
+    """Count the data rows of the CSV at path without parsing it (used for progress)."""
+
+    newlines = 0
+    last_byte = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            newlines += block.count(b'\n')
+            last_byte = block[-1:]
+
+    # Minus the header line, plus a last line without trailing newline
+    rows = newlines - 1 + (last_byte != b'\n')
+    return max(rows, 0)
+
+
+def parse_feature_chunks(path, chunk_rows=None, dtype=np.float64, csv_dtype=CSV_FEATURE_DTYPE):
+    """Yield ``(X, protocols)`` parsed from the CSV at path, in one piece when chunk_rows is None.
+
+    Feature columns are parsed to csv_dtype, then X is built in dtype.
+    """
+
+    if chunk_rows:
+        frames = iter_csv_chunks(path, chunk_rows, csv_dtype)
+    else:
+        frames = [read_csv_features(path, csv_dtype)]
+    for frame in frames:
+        mapper = get_mapper(frame.columns)
+        yield mapper.transform(frame, dtype), mapper.protocols(frame)
+
+
+def iter_feature_chunks(path, chunk_rows=None, cache=None, key=None, dtype=np.float64,
+                        csv_dtype=CSV_FEATURE_DTYPE):
+    """Yield ``(X, protocols)`` for the CSV at path, at most chunk_rows rows at a time.
+
+    With a ColumnarCache, an upload seen before is read from its memory-mapped
+    copy instead of being parsed again (X is then a read-only float32 view);
+    a new one is converted while it is parsed. key is the upload's
+    content_hash, when the caller already has it; dtype the precision of
+    the parsed matrices and csv_dtype that of the CSV parser (the cached
+    copies hold float32 values, so a wider csv_dtype bypasses the cache).
+    """
+
+    if cache is None or not cache.enabled or np.dtype(csv_dtype) != cache.dtype:
+        yield from parse_feature_chunks(path, chunk_rows, dtype, csv_dtype)
+        return
+
+    key = key or content_hash(path)
+    batches = cache.open(key)
+    if batches is None:
+        with cache.writer(key) as writer:
+            for X, protocols in parse_feature_chunks(path, chunk_rows, dtype, csv_dtype):
+                writer.write(X, protocols)
+                yield X, protocols
+        return
+
+    for X, protocols in batches:
+        step = chunk_rows or max(len(X), 1)
+        for start in range(0, len(X), step):
+            yield X[start:start + step], (protocols[start:start + step] if protocols is not None else None)
+
+
+def load_features(path, cache=None, key=None, dtype=np.float64, csv_dtype=CSV_FEATURE_DTYPE):
+    """Whole feature matrix and protocols of the CSV at path (see iter_feature_chunks)."""
+
+    chunks = list(iter_feature_chunks(path, cache=cache, key=key, dtype=dtype, csv_dtype=csv_dtype))
+    if len(chunks) == 1:
+        return chunks[0]
+    if not chunks:
+        return np.zeros((0, N_FEATURES), dtype=dtype), None
+
+    X = np.concatenate([X for X, _ in chunks])
+    protocols = None if chunks[0][1] is None else [p for _, chunk in chunks for p in chunk]
+    return X, protocols
+
+
+def analyze_chunks(path, scorer, chunk_rows=DEFAULT_CSV_CHUNK_ROWS, cache=None):
+    """Score the CSV at path chunk by chunk.
+
+    Yields ``(X, scores, protocols, offset)`` where X is the schema-ordered
+    feature matrix of the chunk and offset the index of its first row within
+    the file.
+    """
+
+    offset = 0
+    for X, protocols in iter_feature_chunks(path, chunk_rows, cache, dtype=scorer.dtype):
+        scores = scorer.score_batch(X, protocols)
+        yield X, scores, protocols, offset
+        offset += len(X)
+
+
+def result_columns(X, scores, protocols=None):
+    """The values reported per row by /analyze_csv, as arrays (compact enough to cache)."""
+    # X may be a float32 view of a cached upload: sum in float64 like a parsed chunk
+    return {
+        'prediction': scores['prediction'],
+        'confidence': scores['confidence'],
+        'protocol': protocols,
+        'flow_duration': X[:, FEATURE_INDEX['Flow Duration']].astype(np.float64),
+        'total_packets': (X[:, FEATURE_INDEX['Total Fwd Packets']].astype(np.float64)
+                          + X[:, FEATURE_INDEX['Total Backward Packets']])
+    }
+
+
+def build_results(X, scores, protocols=None, offset=0):
+    """Assemble the per-row result dicts of /analyze_csv column-wise.
+
+    offset is the index of the first row of X within the whole file.
+    """
+    return results_from_columns(result_columns(X, scores, protocols), offset)
+
+
+def results_from_columns(columns, offset=0):
+    """Per-row result dicts from result_columns output."""
+
+    n_rows = len(columns['prediction'])
+    predictions = columns['prediction'].tolist()
+    confidences = columns['confidence'].tolist()
+    protocols = columns['protocol']
+    if protocols is None:
+        protocols = ['N/A'] * n_rows
+    elif isinstance(protocols, np.ndarray):
+        protocols = protocols.tolist()
+    durations = columns['flow_duration'].tolist()
+    packets = columns['total_packets'].tolist()
+
+    return [
+        {
+            'record': offset + i,
+            'prediction': predictions[i],
+            'confidence': confidences[i],
+            'protocol': protocols[i],
+            'flow_duration': durations[i],
+            'total_packets': packets[i]
+        }
+        for i in range(n_rows)
+    ]
+
+
+def stream_csv_analysis(path, scorer, chunk_rows=DEFAULT_CSV_CHUNK_ROWS, cache=None, on_chunk=None):
+    """Score the CSV at path chunk by chunk, yielding NDJSON lines.
+
+    One line is emitted per flow, followed by a final ``{"stats": ...}`` line.
+    Only one chunk of rows and results is held in memory at a time.
+    on_chunk, if given, is called with the result_columns and offset of
+    each chunk once its lines are built (e.g. to audit them).
+    """
+
+    total_records = 0
+    attacks_detected = 0
+    dedup = {'rows': 0, 'unique': 0, 'cache_hits': 0}
+    cascade = {'rows': 0, 'early_exits': 0}
+
+    try:
+        for X, scores, protocols, offset in analyze_chunks(path, scorer, chunk_rows, cache):
+            columns = result_columns(X, scores, protocols)
+            lines = [json.dumps(result) for result in results_from_columns(columns, offset)]
+            if on_chunk is not None:
+                on_chunk(columns, offset)
+            yield '\n'.join(lines) + '\n'
+
+            total_records += len(X)
+            attacks_detected += int(scores['prediction'].sum())
+            for name in dedup:
+                dedup[name] += scores['dedup'][name]
+            for name in cascade:
+                cascade[name] += scores['cascade'][name]
+    except Exception as e:
+        yield json.dumps({'error': str(e)}) + '\n'
+        return
+
+    yield json.dumps({'stats': {
+        'total': total_records,
+        'threats': attacks_detected,
+        'normal': total_records - attacks_detected,
+        'dedup_ratio': dedup_ratio(dedup),
+        'early_exit_ratio': early_exit_ratio(cascade)
+    }}) + '\n'
@@ -0,0 +1,106 @@
+# -*- encoding: utf-8 -*-
+"""
+Background CSV analysis jobs, tracked by AnalysisResult rows.
+"""
+
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from apps import db
+from apps.ids.ingest import (DEFAULT_CSV_CHUNK_ROWS, analyze_chunks, count_csv_rows, result_columns,
+                             results_from_columns)
+from apps.ids.persistence import DEFAULT_INSERT_BATCH, delete_detections, save_detections
+from apps.models import AnalysisResult
+
+
+class AnalysisJobs:
+    """Scores uploaded CSVs on a local thread pool.
+
+    Each chunk's DetectionRecord rows, progress and partial stats are
+    committed as soon as it is scored, so any worker process can answer
+    polling requests. A failed job keeps none of them: its records are
+    deleted and its counters reset along with the failed status. With an
+    AuditLog, each chunk's verdicts are audited once they are stored.
+    """
+
+    def __init__(self, app, scorer, max_workers=2, chunk_rows=DEFAULT_CSV_CHUNK_ROWS,
+                 insert_batch=DEFAULT_INSERT_BATCH, cache=None, audit=None):
+        self.app = app
+        self.audit = audit
+        self.scorer = scorer
+        self.cache = cache
+        self.chunk_rows = chunk_rows
+        self.insert_batch = insert_batch
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis')
+
+    def submit(self, upload_path, filename, user_id=None):
+        """Queue the analysis of a saved upload and return the job id."""
+
+        job = AnalysisResult(filename=filename, upload_path=upload_path,
+                             user_id=user_id, status='queued')
+        db.session.add(job)
+        db.session.commit()
+
+        self.executor.submit(self._run, job.id)
+        return job.id
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            job = db.session.get(AnalysisResult, job_id)
+
+            try:
+                job.status = 'running'
+                job.total_records = count_csv_rows(job.upload_path)
+                db.session.commit()
+
+                for X, scores, protocols, offset in analyze_chunks(job.upload_path, self.scorer, self.chunk_rows, self.cache):
+                    threats = int(scores['prediction'].sum())
+                    job.processed_records += len(X)
+                    job.attacks_detected += threats
+                    job.benign_traffic += len(X) - threats
+
+                    # Commits the progress update along with the records
+                    columns = result_columns(X, scores, protocols)
+                    save_detections(job.id, results_from_columns(columns, offset),
+                                    batch_size=self.insert_batch)
+                    if self.audit:
+                        self.audit.log_analysis(job.id, job.filename, columns, offset=offset,
+                                                endpoint='/analyze_csv/jobs', user_id=job.user_id)
+
+                job.total_records = job.processed_records
+                job.status = 'done'
+            except Exception as e:
+                print(f"Error in analysis job {job_id}: {str(e)}")
+                traceback.print_exc()
+                db.session.rollback()
+                # No partial results: the chunks stored so far go with the failure
+                delete_detections(job.id)
+                job.processed_records = job.attacks_detected = job.benign_traffic = 0
+                job.status = 'failed'
+                job.error = str(e)
+
+            db.session.commit()
+
+
+def job_status(job):
+    """Polling payload for a job."""
+
+    progress = 0.0
+    if job.status == 'done':
+        progress = 1.0
+    elif job.total_records:
+        progress = min(job.processed_records / job.total_records, 1.0)
+
+    return {
+        'job_id': job.id,
+        'filename': job.filename,
+        'status': job.status,
+        'progress': progress,
+        'processed': job.processed_records,
+        'stats': {
+            'total': job.total_records,
+            'threats': job.attacks_detected,
+            'normal': job.benign_traffic
+        },
+        'error': job.error
+    }
@@ -0,0 +1,183 @@
+# -*- encoding: utf-8 -*-
+"""
+Packet sources for the flow extractor: pcap files (offline or followed as they grow) and live AF_PACKET capture.
+"""
+
+import socket
+import struct
+import time
+from collections import namedtuple
+
+# What the flow extractor needs from a packet. payload and header are the
+# transport payload and header lengths in bytes; flags and window are the TCP
+# flags and window (0 and -1 for other protocols). Ports are 0 for protocols
+# without them.
+Packet = namedtuple('Packet', ['ts', 'src', 'dst', 'sport', 'dport', 'proto', 'payload', 'header', 'flags', 'window'])
+
+TCP = 6
+UDP = 17
+
+# TCP flag bits
+FIN, SYN, RST, PSH, ACK, URG, ECE, CWR = (1 << bit for bit in range(8))
+
+# Link-layer types handled (pcap LINKTYPE_* values)
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+
+# Classic pcap magic numbers: microsecond and nanosecond timestamps
+PCAP_MAGIC = {0xA1B2C3D4: 1e-6, 0xA1B23C4D: 1e-9}
+PCAPNG_MAGIC = 0x0A0D0D0A
+
+ETH_P_ALL = 0x0003
+
+# Seconds between polls of a followed file, and between heartbeats of an idle source
+POLL_INTERVAL = 0.5
+
+
+def decode_transport(ts, proto, src, dst, ip_payload_len, data):
+    """Packet from a transport header (data) and the IP payload length, or None if truncated."""
+
+    if proto == TCP:
+        if len(data) < 20:
+            return None
+        sport, dport = struct.unpack_from('!HH', data)
+        header = (data[12] >> 4) * 4
+        flags = data[13]
+        window = struct.unpack_from('!H', data, 14)[0]
+        return Packet(ts, src, dst, sport, dport, proto, max(ip_payload_len - header, 0), header, flags, window)
+    if proto == UDP:
+        if len(data) < 8:
+            return None
+        sport, dport = struct.unpack_from('!HH', data)
+        return Packet(ts, src, dst, sport, dport, proto, max(ip_payload_len - 8, 0), 8, 0, -1)
+    return Packet(ts, src, dst, 0, 0, proto, ip_payload_len, 0, 0, -1)
+
+
+def decode_ip(ts, data):
+    """Packet from an IPv4 / IPv6 datagram, or None (other protocols, later fragments, truncated)."""
+
+    if len(data) < 1:
+        return None
+    version = data[0] >> 4
+    if version == 4 and len(data) >= 20:
+        ihl = (data[0] & 0x0F) * 4
+        total_length, fragment, proto = struct.unpack_from('!H2xH1xB', data, 2)
+        if fragment & 0x1FFF:
+            # Only the first fragment carries the transport header
+            return None
+        src, dst = socket.inet_ntop(socket.AF_INET, data[12:16]), socket.inet_ntop(socket.AF_INET, data[16:20])
+        return decode_transport(ts, proto, src, dst, total_length - ihl, data[ihl:])
+    if version == 6 and len(data) >= 40:
+        payload_length, proto = struct.unpack_from('!HB', data, 4)
+        src, dst = socket.inet_ntop(socket.AF_INET6, data[8:24]), socket.inet_ntop(socket.AF_INET6, data[24:40])
+        # Extension headers are not walked: their flows keep the extension's protocol number
+        return decode_transport(ts, proto, src, dst, payload_length, data[40:])
+    return None
+
+
+def decode_frame(ts, linktype, frame):
+    """Packet from a captured frame of the given link type, or None if it is not IP."""
+
+    if linktype == LINKTYPE_RAW:
+        return decode_ip(ts, frame)
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(frame) < 16:
+            return None
+        ethertype, offset = struct.unpack_from('!H', frame, 14)[0], 16
+    elif linktype == LINKTYPE_ETHERNET:
+        if len(frame) < 14:
+            return None
+        ethertype, offset = struct.unpack_from('!H', frame, 12)[0], 14
+        while ethertype in ETHERTYPE_VLAN and len(frame) >= offset + 4:
+            ethertype, offset = struct.unpack_from('!H', frame, offset + 2)[0], offset + 4
+    else:
+        raise ValueError(f'Unsupported link type {linktype}')
+
+    if ethertype in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+        return decode_ip(ts, frame[offset:])
+    return None
+
+
+def read_exact(f, size, follow=False):
+    """size bytes from f; at end of file, None (or, following the file, wait for them)."""
+
+    data = f.read(size)
+    while len(data) < size:
+        if not follow:
+            return None
+        time.sleep(POLL_INTERVAL)
+        data += f.read(size - len(data))
+    return data
+
+
+def read_pcap(path, follow=False):
+    """Packets of a classic pcap file, in file order.
+
+    With follow, the file is read as it grows (e.g. ``tcpdump -U -w``) and
+    ``None`` heartbeats are yielded while waiting, so that idle flows can
+    still be expired. pcapng files are rejected (``editcap -F pcap``
+    converts them).
+    """
+
+    with open(path, 'rb') as f:
+        header = read_exact(f, 24, follow)
+        if header is None:
+            return
+
+        for endian in '<>':
+            magic = struct.unpack(endian + 'I', header[:4])[0]
+            if magic in PCAP_MAGIC:
+                break
+        else:
+            if struct.unpack('<I', header[:4])[0] == PCAPNG_MAGIC:
+                raise ValueError('pcapng files are not supported, convert with: editcap -F pcap in.pcapng out.pcap')
+            raise ValueError('Not a pcap file')
+        resolution = PCAP_MAGIC[magic]
+        linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0FFFFFFF
+        record = struct.Struct(endian + 'IIII')
+
+        while True:
+            data = f.read(record.size)
+            while follow and len(data) < record.size:
+                # Nothing new yet: report the wait
+                yield None
+                time.sleep(POLL_INTERVAL)
+                data += f.read(record.size - len(data))
+            if len(data) < record.size:
+                return
+
+            ts_sec, ts_frac, captured, _ = record.unpack(data)
+            frame = read_exact(f, captured, follow)
+            if frame is None:
+                return
+            packet = decode_frame(ts_sec + ts_frac * resolution, linktype, frame)
+            if packet is not None:
+                yield packet
+
+
+def capture_interface(interface, snaplen=65535):
+    """Packets captured live on a network interface (Linux AF_PACKET socket, needs CAP_NET_RAW).
+
+    ``None`` heartbeats are yielded every POLL_INTERVAL seconds without traffic.
+    """
+
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(ETH_P_ALL))
+    try:
+        sock.bind((interface, 0))
+        sock.settimeout(POLL_INTERVAL)
+        while True:
+            try:
+                frame = sock.recv(snaplen)
+            except socket.timeout:
+                yield None
+                continue
+            packet = decode_frame(time.time(), LINKTYPE_ETHERNET, frame)
+            if packet is not None:
+                yield packet
+    finally:
+        sock.close()
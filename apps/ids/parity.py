@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+"""
+Accuracy-parity report of a reduced-precision scoring path against the float64 Keras ensemble.
+
+Run from the repository root:
+
+    python -m apps.ids.parity --reference uploads/sample_ddos_test.csv --precision float32
+    python -m apps.ids.parity --reference uploads/sample_ddos_test.csv --precision float32 --backend tflite_int8
+
+Both scorers score the same rows without dedup or caching: the baseline on
+the CSV parsed in float64, the candidate on the float32 parse the app
+serves. The report gives the label flips, the confidence differences, the
+throughput of both paths and the size of the feature matrix each one
+scales. Exits with 1 when more than --max-flips labels differ, or when
+an ensemble member is missing from either path (its scores all NaN): the
+two would not be comparing the same ensemble.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from apps.ids.ingest import load_features
+from apps.ids.registry import BACKENDS, ModelRegistry
+from apps.ids.scoring import EnsembleScorer, as_matrix
+
+PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+
+
+def timed_scores(scorer, X, repeat=3):
+    """Scores of X and the best wall time over repeat runs."""
+    scores, best = None, float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scores = scorer.score_batch(X)
+        best = min(best, time.perf_counter() - start)
+    return scores, best
+
+
+def served_members(scores, keys):
+    """Members with at least one score (an unavailable member's scores are all NaN)."""
+    return {key for key in keys if len(scores[key]) and not np.isnan(scores[key]).all()}
+
+
+def compare(baseline, candidate, X, X_candidate=None, repeat=3):
+    """Score X with the baseline and X_candidate (default X) with the candidate; returns the report as a dict."""
+
+    if X_candidate is None:
+        X_candidate = X
+    expected, baseline_seconds = timed_scores(baseline, X, repeat)
+    got, candidate_seconds = timed_scores(candidate, X_candidate, repeat)
+
+    flips = expected['prediction'] != got['prediction']
+    diff = np.abs(expected['confidence'] - got['confidence'])
+
+    keys = list(baseline.score_keys.values())
+    baseline_members = served_members(expected, keys)
+    candidate_members = served_members(got, keys)
+    members = {key: float(np.nanmax(np.abs(expected[key] - got[key])))
+               for key in keys if key in baseline_members & candidate_members}
+    return {
+        'rows': len(X),
+        'members_missing': sorted(set(keys) - (baseline_members & candidate_members)),
+        'label_agreement': 1.0 - float(flips.mean()),
+        'label_flips': int(flips.sum()),
+        'flips_to_attack': int((flips & (got['prediction'] == 1)).sum()),
+        'confidence_max_diff': float(diff.max()),
+        'confidence_mean_diff': float(diff.mean()),
+        'member_max_diff': members,
+        'baseline_rows_per_s': len(X) / baseline_seconds,
+        'candidate_rows_per_s': len(X) / candidate_seconds,
+        'baseline_matrix_mb': as_matrix(X, baseline.dtype).nbytes / 2**20,
+        'candidate_matrix_mb': as_matrix(X_candidate, candidate.dtype).nbytes / 2**20
+    }
+
+
+def format_report(report, label):
+    lines = [
+        f"{label} vs float64/keras on {report['rows']} rows",
+        f"  labels      : {report['label_agreement']:.4%} agreement, {report['label_flips']} flips "
+        f"({report['flips_to_attack']} benign -> attack)",
+        f"  confidence  : max |diff| = {report['confidence_max_diff']:.2e}, "
+        f"mean |diff| = {report['confidence_mean_diff']:.2e}",
+    ]
+    if report['members_missing']:
+        lines.insert(1, f"  MEMBERS NOT SCORED BY BOTH PATHS: {', '.join(report['members_missing'])} "
+                        f"(not the same ensemble, the comparison is not valid)")
+    for key, value in report['member_max_diff'].items():
+        lines.append(f"  {key:<12}: max |diff| = {value:.2e}")
+    lines += [
+        f"  throughput  : {report['baseline_rows_per_s']:,.0f} -> {report['candidate_rows_per_s']:,.0f} rows/s "
+        f"({report['candidate_rows_per_s'] / report['baseline_rows_per_s']:.2f}x)",
+        f"  matrix      : {report['baseline_matrix_mb']:.1f} -> {report['candidate_matrix_mb']:.1f} MB",
+    ]
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--model-dir', default=os.getenv('MODEL_DIR', '.'))
+    parser.add_argument('--reference', required=True, help='CSV of flows to score')
+    parser.add_argument('--precision', default='float32', choices=PRECISIONS)
+    parser.add_argument('--backend', default='keras', choices=BACKENDS)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per scorer (best is kept)')
+    parser.add_argument('--max-flips', type=int, default=0, help='label flips tolerated')
+    args = parser.parse_args()
+
+    # The float64 reference parses the CSV in float64, the candidate gets the app's float32 parse
+    X, _ = load_features(args.reference, csv_dtype=np.float64)
+    X_candidate, _ = load_features(args.reference, dtype=PRECISIONS[args.precision])
+
+    baseline = EnsembleScorer(ModelRegistry(args.model_dir, backend='keras'), dedup=False)
+    candidate = EnsembleScorer(ModelRegistry(args.model_dir, backend=args.backend), dedup=False,
+                               dtype=PRECISIONS[args.precision])
+
+    report = compare(baseline, candidate, X, X_candidate, args.repeat)
+    print(format_report(report, f'{args.precision}/{args.backend}'))
+    return 0 if report['label_flips'] <= args.max_flips and not report['members_missing'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# -*- encoding: utf-8 -*-
+"""
+Decoding of bulk /predict payloads (JSON, NumPy .npy, Arrow IPC) into schema-ordered matrices.
+"""
+
+import io
+from collections import namedtuple
+
+import numpy as np
+
+from apps.ids.schema import FEATURE_INDEX, FEATURES, N_FEATURES, canonical_name, is_protocol
+
+NPY_MIMETYPES = ('application/x-npy', 'application/octet-stream')
+ARROW_MIMETYPES = ('application/vnd.apache.arrow.stream', 'application/vnd.apache.arrow.file')
+
+
+class PayloadError(ValueError):
+    """Raised when a bulk payload does not match the feature schema."""
+
+
+# Decoded bulk payload: schema-ordered float64 matrix, Protocol values (None
+# when not sent) and the names that were not sent / not recognised
+FlowPayload = namedtuple('FlowPayload', ['X', 'protocols', 'missing', 'unknown'])
+
+
+def columns_to_matrix(names, columns):
+    """Place named columns into a schema-ordered float64 matrix.
+
+    columns is a 2D array (one column per name). Same policy as /predict
+    (see schema.features_from_mapping): names may be canonical or aliases,
+    a Protocol column is returned as ``protocols``, other unknown names are
+    ignored and returned as ``unknown``, and features that are not sent are
+    filled with 0 and returned as ``missing``. Missing and infinite values
+    are replaced with 0, as in schema.SchemaMapper.transform.
+    """
+
+    features = [canonical_name(name) for name in names]
+    known = [feature for feature in features if feature is not None]
+    if len(set(known)) != len(known):
+        raise PayloadError('Duplicate feature names')
+
+    try:
+        columns = np.asarray(columns)
+    except ValueError:
+        # Ragged rows
+        columns = None
+    if columns is None or columns.ndim != 2 or columns.shape[1] != len(names):
+        raise PayloadError(f'Expected {len(names)} values per flow')
+
+    protocol = [i for i, name in enumerate(names) if is_protocol(name)]
+    protocols = columns[:, protocol[0]].tolist() if protocol else None
+    unknown = [name for i, (name, feature) in enumerate(zip(names, features))
+               if feature is None and i not in protocol]
+
+    try:
+        if features == FEATURES:
+            X = columns.astype(np.float64)
+        else:
+            X = np.zeros((len(columns), N_FEATURES), dtype=np.float64)
+            for i, feature in enumerate(features):
+                if feature is not None:
+                    X[:, FEATURE_INDEX[feature]] = columns[:, i]
+    except (TypeError, ValueError):
+        raise PayloadError('Feature values must be numbers')
+
+    present = set(known)
+    missing = [feature for feature in FEATURES if feature not in present]
+    return FlowPayload(np.nan_to_num(X, copy=False, nan=0.0, posinf=0.0, neginf=0.0), protocols, missing, unknown)
+
+
+def matrix_from_json(payload):
+    """Decode a JSON payload.
+
+    Accepted shapes:
+    ``{"features": [names], "flows": [[values], ...]}`` (compact),
+    ``{"flows": [{name: value}, ...]}`` or a bare ``[{name: value}, ...]``.
+    """
+
+    if isinstance(payload, list):
+        payload = {'flows': payload}
+    if not isinstance(payload, dict) or not isinstance(payload.get('flows'), list):
+        raise PayloadError('Expected a "flows" list')
+
+    flows = payload['flows']
+    if 'features' in payload:
+        return columns_to_matrix(payload['features'], flows if flows else np.empty((0, len(payload['features']))))
+
+    if not all(isinstance(flow, dict) for flow in flows):
+        raise PayloadError('Flows must be objects unless "features" is given')
+
+    # Union of the names used by any flow
+    names = sorted(set().union(*flows)) if flows else []
+    columns = [[flow.get(name, 0) for name in names] for flow in flows]
+    return columns_to_matrix(names, columns if columns else np.empty((0, len(names))))
+
+
+def matrix_from_npy(data, feature_names=None):
+    """Decode a .npy buffer.
+
+    A structured array supplies its own feature names (its field names); a
+    plain 2D array uses feature_names, or the schema order when omitted.
+    """
+
+    try:
+        array = np.load(io.BytesIO(data), allow_pickle=False)
+    except ValueError as e:
+        raise PayloadError(f'Invalid .npy payload: {e}')
+
+    if array.dtype.names:
+        names = list(array.dtype.names)
+        columns = np.column_stack([array[name] for name in names]) if len(array) else np.empty((0, len(names)))
+        return columns_to_matrix(names, columns)
+
+    return columns_to_matrix(feature_names or FEATURES, np.atleast_2d(array))
+
+
+def matrix_from_arrow(data):
+    """Decode an Arrow IPC stream or file; column names are feature names.
+
+    Requires pyarrow (optional dependency).
+    """
+
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise PayloadError('Arrow payloads require pyarrow')
+
+    try:
+        table = pa.ipc.open_stream(data).read_all()
+    except pa.ArrowInvalid:
+        try:
+            table = pa.ipc.open_file(pa.BufferReader(data)).read_all()
+        except pa.ArrowInvalid as e:
+            raise PayloadError(f'Invalid Arrow payload: {e}')
+
+    names = table.column_names
+    columns = np.column_stack([table.column(name).to_numpy(zero_copy_only=False) for name in names]) \
+        if table.num_rows else np.empty((0, len(names)))
+    return columns_to_matrix(names, columns)
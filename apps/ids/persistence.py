@@ -0,0 +1,166 @@
+# -*- encoding: utf-8 -*-
+"""
+Bulk persistence of analysis results into AnalysisResult / DetectionRecord.
+"""
+
+import base64
+import json
+
+from apps import db
+from apps.models import AnalysisResult, DetectionRecord
+
+# DetectionRecord rows sent per executemany / commit
+DEFAULT_INSERT_BATCH = 10000
+
+
+def detection_mappings(analysis_id, results):
+    """Convert /analyze_csv result dicts into DetectionRecord column mappings."""
+
+    def number(value, cast):
+        # 'N/A' placeholders and NaN are stored as NULL
+        if value is None or value == 'N/A' or value != value:
+            return None
+        return cast(value)
+
+    return [
+        {
+            'analysis_id': analysis_id,
+            'record_index': result['record'],
+            'prediction': result['prediction'],
+            'confidence': result['confidence'],
+            'protocol': number(result['protocol'], str),
+            'flow_duration': number(result['flow_duration'], float),
+            'total_packets': number(result['total_packets'], int)
+        }
+        for result in results
+    ]
+
+
+def save_detections(analysis_id, results, batch_size=DEFAULT_INSERT_BATCH):
+    """Insert the results of an analysis with one executemany per batch.
+
+    Each batch is committed on its own so a long analysis never holds a
+    single huge transaction.
+    """
+
+    insert = db.insert(DetectionRecord)
+    for start in range(0, len(results), batch_size):
+        db.session.execute(insert, detection_mappings(analysis_id, results[start:start + batch_size]))
+        db.session.commit()
+
+
+def delete_detections(analysis_id):
+    """Delete the stored results of an analysis, in the current transaction (the caller commits)."""
+    db.session.execute(db.delete(DetectionRecord).where(DetectionRecord.analysis_id == analysis_id))
+
+
+def load_detections(analysis_id):
+    """Return the stored results of an analysis in file order, as result dicts."""
+
+    rows = db.session.execute(
+        db.select(DetectionRecord.record_index, DetectionRecord.prediction, DetectionRecord.confidence,
+                  DetectionRecord.protocol, DetectionRecord.flow_duration, DetectionRecord.total_packets)
+        .where(DetectionRecord.analysis_id == analysis_id)
+        .order_by(DetectionRecord.record_index)
+    )
+    return [detection_result(row) for row in rows]
+
+
+def detection_result(row):
+    """Result dict (as returned by /analyze_csv) for a stored DetectionRecord row."""
+    return {
+        'record': row.record_index,
+        'prediction': row.prediction,
+        'confidence': row.confidence,
+        'protocol': row.protocol,
+        'flow_duration': row.flow_duration,
+        'total_packets': row.total_packets
+    }
+
+
+# Sortable columns of the records API
+SORT_COLUMNS = {
+    'record': DetectionRecord.record_index,
+    'confidence': DetectionRecord.confidence,
+}
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def query_detections(analysis_id, prediction=None, min_confidence=None, max_confidence=None,
+                     protocol=None, sort='record', descending=False, cursor=None, limit=50):
+    """Return one page of an analysis' records as ``(results, next_cursor)``.
+
+    Pages are keyset-paginated on ``(sort column, id)``: cursor is the
+    next_cursor of the previous page, and next_cursor is None on the last page.
+
+    Records scored in cascade mode (SCORING_CASCADE) that exited early store
+    the average of the members that ran, not the full ensemble confidence:
+    it lies on the same side of the decision threshold, but confidence
+    bounds and sorting compare it with full ensemble scores as is.
+    """
+
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f'Invalid sort: {sort}')
+    sort_column = SORT_COLUMNS[sort]
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    query = db.select(DetectionRecord).where(DetectionRecord.analysis_id == analysis_id)
+    if prediction is not None:
+        query = query.where(DetectionRecord.prediction == prediction)
+    if min_confidence is not None:
+        query = query.where(DetectionRecord.confidence >= min_confidence)
+    if max_confidence is not None:
+        query = query.where(DetectionRecord.confidence <= max_confidence)
+    if protocol is not None:
+        query = query.where(DetectionRecord.protocol == protocol)
+
+    key = db.tuple_(sort_column, DetectionRecord.id)
+    if cursor is not None:
+        after = db.tuple_(*decode_cursor(cursor))
+        query = query.where(key < after if descending else key > after)
+
+    if descending:
+        query = query.order_by(sort_column.desc(), DetectionRecord.id.desc())
+    else:
+        query = query.order_by(sort_column, DetectionRecord.id)
+
+    # One extra row tells whether there is a next page
+    rows = db.session.execute(query.limit(limit + 1)).scalars().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, sort_column.key), last.id])
+
+    return [detection_result(row) for row in rows], next_cursor
+
+
+def query_analyses(user_id, cursor=None, limit=20):
+    """Return one page of a user's analyses, newest first, as ``(analyses, next_cursor)``."""
+
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = db.select(AnalysisResult).where(AnalysisResult.user_id == user_id)
+    if cursor is not None:
+        query = query.where(AnalysisResult.id < int(cursor))
+
+    rows = db.session.execute(query.order_by(AnalysisResult.id.desc()).limit(limit + 1)).scalars().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1].id)
+    return rows, next_cursor
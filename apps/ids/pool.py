@@ -0,0 +1,146 @@
+# -*- encoding: utf-8 -*-
+"""
+Process-pool scoring: large batches are sharded across worker processes, each holding its own ensemble.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from apps.ids.registry import ModelRegistry
+from apps.ids.scoring import as_matrix, protocols_of, result_at, row_from_features
+from apps.ids.workers import FORK_SAFE_MODELS, init_worker
+
+# Rows per shard handed to a worker process
+DEFAULT_SHARD_ROWS = 16384
+
+# Scorer of the current pool worker process, built by init_pool_worker
+_worker_scorer = None
+
+
+def init_pool_worker(model_dir, backend, scorer_class, scorer_options, threads):
+    """Build the ensemble of a pool worker, with its native thread pools limited to threads."""
+
+    global _worker_scorer
+
+    # LightGBM (OpenMP) reads this when its library loads, on the first unpickling below
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    registry = ModelRegistry(model_dir, backend=backend)
+    registry.preload(FORK_SAFE_MODELS)
+    init_worker(registry, threads)
+    _worker_scorer = scorer_class(registry, **scorer_options)
+
+
+def score_shard(X, protocols):
+    return _worker_scorer.score_batch(X, protocols)
+
+
+def merge_scores(parts):
+    """Concatenate shard results in order; the per-batch counters are summed."""
+
+    merged = {}
+    for key, value in parts[0].items():
+        if isinstance(value, dict):
+            merged[key] = {name: sum(part[key][name] for part in parts) for name in value}
+        else:
+            merged[key] = np.concatenate([part[key] for part in parts])
+    return merged
+
+
+class PoolScorer:
+    """Drop-in alternative to EnsembleScorer / RoutedScorer that scores large batches on several cores.
+
+    Batches of more than shard_rows rows are cut into shards of shard_rows
+    rows, scored by a pool of worker processes and merged back in order;
+    smaller batches (e.g. /predict) are scored in-process by ``local``, the
+    same scorer the workers build. Each worker loads its own copy of the
+    models and runs LightGBM / TensorFlow with ``threads`` native threads,
+    so workers x threads should not exceed the cores.
+
+    Workers are spawned, not forked (TensorFlow is not fork-safe), on the
+    first pooled batch. Rows are deduplicated (and cached) per shard, not
+    across the whole batch; a score cache is only used by ``local``.
+    """
+
+    def __init__(self, registry, scorer_class, scorer_options, workers=None,
+                 shard_rows=DEFAULT_SHARD_ROWS, threads=1):
+        self.registry = registry
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_rows = shard_rows
+        self.threads = threads
+
+        self.local = scorer_class(registry, **scorer_options)
+        self.dtype = self.local.dtype
+        self.cache = self.local.cache
+        # Workers hold their own registries; the cache lives in this process only
+        self._initargs = (registry.model_dir, registry.backend, scorer_class,
+                          {key: value for key, value in scorer_options.items() if key != 'cache'}, threads)
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.pooled_batches = 0
+        self.local_batches = 0
+        self.shards = 0
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=init_pool_worker, initargs=self._initargs)
+            return self._executor
+
+    def ready(self):
+        return self.local.ready()
+
+    def transform(self, X):
+        return self.local.transform(X)
+
+    def score_batch(self, X, protocols=None):
+        X = as_matrix(X, self.dtype)
+        if self.workers < 2 or len(X) <= self.shard_rows:
+            self.local_batches += 1
+            return self.local.score_batch(X, protocols)
+
+        starts = range(0, len(X), self.shard_rows)
+        futures = [self.executor.submit(score_shard, X[start:start + self.shard_rows],
+                                        None if protocols is None else protocols[start:start + self.shard_rows])
+                   for start in starts]
+        parts = [future.result() for future in futures]
+
+        self.pooled_batches += 1
+        self.shards += len(parts)
+        return merge_scores(parts)
+
+    def score_one(self, features, protocol=None):
+        return result_at(self.local.score_batch(row_from_features(features), protocols_of(protocol)), 0)
+
+    def score_stream(self, chunks):
+        for X in chunks:
+            yield self.score_batch(X)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def metrics(self):
+        # Scored/early-exit counters of the workers stay in their processes
+        return {
+            **self.local.metrics(),
+            'pool': {
+                'workers': self.workers,
+                'shard_rows': self.shard_rows,
+                'threads': self.threads,
+                'started': self._executor is not None,
+                'pooled_batches': self.pooled_batches,
+                'local_batches': self.local_batches,
+                'shards': self.shards
+            }
+        }
@@ -0,0 +1,176 @@
+# -*- encoding: utf-8 -*-
+"""
+Model registry: discovers the shipped artifacts and loads each one lazily.
+"""
+
+import glob
+import hashlib
+import os
+import threading
+import time
+
+
+def load_keras(path):
+    # TensorFlow is only imported once a Keras model is actually needed
+    import tensorflow as tf
+    return tf.keras.models.load_model(path)
+
+
+def load_joblib(path):
+    import joblib
+    return joblib.load(path)
+
+
+def load_tflite(path):
+    # LiteRT interpreter: the Keras models without importing TensorFlow
+    from apps.ids.tflite import TFLiteModel
+    return TFLiteModel(path)
+
+
+LOADERS = {
+    '.h5': load_keras,
+    '.keras': load_keras,
+    '.pkl': load_joblib,
+    '.tflite': load_tflite,
+}
+
+# Serving backends of the Keras models: extension of the artifact each one loads
+# (TFLite files are produced by ``python -m apps.ids.export``)
+BACKENDS = {
+    'keras': '.h5',
+    'tflite': '.tflite',
+    'tflite_int8': '.int8.tflite',
+}
+KERAS_MODELS = ('dnn', 'cnn')
+
+# Known artifacts: registry name -> file name
+ARTIFACTS = {
+    'scaler': 'scaler.pkl',
+    'dnn': 'ids_dnn_model.h5',
+    'cnn': 'ids_cnn_model.h5',
+    'group': 'ids_lightgbm_model_group.pkl',
+    'web': 'ids_lightgbm_model_web.pkl',
+    'non_web': 'ids_lightgbm_model_non_web.pkl',
+    'iso_forest': 'ids_isolation_forest.pkl',
+}
+
+
+def stem(path):
+    # File name up to its first dot: ids_dnn_model.int8.tflite -> ids_dnn_model
+    return os.path.basename(path).split('.')[0]
+
+
+class ModelUnavailable(Exception):
+    """Raised when a model artifact is missing or failed to load."""
+
+
+class ModelRegistry:
+    """Loads each artifact on first use, once, behind a per-model lock.
+
+    A missing or broken artifact only makes that model unavailable; the
+    others keep loading and serving.
+    """
+
+    def __init__(self, model_dir='.', backend='keras'):
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown model backend: {backend} (expected one of {sorted(BACKENDS)})')
+        self.model_dir = model_dir
+        self.backend = backend
+        self.paths = self.discover()
+        self._models = {}
+        self._errors = {}
+        self._load_seconds = {}
+        self._locks = {name: threading.Lock() for name in self.paths}
+
+    def discover(self):
+        """Map registry names to artifact paths (known artifacts plus any other ids_* file)."""
+
+        paths = {name: os.path.join(self.model_dir, filename) for name, filename in ARTIFACTS.items()}
+        for name in KERAS_MODELS:
+            paths[name] = os.path.join(self.model_dir, stem(paths[name]) + BACKENDS[self.backend])
+
+        # Other formats of a known artifact (e.g. ids_dnn_model.int8.tflite) are not separate models
+        known = {stem(path) for path in paths.values()}
+        for ext in LOADERS:
+            for path in glob.glob(os.path.join(self.model_dir, 'ids_*' + ext)):
+                if stem(path) not in known:
+                    name = stem(path)[len('ids_'):]
+                    paths.setdefault(name, path)
+        return paths
+
+    def available(self, name):
+        """True if the model is loaded, or present on disk and not known to be broken."""
+        if name in self._models:
+            return True
+        return name in self.paths and name not in self._errors and os.path.exists(self.paths[name])
+
+    def get(self, name):
+        """Return the loaded model, loading it on first use."""
+
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        if name not in self.paths:
+            raise ModelUnavailable(f'Unknown model: {name}')
+
+        with self._locks[name]:
+            # Another thread may have loaded it while we waited for the lock
+            if name in self._models:
+                return self._models[name]
+            if name in self._errors:
+                raise ModelUnavailable(f'{name}: {self._errors[name]}')
+
+            path = self.paths[name]
+            if not os.path.exists(path):
+                self._errors[name] = f'{path} not found'
+                if name in KERAS_MODELS and self.backend != 'keras':
+                    self._errors[name] += ' (export it with: python -m apps.ids.export)'
+                raise ModelUnavailable(f'{name}: {self._errors[name]}')
+
+            loader = LOADERS[os.path.splitext(path)[1]]
+            start = time.perf_counter()
+            try:
+                model = loader(path)
+            except Exception as e:
+                self._errors[name] = str(e)
+                print(f"Erreur lors du chargement du modèle {name}: {e}")
+                raise ModelUnavailable(f'{name}: {e}')
+
+            self._load_seconds[name] = time.perf_counter() - start
+            self._models[name] = model
+            print(f"Modèle {name} chargé ({self._load_seconds[name]:.2f}s)")
+            return model
+
+    def fingerprint(self):
+        """Digest of the (name, size, mtime) of every artifact; changes when any model file does."""
+
+        parts = []
+        for name, path in sorted(self.paths.items()):
+            try:
+                stat = os.stat(path)
+                parts.append(f'{name}:{stat.st_size}:{stat.st_mtime_ns}')
+            except OSError:
+                parts.append(f'{name}:-')
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+    def preload(self, names=None):
+        """Load the given models (all by default) now, skipping unavailable ones."""
+        for name in (names or self.paths):
+            try:
+                self.get(name)
+            except ModelUnavailable:
+                pass
+
+    def status(self):
+        """Per-model status: file, presence on disk, loaded flag, load time and error."""
+        return {
+            name: {
+                'file': os.path.basename(path),
+                'present': os.path.exists(path),
+                'loaded': name in self._models,
+                'load_seconds': self._load_seconds.get(name),
+                'error': self._errors.get(name)
+            }
+            for name, path in self.paths.items()
+        }
@@ -0,0 +1,166 @@
+# -*- encoding: utf-8 -*-
+"""
+Result caches: whole uploads for /analyze_csv and individual flow vectors for the scorer.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def columns_nbytes(columns):
+    # Object arrays (e.g. string protocols) only count their pointers; charge 64 bytes per item
+    return sum(values.nbytes if values.dtype != object else 64 * len(values)
+               for values in columns.values() if values is not None)
+
+
+class ResultCache:
+    """In-process LRU of analysis results keyed by upload content hash.
+
+    Entries hold the compact result columns of an analysis (see
+    ingest.result_columns), the id of the analysis that produced them and
+    its extra stats, bounded by entry count and total size. Every lookup
+    checks the registry fingerprint; when any model file changes, the
+    whole cache is dropped.
+    """
+
+    def __init__(self, registry, max_entries=32, max_mb=256):
+        self.registry = registry
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 2**20
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_models(self):
+        # Called with the lock held
+        fingerprint = self.registry.fingerprint()
+        if fingerprint != self._fingerprint:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._nbytes = 0
+            self._fingerprint = fingerprint
+
+    def get(self, key):
+        """``(columns, analysis_id, stats)`` stored for an upload hash, or None."""
+
+        with self._lock:
+            self._check_models()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[:3]
+
+    def put(self, key, columns, analysis_id=None, stats=None):
+        columns = {name: (None if values is None else np.asarray(values))
+                   for name, values in columns.items()}
+        nbytes = columns_nbytes(columns)
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_models()
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[3]
+            self._entries[key] = (columns, analysis_id, stats or {}, nbytes)
+            self._nbytes += nbytes
+
+            while len(self._entries) > self.max_entries or self._nbytes > self.max_bytes:
+                _, entry = self._entries.popitem(last=False)
+                self._nbytes -= entry[3]
+
+    def metrics(self):
+        return {
+            'entries': len(self._entries),
+            'size_mb': self._nbytes / 2**20,
+            'max_entries': self.max_entries,
+            'max_mb': self.max_bytes / 2**20,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
+
+
+class ScoreCache:
+    """Bounded LRU of ensemble scores by flow vector, shared by every request of a worker.
+
+    Keys are the 128-bit row hashes computed by scoring.row_hashes; values
+    are one score per field of ``fields``. Like ResultCache it is dropped
+    whenever the registry fingerprint changes.
+    """
+
+    def __init__(self, registry, fields, max_entries=100000):
+        self.registry = registry
+        self.fields = fields
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_models(self):
+        # Called with the lock held
+        fingerprint = self.registry.fingerprint()
+        if fingerprint != self._fingerprint:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._fingerprint = fingerprint
+
+    def lookup(self, hashes):
+        """Scores of the rows whose hashes are cached.
+
+        Returns ``(hit, scores)``: a boolean mask over the rows of hashes and
+        a dict of arrays with one value per hit, in row order.
+        """
+
+        keys = [tuple(pair) for pair in hashes.tolist()]
+        with self._lock:
+            self._check_models()
+            values = [self._entries.get(key) for key in keys]
+            for key, value in zip(keys, values):
+                if value is not None:
+                    self._entries.move_to_end(key)
+
+        hit = np.array([value is not None for value in values], dtype=bool)
+        n_hits = int(hit.sum())
+        self.hits += n_hits
+        self.misses += len(keys) - n_hits
+
+        found = [value for value in values if value is not None]
+        scores = {field: np.array([value[i] for value in found]) for i, field in enumerate(self.fields)}
+        return hit, scores
+
+    def store(self, hashes, scores):
+        """Cache one score per field for each row of hashes."""
+
+        rows = zip(*(scores[field].tolist() for field in self.fields))
+        with self._lock:
+            for pair, value in zip(hashes.tolist(), rows):
+                self._entries[tuple(pair)] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def metrics(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
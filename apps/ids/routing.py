@@ -0,0 +1,162 @@
+# -*- encoding: utf-8 -*-
+"""
+Routed scoring: iso_forest pre-filter, then web / non-web flows scored with their specialist LightGBM.
+"""
+
+import numpy as np
+
+from apps.ids.registry import ModelUnavailable
+from apps.ids.schema import FEATURE_INDEX
+from apps.ids.scoring import (CASCADE_ORDER, ENSEMBLE_WEIGHTS, SCORE_FIELDS, EnsembleScorer,
+                              as_matrix, protocols_of, result_at, row_from_features)
+
+# Destination ports routed to the web specialist
+WEB_PORTS = (80, 443, 8000, 8080, 8443)
+
+# Protocol values counted as TCP (numeric or named, as found in CSV exports)
+TCP_VALUES = ('6', '6.0', 'tcp')
+
+# iso_forest decision_function above which a flow is passed as benign (0 is sklearn's inlier boundary)
+ISO_FOREST_THRESHOLD = 0.0
+
+ROUTES = ('prefilter', 'web', 'non_web')
+
+
+def tcp_mask(protocols):
+    """True for the flows whose Protocol value is TCP."""
+    values = np.char.lower(np.char.strip(np.asarray(protocols).astype(str)))
+    return np.isin(values, TCP_VALUES)
+
+
+class RoutedScorer:
+    """Drop-in alternative to EnsembleScorer that routes each flow to a specialist.
+
+    1. iso_forest scores every scaled flow; flows above prefilter_threshold
+       (clear inliers) are reported benign without running the ensemble.
+    2. The rest are split on their destination port (and Protocol, when the
+       caller has it: only TCP flows can be web).
+    3. Each partition is scored in one batch by an ensemble whose LightGBM
+       member is the partition's specialist (``web`` / ``non_web``), falling
+       back to the general ``group`` model when the specialist is missing.
+
+    Results are merged back in input order; ``route`` and ``anomaly_score``
+    are added per flow. Pre-filtered flows get confidence 0 and no
+    individual scores. The batch is scaled once, shared by iso_forest and
+    the partitions.
+    """
+
+    def __init__(self, registry, web_ports=WEB_PORTS, prefilter_threshold=ISO_FOREST_THRESHOLD,
+                 cascade_order=CASCADE_ORDER, **scorer_options):
+        self.registry = registry
+        self.web_ports = np.asarray(web_ports, dtype=np.float64)
+        self.prefilter_threshold = prefilter_threshold
+        self.cascade_order = cascade_order
+        # A flow's route also depends on its Protocol, which is not part of
+        # the vector: the per-vector score cache is not used
+        scorer_options.pop('cache', None)
+        self.scorer_options = scorer_options
+        self.scorers = {}
+        self.cache = None
+
+        # The full ensemble, used for scaling and readiness
+        self.base = EnsembleScorer(registry, cascade_order=cascade_order, **scorer_options)
+        self.dtype = self.base.dtype
+
+        # Metrics
+        self.routed = dict.fromkeys(ROUTES, 0)
+
+    def ready(self):
+        return self.base.ready()
+
+    def transform(self, X):
+        return self.base.transform(X)
+
+    def scorer_for(self, route):
+        """Ensemble of a route, with its specialist in place of the group model."""
+
+        specialist = route if self.registry.available(route) else 'group'
+        if specialist not in self.scorers:
+            weights = {(specialist if name == 'group' else name): weight for name, weight in ENSEMBLE_WEIGHTS.items()}
+            order = tuple(specialist if name == 'group' else name for name in self.cascade_order)
+            self.scorers[specialist] = EnsembleScorer(self.registry, weights=weights, cascade_order=order,
+                                                      score_keys={'dnn': 'dnn', 'cnn': 'cnn', specialist: 'lightgbm'},
+                                                      **self.scorer_options)
+        return self.scorers[specialist]
+
+    def prefilter(self, X_scaled):
+        """iso_forest decision_function of every scaled flow (NaN when the pre-filter is off or unavailable)."""
+
+        anomaly = np.full(len(X_scaled), np.nan)
+        if self.prefilter_threshold is None or not len(X_scaled):
+            return anomaly
+        try:
+            model = self.registry.get('iso_forest')
+        except ModelUnavailable:
+            return anomaly
+        return model.decision_function(X_scaled)
+
+    def score_batch(self, X, protocols=None):
+        X = as_matrix(X, self.dtype)
+        n_rows = len(X)
+        X_scaled = self.transform(X)
+
+        anomaly = self.prefilter(X_scaled)
+        route = np.full(n_rows, ROUTES.index('non_web'))
+        web = np.isin(X[:, FEATURE_INDEX['Destination Port']], self.web_ports)
+        if protocols is not None:
+            web &= tcp_mask(protocols)
+        route[web] = ROUTES.index('web')
+        if self.prefilter_threshold is not None:
+            route[anomaly > self.prefilter_threshold] = ROUTES.index('prefilter')
+
+        # Pre-filtered flows keep these defaults
+        scores = {field: np.full(n_rows, np.nan) for field in SCORE_FIELDS}
+        scores['prediction'] = np.zeros(n_rows, dtype=np.int64)
+        scores['confidence'] = np.zeros(n_rows)
+        dedup = {'rows': 0, 'unique': 0, 'cache_hits': 0}
+        cascade = {'rows': 0, 'early_exits': 0}
+
+        for code, name in enumerate(ROUTES):
+            rows = np.flatnonzero(route == code)
+            self.routed[name] += len(rows)
+            if name == 'prefilter' or not len(rows):
+                continue
+
+            part = self.scorer_for(name).score_batch(X_scaled, scaled=True, rows=rows)
+            for field in SCORE_FIELDS:
+                scores[field][rows] = part[field]
+            for key in dedup:
+                dedup[key] += part['dedup'][key]
+            for key in cascade:
+                cascade[key] += part['cascade'][key]
+
+        # Pre-filtered rows count as served without running the models
+        dedup['rows'] = n_rows
+        scores.update({
+            'route': np.array(ROUTES)[route],
+            'anomaly_score': anomaly,
+            'dedup': dedup,
+            'cascade': cascade
+        })
+        return scores
+
+    def score_one(self, features, protocol=None):
+        return result_at(self.score_batch(row_from_features(features), protocols_of(protocol)), 0)
+
+    def score_stream(self, chunks):
+        for X in chunks:
+            yield self.score_batch(X)
+
+    def metrics(self):
+        scorers = [self.base] + list(self.scorers.values())
+        scored_rows = sum(scorer.scored_rows for scorer in scorers)
+        early_exits = sum(scorer.early_exits for scorer in scorers)
+        return {
+            **self.base.metrics(),
+            'scored_rows': scored_rows,
+            'early_exits': early_exits,
+            'early_exit_ratio': (early_exits / scored_rows) if scored_rows else 0.0,
+            'routing': True,
+            'routed': dict(self.routed),
+            'specialists': sorted(self.scorers)
+        }
@@ -0,0 +1,247 @@
+# -*- encoding: utf-8 -*-
+"""
+Canonical CICIDS2017 feature schema expected by scaler.pkl and the models.
+"""
+
+import logging
+import re
+from functools import lru_cache
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Model features in the order the scaler and the models were trained on
+FEATURES = [
+    'Destination Port', 'Flow Duration', 'Total Fwd Packets', 'Total Backward Packets',
+    'Total Length of Fwd Packets', 'Total Length of Bwd Packets', 'Fwd Packet Length Max',
+    'Fwd Packet Length Min', 'Fwd Packet Length Mean', 'Fwd Packet Length Std',
+    'Bwd Packet Length Max', 'Bwd Packet Length Min', 'Bwd Packet Length Mean',
+    'Bwd Packet Length Std', 'Flow Bytes/s', 'Flow Packets/s', 'Flow IAT Mean',
+    'Flow IAT Std', 'Flow IAT Max', 'Flow IAT Min', 'Fwd IAT Total', 'Fwd IAT Mean',
+    'Fwd IAT Std', 'Fwd IAT Max', 'Fwd IAT Min', 'Bwd IAT Total', 'Bwd IAT Mean',
+    'Bwd IAT Std', 'Bwd IAT Max', 'Bwd IAT Min', 'Fwd PSH Flags', 'Bwd PSH Flags',
+    'Fwd URG Flags', 'Bwd URG Flags', 'Fwd Header Length', 'Bwd Header Length',
+    'Fwd Packets/s', 'Bwd Packets/s', 'Min Packet Length', 'Max Packet Length',
+    'Packet Length Mean', 'Packet Length Std', 'Packet Length Variance', 'FIN Flag Count',
+    'SYN Flag Count', 'RST Flag Count', 'PSH Flag Count', 'ACK Flag Count',
+    'URG Flag Count', 'CWE Flag Count', 'ECE Flag Count', 'Down/Up Ratio',
+    'Average Packet Size', 'Avg Fwd Segment Size', 'Avg Bwd Segment Size',
+    'Fwd Header Length.1', 'Fwd Avg Bytes/Bulk', 'Fwd Avg Packets/Bulk',
+    'Fwd Avg Bulk Rate', 'Bwd Avg Bytes/Bulk', 'Bwd Avg Packets/Bulk',
+    'Bwd Avg Bulk Rate', 'Subflow Fwd Packets', 'Subflow Fwd Bytes',
+    'Subflow Bwd Packets', 'Subflow Bwd Bytes', 'Init_Win_bytes_forward',
+    'Init_Win_bytes_backward', 'act_data_pkt_fwd', 'min_seg_size_forward'
+]
+
+N_FEATURES = len(FEATURES)
+
+FEATURE_INDEX = {feature: i for i, feature in enumerate(FEATURES)}
+
+# Columns present in CICIDS exports that are not model inputs
+EXCLUDE_COLUMNS = ['Unnamed: 0', 'Label', 'label', 'Label_encoded', 'Attack_Type']
+
+# CICFlowMeter-V3 / CSE-CIC-IDS2018 names of the CICIDS2017 features
+ALIASES = {
+    'Dst Port': 'Destination Port',
+    'Tot Fwd Pkts': 'Total Fwd Packets',
+    'Tot Bwd Pkts': 'Total Backward Packets',
+    'TotLen Fwd Pkts': 'Total Length of Fwd Packets',
+    'TotLen Bwd Pkts': 'Total Length of Bwd Packets',
+    'Fwd Pkt Len Max': 'Fwd Packet Length Max',
+    'Fwd Pkt Len Min': 'Fwd Packet Length Min',
+    'Fwd Pkt Len Mean': 'Fwd Packet Length Mean',
+    'Fwd Pkt Len Std': 'Fwd Packet Length Std',
+    'Bwd Pkt Len Max': 'Bwd Packet Length Max',
+    'Bwd Pkt Len Min': 'Bwd Packet Length Min',
+    'Bwd Pkt Len Mean': 'Bwd Packet Length Mean',
+    'Bwd Pkt Len Std': 'Bwd Packet Length Std',
+    'Flow Byts/s': 'Flow Bytes/s',
+    'Flow Pkts/s': 'Flow Packets/s',
+    'Fwd IAT Tot': 'Fwd IAT Total',
+    'Bwd IAT Tot': 'Bwd IAT Total',
+    'Fwd Header Len': 'Fwd Header Length',
+    'Bwd Header Len': 'Bwd Header Length',
+    'Fwd Pkts/s': 'Fwd Packets/s',
+    'Bwd Pkts/s': 'Bwd Packets/s',
+    'Pkt Len Min': 'Min Packet Length',
+    'Pkt Len Max': 'Max Packet Length',
+    'Pkt Len Mean': 'Packet Length Mean',
+    'Pkt Len Std': 'Packet Length Std',
+    'Pkt Len Var': 'Packet Length Variance',
+    'FIN Flag Cnt': 'FIN Flag Count',
+    'SYN Flag Cnt': 'SYN Flag Count',
+    'RST Flag Cnt': 'RST Flag Count',
+    'PSH Flag Cnt': 'PSH Flag Count',
+    'ACK Flag Cnt': 'ACK Flag Count',
+    'URG Flag Cnt': 'URG Flag Count',
+    'CWE Flag Cnt': 'CWE Flag Count',
+    'ECE Flag Cnt': 'ECE Flag Count',
+    'Pkt Size Avg': 'Average Packet Size',
+    'Fwd Seg Size Avg': 'Avg Fwd Segment Size',
+    'Bwd Seg Size Avg': 'Avg Bwd Segment Size',
+    'Fwd Byts/b Avg': 'Fwd Avg Bytes/Bulk',
+    'Fwd Pkts/b Avg': 'Fwd Avg Packets/Bulk',
+    'Fwd Blk Rate Avg': 'Fwd Avg Bulk Rate',
+    'Bwd Byts/b Avg': 'Bwd Avg Bytes/Bulk',
+    'Bwd Pkts/b Avg': 'Bwd Avg Packets/Bulk',
+    'Bwd Blk Rate Avg': 'Bwd Avg Bulk Rate',
+    'Subflow Fwd Pkts': 'Subflow Fwd Packets',
+    'Subflow Fwd Byts': 'Subflow Fwd Bytes',
+    'Subflow Bwd Pkts': 'Subflow Bwd Packets',
+    'Subflow Bwd Byts': 'Subflow Bwd Bytes',
+    'Init Fwd Win Byts': 'Init_Win_bytes_forward',
+    'Init Bwd Win Byts': 'Init_Win_bytes_backward',
+    'Fwd Act Data Pkts': 'act_data_pkt_fwd',
+    'Fwd Seg Size Min': 'min_seg_size_forward',
+}
+
+# CICIDS2017 duplicates 'Fwd Header Length'; exports without the copy reuse the original
+FALLBACKS = {'Fwd Header Length.1': 'Fwd Header Length'}
+
+
+def normalize_name(name):
+    # CICIDS2017 headers carry stray leading spaces (' Destination Port'); match case-insensitively
+    return re.sub(r'\s+', ' ', str(name)).strip().lower()
+
+
+# Normalised name (canonical or alias) -> canonical feature
+CANONICAL_NAMES = {normalize_name(feature): feature for feature in FEATURES}
+CANONICAL_NAMES.update({normalize_name(alias): feature for alias, feature in ALIASES.items()})
+
+
+def canonical_name(name):
+    """Canonical feature for a header or field name, or None if it is not a model feature."""
+    return CANONICAL_NAMES.get(normalize_name(name))
+
+
+def is_protocol(name):
+    """True for the Protocol column / field: not a model input, but used to route flows."""
+    return normalize_name(name) == 'protocol'
+
+
+class SchemaMapper:
+    """Mapping from one CSV header to the model's feature columns.
+
+    Compiled once per distinct header (see get_mapper); ``transform`` then
+    builds the schema-ordered matrix of a frame in one allocation.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        excluded = {normalize_name(col) for col in EXCLUDE_COLUMNS}
+        candidates = [(pos, col) for pos, col in enumerate(self.columns)
+                      if normalize_name(col) not in excluded]
+
+        # Headerless exports: numbered columns, the first N_FEATURES in numeric order
+        numbered = sorted((int(col), pos) for pos, col in candidates if str(col).strip().isdigit())
+        self.numbered = len(numbered) >= N_FEATURES
+
+        if self.numbered:
+            self.positions = np.array([pos for _, pos in numbered[:N_FEATURES]])
+        else:
+            self.positions = np.full(N_FEATURES, -1)
+            for pos, col in candidates:
+                feature = canonical_name(col)
+                # First matching column wins (an exact name and an alias may both be present)
+                if feature is not None and self.positions[FEATURE_INDEX[feature]] < 0:
+                    self.positions[FEATURE_INDEX[feature]] = pos
+            for feature, source in FALLBACKS.items():
+                if self.positions[FEATURE_INDEX[feature]] < 0:
+                    self.positions[FEATURE_INDEX[feature]] = self.positions[FEATURE_INDEX[source]]
+
+        self.present = np.flatnonzero(self.positions >= 0)
+        self.missing = [FEATURES[i] for i in np.flatnonzero(self.positions < 0)]
+
+        protocol = [pos for pos, col in candidates if normalize_name(col) == 'protocol']
+        self.protocol_position = protocol[0] if protocol else None
+
+    @property
+    def usecols(self):
+        """Positions of the CSV columns the analysis reads (features and Protocol)."""
+        positions = set(self.positions[self.present].tolist())
+        if self.protocol_position is not None:
+            positions.add(self.protocol_position)
+        return sorted(positions)
+
+    def describe(self):
+        if self.numbered:
+            return f"Using numbered columns {self.columns[self.positions[0]]}-{self.columns[self.positions[-1]]}: {N_FEATURES} features"
+        return (f"Matched features: {len(self.present)}, missing (filled with zeros): {len(self.missing)}, "
+                f"discarding: {len(self.columns) - len(set(self.usecols))} columns")
+
+    def transform(self, df, dtype=np.float64):
+        """Schema-ordered matrix of df (a frame with this mapper's header).
+
+        Missing and infinite values are replaced with 0, in place.
+        """
+
+        if len(self.present) == N_FEATURES:
+            X = df.iloc[:, self.positions].to_numpy(dtype=dtype)
+        else:
+            X = np.zeros((len(df), N_FEATURES), dtype=dtype)
+            X[:, self.present] = df.iloc[:, self.positions[self.present]].to_numpy(dtype=dtype)
+        # A float64 frame can hand back a read-only view of its own data
+        return np.nan_to_num(X, copy=not X.flags.writeable, nan=0.0, posinf=0.0, neginf=0.0)
+
+    def protocols(self, df):
+        """Protocol column of df as a list, or None if the header has none."""
+        if self.protocol_position is None:
+            return None
+        return df.iloc[:, self.protocol_position].tolist()
+
+
+@lru_cache(maxsize=128)
+def _compile_mapper(columns):
+    mapper = SchemaMapper(columns)
+    # Once per distinct header, not per request
+    logger.debug(mapper.describe())
+    return mapper
+
+
+def get_mapper(columns):
+    """Cached SchemaMapper for a header (any iterable of column names)."""
+    return _compile_mapper(tuple(columns))
+
+
+def preview_records(df, rows=10):
+    """First rows of an uploaded frame, without the non-feature columns, for the dashboard."""
+    excluded = {normalize_name(col) for col in EXCLUDE_COLUMNS}
+    columns = [col for col in df.columns if normalize_name(col) not in excluded]
+    return df[columns].head(rows).to_dict('records')
+
+
+def vector_from_mapping(data):
+    """Build a single feature row from a ``{feature name: value}`` mapping.
+
+    Names may be canonical or aliases; unknown names are ignored and missing
+    features default to 0.
+    """
+    return features_from_mapping(data)[0]
+
+
+def features_from_mapping(data):
+    """``(row, protocol, unknown, missing)`` of a ``{feature name: value}`` mapping.
+
+    Same policy as every /predict variant: names may be canonical or
+    aliases, Protocol is returned apart (None when absent), other unknown
+    names are ignored and listed in ``unknown``, and features that are not
+    sent default to 0 and are listed in ``missing``. Missing and infinite
+    values are replaced with 0, as in SchemaMapper.transform.
+    """
+
+    row = np.zeros((1, N_FEATURES), dtype=np.float64)
+    protocol, unknown, seen = None, [], set()
+    for name, value in data.items():
+        feature = canonical_name(name)
+        if feature is None:
+            if is_protocol(name):
+                protocol = value
+            else:
+                unknown.append(name)
+            continue
+        seen.add(feature)
+        if value not in (None, ''):
+            row[0, FEATURE_INDEX[feature]] = float(value)
+    missing = [feature for feature in FEATURES if feature not in seen]
+    return np.nan_to_num(row, copy=False, nan=0.0, posinf=0.0, neginf=0.0), protocol, unknown, missing
@@ -0,0 +1,398 @@
+# -*- encoding: utf-8 -*-
+"""
+Ensemble scoring engine (scaler -> DNN + CNN + LightGBM -> weighted average).
+"""
+
+import numpy as np
+
+from apps.ids.registry import ModelUnavailable
+from apps.ids.schema import FEATURES, N_FEATURES, vector_from_mapping
+
+# Ensemble weights, by registry name: DNN, CNN, LightGBM (group model)
+ENSEMBLE_WEIGHTS = {'dnn': 0.4, 'cnn': 0.3, 'group': 0.3}
+
+# Key of each member's individual score in the results
+SCORE_KEYS = {'dnn': 'dnn', 'cnn': 'cnn', 'group': 'lightgbm'}
+
+# Rows handed to each model per call
+DEFAULT_CHUNK_SIZE = 8192
+
+# Ensemble score above which a flow is flagged as an attack
+DECISION_THRESHOLD = 0.5
+
+# Cascade mode: members in increasing cost order (LightGBM, dense DNN, then the CNN)
+CASCADE_ORDER = ('group', 'dnn', 'cnn')
+
+# Cascade mode: margin kept around the threshold so rounding cannot flip an early decision
+CASCADE_MARGIN = 1e-9
+
+
+# Fields of a score_batch result, one value per row
+SCORE_FIELDS = ('prediction', 'confidence') + tuple(SCORE_KEYS.values())
+
+# Odd 64-bit multipliers of the two row hashes (fixed, so hashes are stable across workers)
+HASH_MULTIPLIERS = np.random.default_rng(0x1D5).integers(1, 2**63, size=(2, N_FEATURES), dtype=np.uint64) | np.uint64(1)
+
+
+def as_matrix(X, dtype=np.float64):
+    """X as a matrix of dtype in schema order, or ValueError."""
+    X = np.asarray(X, dtype=dtype)
+    if X.ndim != 2 or X.shape[1] != N_FEATURES:
+        raise ValueError(f'Feature count mismatch: got {X.shape[-1]}, expected {N_FEATURES}')
+    return X
+
+
+def row_hashes(X, rows=None):
+    """Two independent 64-bit hashes of the bits of each row (or of rows), as an ``(n, 2)`` uint64 array."""
+    # float32 rows are hashed as pairs of values (70 features = 35 words)
+    if X.dtype != np.float32:
+        X = np.asarray(X, dtype=np.float64)
+    multipliers = HASH_MULTIPLIERS[:, :X.shape[1] * X.itemsize // 8].T
+
+    # Row chunks bound the copies of gathered rows and column-major inputs (e.g. DataFrame values)
+    n_rows = len(X) if rows is None else len(rows)
+    hashes = np.empty((n_rows, 2), dtype=np.uint64)
+    for start in range(0, n_rows, DEFAULT_CHUNK_SIZE):
+        stop = start + DEFAULT_CHUNK_SIZE
+        chunk = X[start:stop] if rows is None else X[rows[start:stop]]
+        # Integer matmul wraps around modulo 2**64
+        np.matmul(np.ascontiguousarray(chunk).view(np.uint64), multipliers, out=hashes[start:stop])
+    return hashes
+
+
+def dedup_rows(hashes):
+    """Distinct rows given their row_hashes.
+
+    Returns ``(first, inverse)``: the index of the first occurrence of each
+    distinct row, and for every row its position in ``first``. Rows are
+    grouped on the first hash and the second one must agree within each
+    group; if it does not (a 64-bit collision), both are used.
+    """
+
+    _, first, inverse = np.unique(hashes[:, 0], return_index=True, return_inverse=True)
+    if not np.array_equal(hashes[first[inverse], 1], hashes[:, 1]):
+        _, first, inverse = np.unique(hashes, axis=0, return_index=True, return_inverse=True)
+    return first, inverse.ravel()
+
+
+def reshape_cnn(X_scaled):
+    # The CNN takes each row as a (features, 1) sequence (a view of contiguous rows)
+    return X_scaled.reshape(len(X_scaled), -1, 1)
+
+
+def take_rows(X, rows=None):
+    return X if rows is None else X[rows]
+
+
+def scale_into(X, scaler, out, rows=None):
+    """MinMax-scale X (or its given rows) into out, in place: ``out = X * scale_ + min_``.
+
+    Same operations and precision as ``MinMaxScaler.transform``, without
+    its input validation or an intermediate copy of gathered rows. Returns out.
+    """
+
+    if rows is None:
+        np.multiply(X, scaler.scale_, out=out)
+    else:
+        np.take(X, rows, axis=0, out=out, mode='clip')  # mode='raise' buffers a copy
+        np.multiply(out, scaler.scale_, out=out)
+    np.add(out, scaler.min_, out=out)
+    if getattr(scaler, 'clip', False):
+        np.clip(out, *scaler.feature_range, out=out)
+    return out
+
+
+# Attack score of each member on a scaled chunk
+MEMBER_PREDICT = {
+    # predict_on_batch skips the tf.data pipeline that predict() builds per call
+    'dnn': lambda model, chunk: np.asarray(model.predict_on_batch(chunk))[:, 0],
+    'cnn': lambda model, chunk: np.asarray(model.predict_on_batch(reshape_cnn(chunk)))[:, 0],
+    'group': lambda model, chunk: model.predict_proba(chunk)[:, 1],
+    # Specialists (see routing): class 0 is benign, the web model has two attack classes
+    'web': lambda model, chunk: 1.0 - model.predict_proba(chunk)[:, 0],
+    'non_web': lambda model, chunk: 1.0 - model.predict_proba(chunk)[:, 0],
+}
+
+
+class EnsembleScorer:
+    """Single scoring path used by every endpoint, backed by a ModelRegistry.
+
+    ``score_batch`` returns a dict of NumPy arrays, one entry per row:
+    ``prediction``, ``confidence`` and the individual ``dnn``, ``cnn`` and
+    ``lightgbm`` scores. If an ensemble member is unavailable the remaining
+    weights are renormalised and its individual scores are NaN.
+
+    With dedup, identical rows of a batch are scaled and scored once; with a
+    ScoreCache, rows already scored by an earlier batch are not scored again.
+
+    dtype is the precision of the feature matrix through scaling and the
+    models (float64 by default; float32 halves its memory, the models
+    compute in float32 anyway). Scores are always float64.
+
+    A batch is scaled once, into a single new matrix (only its distinct,
+    uncached rows with dedup) that every member reads: the CNN gets a view
+    of it and the cascade stages gather their rows one chunk at a time.
+
+    In cascade mode the members run one after the other in cascade_order,
+    each on the rows still undecided. Every member score lies in [0, 1], so
+    after each stage a row's final score is bounded by its partial weighted
+    sum and that sum plus the weight still to come; rows whose bounds are
+    both on the same side of the threshold exit with that label, which is
+    the label the full ensemble would give. Their confidence is the
+    renormalised average over the members that ran (on the same side of the
+    threshold) and the skipped members' scores are NaN.
+    """
+
+    features = FEATURES
+
+    def __init__(self, registry, weights=ENSEMBLE_WEIGHTS, chunk_size=DEFAULT_CHUNK_SIZE,
+                 dedup=True, cache=None, cascade=False, cascade_order=CASCADE_ORDER,
+                 score_keys=SCORE_KEYS, dtype=np.float64):
+        self.registry = registry
+        self.dtype = np.dtype(dtype)
+        self.weights = weights
+        self.score_keys = score_keys
+        self.chunk_size = chunk_size
+        self.dedup = dedup
+        self.cache = cache
+        self.cascade = cascade
+        self.cascade_order = cascade_order
+
+        # Metrics (rows scored, rows that skipped at least one member)
+        self.scored_rows = 0
+        self.early_exits = 0
+
+    def ready(self):
+        """True if the scaler and at least one ensemble member can be served."""
+        return (self.registry.available('scaler')
+                and any(self.registry.available(name) for name in self.weights))
+
+    def members(self):
+        """Loaded ensemble members as ``(name, weight, model)``, skipping unavailable ones."""
+
+        members = []
+        for name, weight in self.weights.items():
+            try:
+                members.append((name, weight, self.registry.get(name)))
+            except ModelUnavailable:
+                continue
+
+        if not members:
+            raise ModelUnavailable('No ensemble model available')
+        return members
+
+    def transform(self, X, rows=None):
+        """Scale a raw feature matrix (DataFrame or array) in schema order, or only its given rows.
+
+        MinMax scalers are applied in place on one preallocated matrix (see
+        scale_into); any other scaler goes through its own transform.
+        """
+
+        X = as_matrix(X, self.dtype)
+        n_rows = len(X) if rows is None else len(rows)
+        if not n_rows:
+            # sklearn rejects empty inputs
+            return np.empty((0, X.shape[1]), dtype=self.dtype)
+
+        scaler = self.registry.get('scaler')
+        if not hasattr(scaler, 'min_'):
+            return scaler.transform(X if rows is None else X[rows])
+        return scale_into(X, scaler, np.empty((n_rows, X.shape[1]), dtype=self.dtype), rows)
+
+    def predict_member(self, name, model, X_scaled, rows=None):
+        """Attack scores of one member on a scaled matrix (or its given rows), chunk_size rows per call."""
+
+        n_rows = len(X_scaled) if rows is None else len(rows)
+        scores = np.empty(n_rows, dtype=np.float64)
+        for start in range(0, n_rows, self.chunk_size):
+            stop = min(start + self.chunk_size, n_rows)
+            chunk = X_scaled[start:stop] if rows is None else X_scaled[rows[start:stop]]
+            scores[start:stop] = MEMBER_PREDICT[name](model, chunk)
+        return scores
+
+    def score_scaled(self, X_scaled):
+        """Score an already scaled matrix, one call per model and chunk.
+
+        ``scores['cascade']`` counts the rows scored and those that exited
+        the cascade early (always 0 outside cascade mode).
+        """
+
+        n_rows = len(X_scaled)
+        members = self.members()
+        if self.cascade:
+            member_scores, confidences, early_exits = self.score_cascade(X_scaled, members)
+        else:
+            member_scores = {name: self.predict_member(name, model, X_scaled) for name, _, model in members}
+            confidences = sum(member_scores[name] * weight for name, weight, _ in members)
+            if len(members) < len(self.weights):
+                # Degraded ensemble: renormalise over the members that are available
+                confidences = confidences / sum(weight for _, weight, _ in members)
+            early_exits = 0
+
+        self.scored_rows += n_rows
+        self.early_exits += early_exits
+
+        scores = {
+            'prediction': (confidences > DECISION_THRESHOLD).astype(np.int64),
+            'confidence': confidences,
+        }
+        for name, key in self.score_keys.items():
+            scores[key] = member_scores.get(name, np.full(n_rows, np.nan))
+        scores['cascade'] = {'rows': n_rows, 'early_exits': early_exits}
+        return scores
+
+    def score_cascade(self, X_scaled, members):
+        """Run the members in cascade_order on the rows they can still flip.
+
+        Returns ``(member_scores, confidences, early_exits)``.
+        """
+
+        n_rows = len(X_scaled)
+        total = sum(weight for _, weight, _ in members)
+        rank = {name: i for i, name in enumerate(self.cascade_order)}
+        ordered = sorted(members, key=lambda member: rank.get(member[0], len(rank)))
+
+        member_scores = {name: np.full(n_rows, np.nan) for name, _, _ in members}
+        partial = np.zeros(n_rows)     # weighted sum of the scores so far, over total
+        done = np.zeros(n_rows)        # weight of the members run so far, over total
+        remaining = 1.0
+        active = np.arange(n_rows)
+
+        for i, (name, weight, model) in enumerate(ordered):
+            scores = self.predict_member(name, model, X_scaled, active)
+            member_scores[name][active] = scores
+            partial[active] += scores * (weight / total)
+            done[active] += weight / total
+            remaining -= weight / total
+
+            if i == len(ordered) - 1:
+                break
+            # Decided whatever the remaining members say
+            low, high = partial[active], partial[active] + remaining
+            decided = (low > DECISION_THRESHOLD + CASCADE_MARGIN) | (high <= DECISION_THRESHOLD - CASCADE_MARGIN)
+            active = active[~decided]
+            if not len(active):
+                break
+
+        confidences = partial / done
+        # Rows still active ran every member: same formula (and summation order) as the full ensemble
+        if len(active):
+            confidences[active] = sum(member_scores[name][active] * weight for name, weight, _ in members)
+            if len(members) < len(self.weights):
+                confidences[active] /= total
+        return member_scores, confidences, n_rows - len(active)
+
+    def metrics(self):
+        return {
+            'cascade': self.cascade,
+            'cascade_order': list(self.cascade_order),
+            'scored_rows': self.scored_rows,
+            'early_exits': self.early_exits,
+            'early_exit_ratio': (self.early_exits / self.scored_rows) if self.scored_rows else 0.0
+        }
+
+    def score_batch(self, X, protocols=None, scaled=False, rows=None):
+        """Score a raw feature matrix (rows in schema order), an already scaled one, or only their given rows.
+
+        ``scores['dedup']`` counts the ``rows`` scored, the ``unique`` ones and
+        the unique rows found in the score cache (``cache_hits``). protocols
+        is only used by RoutedScorer and accepted here for the same interface.
+        Scaled rows are hashed as they are: a score cache must not be shared
+        between callers passing raw and scaled matrices.
+        """
+
+        X = as_matrix(X, self.dtype)
+        n_rows = len(X) if rows is None else len(rows)
+        transform = take_rows if scaled else self.transform
+        if not (self.dedup or self.cache) or not n_rows:
+            scores = self.score_scaled(transform(X, rows))
+            scores['dedup'] = {'rows': n_rows, 'unique': n_rows, 'cache_hits': 0}
+            return scores
+
+        hashes = row_hashes(X, rows)
+        if self.dedup:
+            first, inverse = dedup_rows(hashes)
+        else:
+            first, inverse = np.arange(n_rows), None
+        hashes = hashes[first]
+
+        if self.cache:
+            hit, cached = self.cache.lookup(hashes)
+        else:
+            hit, cached = np.zeros(len(first), dtype=bool), None
+
+        # Scores of the distinct rows: cached ones, then the rest scored in one pass
+        unique_scores = {field: np.empty(len(first), dtype=np.int64 if field == 'prediction' else np.float64)
+                         for field in SCORE_FIELDS}
+        if hit.any():
+            for field in SCORE_FIELDS:
+                unique_scores[field][hit] = cached[field]
+        if not hit.all():
+            fresh = self.score_scaled(transform(X, first[~hit] if rows is None else rows[first[~hit]]))
+            for field in SCORE_FIELDS:
+                unique_scores[field][~hit] = fresh[field]
+            if self.cache:
+                self.cache.store(hashes[~hit], fresh)
+
+        scores = unique_scores if inverse is None else {field: values[inverse] for field, values in unique_scores.items()}
+        scores['dedup'] = {'rows': n_rows, 'unique': len(first), 'cache_hits': int(hit.sum())}
+        scores['cascade'] = fresh['cascade'] if not hit.all() else {'rows': 0, 'early_exits': 0}
+        return scores
+
+    def score_one(self, features, protocol=None):
+        """Score one flow given as a ``{feature: value}`` mapping or a schema-ordered sequence."""
+        return result_at(self.score_batch(row_from_features(features), protocols_of(protocol)), 0)
+
+    def score_stream(self, chunks):
+        """Score an iterable of raw feature matrices, yielding one result dict per chunk."""
+        for X in chunks:
+            yield self.score_batch(X)
+
+
+def protocols_of(protocol):
+    """score_batch protocols argument for one flow (None when its Protocol is unknown)."""
+    return None if protocol is None else [protocol]
+
+
+def row_from_features(features):
+    """One-row feature matrix from a ``{feature: value}`` mapping or a schema-ordered sequence."""
+
+    if hasattr(features, 'get'):
+        return vector_from_mapping(features)
+
+    row = np.asarray(features, dtype=np.float64).reshape(1, -1)
+    if row.shape[1] != N_FEATURES:
+        raise ValueError(f'Feature count mismatch: got {row.shape[1]}, expected {N_FEATURES}')
+    return np.nan_to_num(row, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def dedup_ratio(dedup):
+    """Share of the rows of a score_batch call that were not run through the models."""
+    if not dedup['rows']:
+        return 0.0
+    return 1.0 - (dedup['unique'] - dedup['cache_hits']) / dedup['rows']
+
+
+def early_exit_ratio(cascade):
+    """Share of the rows scored by the models that skipped at least one member."""
+    if not cascade['rows']:
+        return 0.0
+    return cascade['early_exits'] / cascade['rows']
+
+
+def result_at(scores, i):
+    """The /predict response for row i of a score_batch result."""
+
+    result = {
+        'prediction': int(scores['prediction'][i]),
+        'confidence': float(scores['confidence'][i]),
+        'individual_scores': {
+            key: (None if np.isnan(scores[key][i]) else float(scores[key][i]))
+            for key in SCORE_KEYS.values()
+        }
+    }
+    if 'route' in scores:
+        # Routed scoring (see routing.RoutedScorer)
+        result['route'] = str(scores['route'][i])
+        result['anomaly_score'] = None if np.isnan(scores['anomaly_score'][i]) else float(scores['anomaly_score'][i])
+    return result
@@ -0,0 +1,341 @@
+# -*- encoding: utf-8 -*-
+"""
+Streaming ingestion: NDJSON flow records from sensors, scored in micro-batches with bounded queues.
+
+The same sessions serve POST /predict/stream (chunked HTTP) and a socket
+listener, run from the repository root:
+
+    python -m apps.ids.stream --tcp 0.0.0.0:9400
+    python -m apps.ids.stream --unix /run/ids/stream.sock --attacks-only
+
+One JSON record per line: ``{feature: value, ...}`` (names or aliases, an
+optional ``Protocol`` and an ``id`` echoed back) or a list of the 70 values
+in schema order. One verdict line is streamed back per record, in order;
+as on /predict, unknown names are ignored and features not sent are 0, and
+the verdict lists them (``unknown_features`` / ``missing_features``).
+
+The listener scores records as the app does: its scorer is built from the
+same settings (SCORING_PRECISION, SCORING_CASCADE, SCORING_ROUTING, ... see
+apps/config.py), read from the environment.
+"""
+
+import argparse
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+
+import numpy as np
+
+from apps.ids.engine import build_scorer, config_settings
+from apps.ids.registry import BACKENDS
+from apps.ids.schema import features_from_mapping
+from apps.ids.scoring import result_at, row_from_features
+
+# Records scored per ensemble call
+DEFAULT_MAX_BATCH_SIZE = 1024
+
+# Milliseconds a record may wait for its batch to fill
+DEFAULT_MAX_LATENCY_MS = 200
+
+# Parsed records waiting per stream; when full the stream is no longer read
+# until the scorer catches up, so TCP flow control slows the sensor down
+DEFAULT_MAX_QUEUE = 8192
+
+# Streams served at once
+DEFAULT_MAX_SESSIONS = 16
+
+# Longest record line accepted, in bytes
+DEFAULT_MAX_LINE_BYTES = 65536
+
+# Seconds between checks for a closed stream while the queue is full
+POLL_INTERVAL = 0.5
+
+# Queued after the last record of a stream
+END = object()
+
+
+def iter_lines(stream, max_line_bytes):
+    """Non-blank lines of a binary stream; None for a line longer than max_line_bytes (skipped)."""
+
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        if len(line) > max_line_bytes and not line.endswith(b'\n'):
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(max_line_bytes + 1)
+            yield None
+        elif line.strip():
+            yield line
+
+
+def parse_record(line):
+    """``(row, protocol, id, unknown, missing)`` of one NDJSON record; ValueError if it is not a flow record."""
+
+    try:
+        record = json.loads(line)
+        if isinstance(record, dict):
+            record_id = record.pop('id', None)
+            row, protocol, unknown, missing = features_from_mapping(record)
+            return row, protocol, record_id, unknown, missing
+        return row_from_features(record), None, None, [], []
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid record: {e}')
+
+
+class StreamIngestor:
+    """Scores streams of NDJSON flow records, one micro-batch at a time.
+
+    Each stream gets a reader thread that parses its lines into a queue of
+    at most max_queue records; ``session`` collects up to max_batch_size
+    queued records (waiting at most max_latency_ms after the first one),
+    scores them in one call and yields their verdicts. A slow scorer fills
+    the queue, which blocks the reader: memory per stream stays bounded and
+    the sender is throttled by the transport. Invalid records get an error
+    verdict and do not fail their batch. With an AuditLog, the verdicts of
+    each scored batch are audited along with the session's context.
+    """
+
+    def __init__(self, scorer, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_latency_ms=DEFAULT_MAX_LATENCY_MS,
+                 max_queue=DEFAULT_MAX_QUEUE, max_sessions=DEFAULT_MAX_SESSIONS,
+                 max_line_bytes=DEFAULT_MAX_LINE_BYTES, audit=None):
+        self.scorer = scorer
+        self.audit = audit
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.max_queue = max_queue
+        self.max_sessions = max_sessions
+        self.max_line_bytes = max_line_bytes
+        self._sessions = threading.BoundedSemaphore(max_sessions)
+
+        # Metrics
+        self.sessions = 0
+        self.active_sessions = 0
+        self.rejected_sessions = 0
+        self.records = 0
+        self.errors = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.backpressure_waits = 0
+
+    def ready(self):
+        return self.scorer.ready()
+
+    def available(self):
+        return self.active_sessions < self.max_sessions
+
+    def _put(self, records, item, closed):
+        """Queue item, waiting while the queue is full; False if the session closed meanwhile."""
+
+        if records.full():
+            self.backpressure_waits += 1
+        while not closed.is_set():
+            try:
+                records.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read(self, stream, records, closed):
+        # Items are (record number, row, protocol, id, unknown names, missing features, error)
+        n = 0
+        try:
+            for line in iter_lines(stream, self.max_line_bytes):
+                if line is None:
+                    item = (n, None, None, None, [], [], f'Record longer than {self.max_line_bytes} bytes')
+                else:
+                    try:
+                        item = (n, *parse_record(line), None)
+                    except ValueError as e:
+                        item = (n, None, None, None, [], [], str(e))
+                if not self._put(records, item, closed):
+                    return
+                n += 1
+        except (OSError, ValueError) as e:
+            # Connection reset, truncated chunked body...
+            self._put(records, (n, None, None, None, [], [], f'Stream error: {e}'), closed)
+        finally:
+            self._put(records, END, closed)
+
+    def session(self, stream, **context):
+        """Yield the verdicts of the records read from a binary stream, one list per micro-batch.
+
+        context (e.g. the client address) is added to the audited verdicts.
+        """
+
+        if not self._sessions.acquire(blocking=False):
+            self.rejected_sessions += 1
+            yield [{'error': 'Too many streams'}]
+            return
+
+        records = queue.Queue(maxsize=self.max_queue)
+        closed = threading.Event()
+        reader = threading.Thread(target=self._read, args=(stream, records, closed),
+                                  name='stream-reader', daemon=True)
+        self.sessions += 1
+        self.active_sessions += 1
+        reader.start()
+        try:
+            done = False
+            while not done:
+                batch = [records.get()]
+                deadline = time.monotonic() + self.max_latency
+                while batch[-1] is not END and len(batch) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(records.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+
+                self.max_queue_depth = max(self.max_queue_depth, records.qsize() + len(batch))
+                if batch[-1] is END:
+                    batch.pop()
+                    done = True
+                if batch:
+                    yield self._score(batch, context)
+        finally:
+            # Client gone or stream over: release the reader
+            closed.set()
+            self.active_sessions -= 1
+            self._sessions.release()
+
+    def _score(self, batch, context):
+        valid = [item for item in batch if item[6] is None]
+        scores, error = None, None
+        if valid:
+            X = np.vstack([item[1] for item in valid])
+            protocols = [item[2] for item in valid]
+            if None in protocols:
+                protocols = None
+            try:
+                scores = self.scorer.score_batch(X, protocols)
+            except Exception as e:
+                error = str(e)
+            if self.audit and scores is not None:
+                self.audit.log_batch('/predict/stream', X, scores, records=[item[0] for item in valid],
+                                     protocols=protocols, **context)
+
+        verdicts = []
+        position = 0
+        for n, _, _, record_id, unknown, missing, item_error in batch:
+            verdict = {'record': n}
+            if record_id is not None:
+                verdict['id'] = record_id
+            if item_error is None and error is None:
+                verdict.update(result_at(scores, position))
+                # Same policy as /predict, reported only when there is something to report
+                if unknown:
+                    verdict['unknown_features'] = unknown
+                if missing:
+                    verdict['missing_features'] = missing
+            else:
+                verdict['error'] = item_error or error
+            position += item_error is None
+            verdicts.append(verdict)
+
+        self.batches += 1
+        self.records += len(batch)
+        self.errors += sum(1 for verdict in verdicts if 'error' in verdict)
+        return verdicts
+
+    def lines(self, stream, attacks_only=False, **context):
+        """NDJSON response body of a stream: one chunk per micro-batch."""
+
+        for verdicts in self.session(stream, **context):
+            chunk = ''.join(json.dumps(verdict) + '\n' for verdict in verdicts
+                            if not attacks_only or verdict.get('prediction', 1))
+            if chunk:
+                yield chunk.encode()
+
+    def metrics(self):
+        return {
+            'sessions': self.sessions,
+            'active_sessions': self.active_sessions,
+            'rejected_sessions': self.rejected_sessions,
+            'records': self.records,
+            'errors': self.errors,
+            'batches': self.batches,
+            'mean_batch_size': (self.records / self.batches) if self.batches else 0.0,
+            'max_queue_depth': self.max_queue_depth,
+            'backpressure_waits': self.backpressure_waits,
+            'max_batch_size': self.max_batch_size,
+            'max_latency_ms': self.max_latency * 1000.0,
+            'max_queue': self.max_queue
+        }
+
+
+class StreamHandler(socketserver.StreamRequestHandler):
+    """One sensor connection: records in, verdicts back on the same socket."""
+
+    def handle(self):
+        chunks = self.server.ingestor.lines(self.rfile, self.server.attacks_only)
+        try:
+            for chunk in chunks:
+                self.wfile.write(chunk)
+        except OSError:
+            # Sensor disconnected before reading its verdicts
+            pass
+        finally:
+            chunks.close()
+
+
+class TCPStreamServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixStreamServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    listen = parser.add_mutually_exclusive_group(required=True)
+    listen.add_argument('--tcp', metavar='HOST:PORT', help='TCP address listened on')
+    listen.add_argument('--unix', metavar='PATH', help='Unix socket listened on')
+    parser.add_argument('--model-dir', default=os.getenv('MODEL_DIR', '.'))
+    parser.add_argument('--backend', default=os.getenv('MODEL_BACKEND', 'keras'), choices=BACKENDS)
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument('--max-latency-ms', type=float, default=DEFAULT_MAX_LATENCY_MS)
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE)
+    parser.add_argument('--max-sessions', type=int, default=DEFAULT_MAX_SESSIONS)
+    parser.add_argument('--max-line-bytes', type=int, default=DEFAULT_MAX_LINE_BYTES)
+    parser.add_argument('--attacks-only', action='store_true', help='only send back flows flagged as attacks')
+    args = parser.parse_args()
+
+    scorer = build_scorer(config_settings(MODEL_DIR=args.model_dir, MODEL_BACKEND=args.backend))
+    ingestor = StreamIngestor(scorer, max_batch_size=args.max_batch_size, max_latency_ms=args.max_latency_ms,
+                              max_queue=args.max_queue, max_sessions=args.max_sessions,
+                              max_line_bytes=args.max_line_bytes)
+
+    if args.tcp:
+        host, _, port = args.tcp.rpartition(':')
+        server = TCPStreamServer((host or '0.0.0.0', int(port)), StreamHandler)
+    else:
+        if os.path.exists(args.unix):
+            # Left over by a previous run
+            os.unlink(args.unix)
+        server = UnixStreamServer(args.unix, StreamHandler)
+    server.ingestor = ingestor
+    server.attacks_only = args.attacks_only
+
+    print(f'Listening on {args.tcp or args.unix}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps({'stats': ingestor.metrics()}), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
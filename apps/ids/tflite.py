@@ -0,0 +1,60 @@
+# -*- encoding: utf-8 -*-
+"""
+TFLite serving backend: runs the exported DNN/CNN with the LiteRT interpreter instead of tf.keras.
+"""
+
+import threading
+
+import numpy as np
+
+# Interpreter threads per model (None = runtime default); set per worker by workers.init_worker
+NUM_THREADS = None
+
+
+def interpreter_class():
+    """The lightest available TFLite interpreter: LiteRT, tflite-runtime, then TensorFlow's own."""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """A .tflite model behind the ``predict_on_batch`` interface of the Keras models.
+
+    The input tensor is resized to each batch's shape (the models are
+    exported with a dynamic batch dimension). An interpreter is not thread
+    safe, so calls are serialised.
+    """
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = interpreter_class()(model_path=path,
+                                               num_threads=num_threads if num_threads is not None else NUM_THREADS)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(self.input['shape'])
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, x):
+        x = np.ascontiguousarray(x, dtype=self.input['dtype'])
+        if not len(x):
+            return np.zeros((0,) + tuple(self.output['shape'][1:]), dtype=np.float32)
+
+        with self._lock:
+            if x.shape != self.input_shape:
+                self.interpreter.resize_tensor_input(self.input['index'], x.shape)
+                self.interpreter.allocate_tensors()
+                self.input_shape = x.shape
+            self.interpreter.set_tensor(self.input['index'], x)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output['index'])
+
+    def predict(self, x, verbose=0):
+        return self.predict_on_batch(x)
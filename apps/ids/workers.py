@@ -0,0 +1,74 @@
+# -*- encoding: utf-8 -*-
+"""
+Helpers for multi-worker (gunicorn) deployments: fork-safe preloading and memory reports.
+"""
+
+import gc
+import os
+import resource
+
+# Plain sklearn / LightGBM pickles: safe to load in the gunicorn master and
+# share copy-on-write with the forked workers
+FORK_SAFE_MODELS = ('scaler', 'group', 'web', 'non_web', 'iso_forest')
+
+# Keras models (or their TFLite exports): TensorFlow starts its thread pools on
+# import and interpreters own theirs, so they are only ever loaded inside a worker, after fork
+WORKER_MODELS = ('dnn', 'cnn')
+
+
+def preload_shared(registry):
+    """Load the fork-safe artifacts in the current (master) process.
+
+    gc.freeze() moves everything allocated so far out of the collector's
+    generations, so collections in the workers do not touch (and copy) the
+    pages holding the shared models.
+    """
+    registry.preload(FORK_SAFE_MODELS)
+    gc.freeze()
+
+
+def init_worker(registry, tf_threads=0):
+    """Initialise the serving backend and load the Keras models in a freshly forked worker."""
+
+    if tf_threads and registry.backend.startswith('tflite'):
+        from apps.ids import tflite
+        tflite.NUM_THREADS = tf_threads
+    elif tf_threads:
+        # Keep N workers from each spawning one TensorFlow thread per core
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(tf_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(tf_threads)
+
+    registry.preload(WORKER_MODELS)
+
+
+def memory_report(registry=None):
+    """Memory of the current process in MB.
+
+    On Linux ``shared`` is memory still shared with other processes (e.g. the
+    models inherited from the gunicorn master) and ``pss`` is this worker's
+    proportional share, the number to sum when sizing the worker count.
+    """
+
+    report = {'pid': os.getpid()}
+    try:
+        kb = {}
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                # "Rss:   123456 kB" lines; the first line is the address range
+                if len(parts) == 3 and parts[0].endswith(':'):
+                    kb[parts[0][:-1]] = int(parts[1])
+        report.update({
+            'rss_mb': kb['Rss'] / 1024,
+            'pss_mb': kb['Pss'] / 1024,
+            'shared_mb': (kb['Shared_Clean'] + kb['Shared_Dirty']) / 1024,
+            'private_mb': (kb['Private_Clean'] + kb['Private_Dirty']) / 1024,
+        })
+    except (OSError, KeyError, ValueError):
+        # No smaps_rollup (not Linux, or kernel < 4.14): peak RSS only, in platform units
+        report['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if registry is not None:
+        report['loaded_models'] = sorted(name for name, status in registry.status().items() if status['loaded'])
+    return report
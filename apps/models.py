@@ -1,6 +1,9 @@
 from apps import db
 from datetime import datetime
 
+# Schema changes of these models ship as revisions under migrations/
+# (FLASK_APP=run.py flask db upgrade); db.create_all() never adds columns
+
 
 # Book Sample
 class Book(db.Model):
@@ -11,11 +14,17 @@ class Book(db.Model):
 class AnalysisResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
-    total_records = db.Column(db.Integer, nullable=False)
-    attacks_detected = db.Column(db.Integer, nullable=False)
-    benign_traffic = db.Column(db.Integer, nullable=False)
+    total_records = db.Column(db.Integer, nullable=False, default=0)
+    attacks_detected = db.Column(db.Integer, nullable=False, default=0)
+    benign_traffic = db.Column(db.Integer, nullable=False, default=0)
     analysis_date = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, nullable=True)
+
+    # Background job tracking (see apps.ids.jobs)
+    status = db.Column(db.String(20), nullable=False, default='done')  # queued, running, done, failed
+    processed_records = db.Column(db.Integer, nullable=False, default=0)
+    upload_path = db.Column(db.String(255))
+    error = db.Column(db.Text)
     
     def __repr__(self):
         return f'<AnalysisResult {self.filename}: {self.attacks_detected}/{self.total_records} attacks>'
@@ -23,15 +32,37 @@ class AnalysisResult(db.Model):
 # Individual Attack Detection Records
 class DetectionRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    analysis_id = db.Column(db.Integer, db.ForeignKey('analysis_result.id'), nullable=False)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('analysis_result.id'), nullable=False, index=True)
     record_index = db.Column(db.Integer, nullable=False)
-    prediction = db.Column(db.Integer, nullable=False)  # 0 = benign, 1 = attack
-    confidence = db.Column(db.Float, nullable=False)
+    prediction = db.Column(db.Integer, nullable=False, index=True)  # 0 = benign, 1 = attack
+    confidence = db.Column(db.Float, nullable=False, index=True)
     protocol = db.Column(db.String(50))
     flow_duration = db.Column(db.Float)
     total_packets = db.Column(db.Integer)
     
     analysis = db.relationship('AnalysisResult', backref=db.backref('records', lazy=True))
+
+    __table_args__ = (
+        # "attacks above confidence X" within one analysis, and listing it in file order
+        db.Index('ix_detection_record_analysis_prediction_confidence', 'analysis_id', 'prediction', 'confidence'),
+        db.Index('ix_detection_record_analysis_record_index', 'analysis_id', 'record_index'),
+    )
     
     def __repr__(self):
-        return f'<DetectionRecord {self.id}: {"ATTACK" if self.prediction else "BENIGN"}>'
\ No newline at end of file
+        return f'<DetectionRecord {self.id}: {"ATTACK" if self.prediction else "BENIGN"}>'
+
+# Audit trail of the verdicts served by /predict and /analyze_csv (see apps.ids.audit)
+class AuditRecord(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    endpoint = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    analysis_id = db.Column(db.Integer, nullable=True, index=True)
+    record_index = db.Column(db.Integer)
+    prediction = db.Column(db.Integer, nullable=False)
+    confidence = db.Column(db.Float, nullable=False)
+    protocol = db.Column(db.String(50))
+    features = db.Column(db.Text)  # submitted /predict features, as JSON
+
+    def __repr__(self):
+        return f'<AuditRecord {self.id}: {self.endpoint} {"ATTACK" if self.prediction else "BENIGN"}>'
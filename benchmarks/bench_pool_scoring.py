@@ -0,0 +1,78 @@
+# -*- encoding: utf-8 -*-
+"""
+Scaling of the process-pool scorer: rows/second for 1..N worker processes vs the in-process scorer.
+
+Run from the repository root:
+
+    python benchmarks/bench_pool_scoring.py --rows 400000 --workers 1 2 4 8
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from apps.ids.pool import PoolScorer  # noqa: E402
+from apps.ids.registry import ModelRegistry  # noqa: E402
+from apps.ids.scoring import EnsembleScorer  # noqa: E402
+
+
+def timed(scorer, X, repeat):
+    """Scores of X and the best wall time over repeat runs."""
+    scores, best = None, float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scores = scorer.score_batch(X)
+        best = min(best, time.perf_counter() - start)
+    return scores, best
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=400000)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, 8, cores} & set(range(1, cores + 1))))
+    parser.add_argument('--shard-rows', type=int, help='rows per shard (default: rows / (4 x workers))')
+    parser.add_argument('--threads', type=int, default=1, help='native threads per worker')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    registry = ModelRegistry('.')
+    scaler = registry.get('scaler')
+    rng = np.random.default_rng(args.seed)
+    # Unique rows, so dedup does not shrink the work
+    X = rng.uniform(scaler.data_min_, scaler.data_max_, size=(args.rows, scaler.n_features_in_))
+    print(f"{args.rows} rows, {cores} cores, {args.threads} thread(s) per worker")
+
+    # dedup and the single-process baseline use the same thread budget as one worker
+    options = dict(dedup=False)
+    os.environ['OMP_NUM_THREADS'] = str(args.threads)
+    baseline = EnsembleScorer(registry, **options)
+    baseline.score_batch(X[:64])
+    expected, baseline_seconds = timed(baseline, X, args.repeat)
+    print(f"{'in-process':<12}: {args.rows / baseline_seconds:12.0f} rows/s")
+
+    for workers in args.workers:
+        shard_rows = args.shard_rows or -(-args.rows // (4 * workers))
+        scorer = PoolScorer(registry, EnsembleScorer, options, workers=workers,
+                            shard_rows=shard_rows, threads=args.threads)
+        # Warm-up: spawn the workers and load their models
+        scorer.score_batch(X[:shard_rows * workers + 1])
+        got, seconds = timed(scorer, X, args.repeat)
+        scorer.shutdown()
+
+        speedup = baseline_seconds / seconds
+        same = (np.array_equal(got['prediction'], expected['prediction'])
+                and np.allclose(got['confidence'], expected['confidence'], rtol=0, atol=1e-6))
+        print(f"{workers:>2} worker(s) : {args.rows / seconds:12.0f} rows/s  {speedup:5.2f}x  "
+              f"efficiency {speedup / workers:6.1%}  shards of {shard_rows}  identical: {same}")
+
+
+if __name__ == '__main__':
+    main()
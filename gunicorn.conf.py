@@ -0,0 +1,36 @@
+# -*- encoding: utf-8 -*-
+"""
+Gunicorn configuration for the IDS app (loaded automatically by `gunicorn` from this directory).
+
+    PRELOAD_MODELS=True gunicorn
+
+With PRELOAD_MODELS=True the app is imported once in the master: the sklearn/LightGBM
+artifacts are loaded there and shared copy-on-write with every worker, while the Keras
+models (TensorFlow) are loaded in each worker after fork.
+"""
+
+import multiprocessing
+import os
+
+wsgi_app = 'run:app'
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+
+preload_app = (os.getenv('PRELOAD_MODELS', 'False') == 'True')
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+
+    # TensorFlow is first imported here, in the worker, never in the master
+    from apps.ids.workers import init_worker
+    from run import app
+    init_worker(app.registry, tf_threads=app.config['TF_THREADS'])
+
+
+def post_worker_init(worker):
+    from apps.ids.workers import memory_report
+    from run import app
+    worker.log.info('Worker memory: %s', memory_report(app.registry))
@@ -0,0 +1,80 @@
+"""Baseline schema: users, OAuth tokens, books and analysis results
+
+Revision ID: 3b1d8c0e5f21
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1d8c0e5f21'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    # Tables db.create_all() may already have created are left as they are
+    if not has_table('Users'):
+        op.create_table('Users',
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('username', sa.String(length=64), nullable=True),
+                        sa.Column('email', sa.String(length=64), nullable=True),
+                        sa.Column('password', sa.LargeBinary(), nullable=True),
+                        sa.Column('oauth_github', sa.String(length=100), nullable=True),
+                        sa.Column('api_token', sa.String(length=100), nullable=True),
+                        sa.Column('api_token_ts', sa.Integer(), nullable=True),
+                        sa.PrimaryKeyConstraint('id'),
+                        sa.UniqueConstraint('email'),
+                        sa.UniqueConstraint('username'))
+    if not has_table('flask_dance_oauth'):
+        op.create_table('flask_dance_oauth',
+                        sa.Column('user_id', sa.Integer(), nullable=False),
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('provider', sa.String(length=50), nullable=False),
+                        sa.Column('created_at', sa.DateTime(), nullable=False),
+                        sa.Column('token', sa.JSON(), nullable=False),
+                        sa.ForeignKeyConstraint(['user_id'], ['Users.id'], ondelete='cascade'),
+                        sa.PrimaryKeyConstraint('id'))
+    if not has_table('book'):
+        op.create_table('book',
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('title', sa.String(length=64), nullable=True),
+                        sa.PrimaryKeyConstraint('id'))
+    if not has_table('analysis_result'):
+        op.create_table('analysis_result',
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('filename', sa.String(length=255), nullable=False),
+                        sa.Column('total_records', sa.Integer(), nullable=False),
+                        sa.Column('attacks_detected', sa.Integer(), nullable=False),
+                        sa.Column('benign_traffic', sa.Integer(), nullable=False),
+                        sa.Column('analysis_date', sa.DateTime(), nullable=True),
+                        sa.Column('user_id', sa.Integer(), nullable=True),
+                        sa.PrimaryKeyConstraint('id'))
+    if not has_table('detection_record'):
+        op.create_table('detection_record',
+                        sa.Column('id', sa.Integer(), nullable=False),
+                        sa.Column('analysis_id', sa.Integer(), nullable=False),
+                        sa.Column('record_index', sa.Integer(), nullable=False),
+                        sa.Column('prediction', sa.Integer(), nullable=False),
+                        sa.Column('confidence', sa.Float(), nullable=False),
+                        sa.Column('protocol', sa.String(length=50), nullable=True),
+                        sa.Column('flow_duration', sa.Float(), nullable=True),
+                        sa.Column('total_packets', sa.Integer(), nullable=True),
+                        sa.ForeignKeyConstraint(['analysis_id'], ['analysis_result.id']),
+                        sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    op.drop_table('detection_record')
+    op.drop_table('analysis_result')
+    op.drop_table('book')
+    op.drop_table('flask_dance_oauth')
+    op.drop_table('Users')
@@ -0,0 +1,44 @@
+"""Background job tracking columns of analysis_result
+
+Revision ID: 8e4a2f7c1d90
+Revises: 3b1d8c0e5f21
+Create Date: 2026-10-18 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e4a2f7c1d90'
+down_revision = '3b1d8c0e5f21'
+branch_labels = None
+depends_on = None
+
+COLUMNS = (
+    # Analyses stored before background jobs were complete ('done')
+    sa.Column('status', sa.String(length=20), nullable=False, server_default='done'),
+    sa.Column('processed_records', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('upload_path', sa.String(length=255), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+)
+
+
+def existing_columns(table):
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    present = existing_columns('analysis_result')
+    for column in COLUMNS:
+        if column.name not in present:
+            op.add_column('analysis_result', column.copy())
+    if 'processed_records' not in present:
+        # Stored analyses were processed in full
+        op.execute('UPDATE analysis_result SET processed_records = total_records')
+
+
+def downgrade():
+    with op.batch_alter_table('analysis_result') as batch_op:
+        for column in reversed(COLUMNS):
+            batch_op.drop_column(column.name)
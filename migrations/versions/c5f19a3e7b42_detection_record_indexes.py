@@ -0,0 +1,40 @@
+"""Indexes of detection_record for filtered / paginated record queries
+
+Revision ID: c5f19a3e7b42
+Revises: 8e4a2f7c1d90
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f19a3e7b42'
+down_revision = '8e4a2f7c1d90'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('ix_detection_record_analysis_id', ['analysis_id']),
+    ('ix_detection_record_prediction', ['prediction']),
+    ('ix_detection_record_confidence', ['confidence']),
+    ('ix_detection_record_analysis_prediction_confidence', ['analysis_id', 'prediction', 'confidence']),
+    ('ix_detection_record_analysis_record_index', ['analysis_id', 'record_index']),
+)
+
+
+def existing_indexes(table):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    present = existing_indexes('detection_record')
+    for name, columns in INDEXES:
+        if name not in present:
+            op.create_index(name, 'detection_record', columns)
+
+
+def downgrade():
+    for name, _ in reversed(INDEXES):
+        op.drop_index(name, table_name='detection_record')
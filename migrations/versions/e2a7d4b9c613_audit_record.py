@@ -0,0 +1,42 @@
+"""Table of the verdict audit log (audit_record)
+
+Revision ID: e2a7d4b9c613
+Revises: c5f19a3e7b42
+Create Date: 2026-10-18 09:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7d4b9c613'
+down_revision = 'c5f19a3e7b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table('audit_record'):
+        # Already created by db.create_all()
+        return
+    op.create_table('audit_record',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('created_at', sa.DateTime(), nullable=False),
+                    sa.Column('endpoint', sa.String(length=50), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=True),
+                    sa.Column('analysis_id', sa.Integer(), nullable=True),
+                    sa.Column('record_index', sa.Integer(), nullable=True),
+                    sa.Column('prediction', sa.Integer(), nullable=False),
+                    sa.Column('confidence', sa.Float(), nullable=False),
+                    sa.Column('protocol', sa.String(length=50), nullable=True),
+                    sa.Column('features', sa.Text(), nullable=True),
+                    sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_audit_record_created_at', 'audit_record', ['created_at'])
+    op.create_index('ix_audit_record_analysis_id', 'audit_record', ['analysis_id'])
+
+
+def downgrade():
+    op.drop_index('ix_audit_record_analysis_id', table_name='audit_record')
+    op.drop_index('ix_audit_record_created_at', table_name='audit_record')
+    op.drop_table('audit_record')
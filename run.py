@@ -1,9 +1,7 @@
 import os
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 import pickle
 import pandas as pd
-import joblib
-import tensorflow as tf
 import numpy as np
 from flask_migrate import Migrate
 from flask_minify import Minify
@@ -12,6 +10,19 @@ from sys import exit
 # from api_generator.commands import gen_api  # Désactivé pour éviter les erreurs
 from apps.config import config_dict
 from apps import create_app, db
+from apps.ids.columnar import ColumnarCache
+from apps.ids.engine import build_scorer
+from apps.ids.jobs import AnalysisJobs
+from apps.ids.audit import AuditLog
+from apps.ids.batching import MicroBatcher
+from apps.ids.payloads import (ARROW_MIMETYPES, NPY_MIMETYPES, PayloadError,
+                               matrix_from_arrow, matrix_from_json, matrix_from_npy)
+from apps.ids.registry import ModelRegistry
+from apps.ids.result_cache import ResultCache
+from apps.ids.schema import features_from_mapping
+from apps.ids.scoring import SCORE_KEYS, dedup_ratio, early_exit_ratio
+from apps.ids.stream import StreamIngestor
+from apps.ids.workers import memory_report, preload_shared
 
 # Configuration de l'application
 DEBUG = (os.getenv('DEBUG', 'False') == 'True')
@@ -25,34 +36,63 @@ except KeyError:
 # Création de l'application Flask
 app = create_app(app_config)
 
-# Charger tous les modèles de l'ensemble
-models_loaded = False
-scaler = model_dnn = model_cnn = model_group = model_web = model_non_web = iso_forest = None
-
-try:
-    scaler = joblib.load('scaler.pkl')
-    model_dnn = tf.keras.models.load_model('ids_dnn_model.h5')
-    model_cnn = tf.keras.models.load_model('ids_cnn_model.h5')
-    model_group = joblib.load('ids_lightgbm_model_group.pkl')
-    model_web = joblib.load('ids_lightgbm_model_web.pkl')
-    model_non_web = joblib.load('ids_lightgbm_model_non_web.pkl')
-    iso_forest = joblib.load('ids_isolation_forest.pkl')
-    models_loaded = True
-    print("Tous les modèles chargés avec succès")
-    
-    # Store models in app context
-    app.models_loaded = True
-    app.scaler = scaler
-    app.model_dnn = model_dnn
-    app.model_cnn = model_cnn
-    app.model_group = model_group
-    app.model_web = model_web
-    app.model_non_web = model_non_web
-    app.iso_forest = iso_forest
-except Exception as e:
-    print(f"Erreur lors du chargement des modèles: {e}")
-    models_loaded = False
-    app.models_loaded = False
+# Registre des modèles : chaque artefact est chargé à sa première utilisation
+# (DNN/CNN via Keras ou via leurs exports TFLite, selon MODEL_BACKEND)
+app.registry = ModelRegistry(app.config['MODEL_DIR'], backend=app.config['MODEL_BACKEND'])
+# Moteur de scoring selon les réglages SCORING_* (précision, déduplication, cache des
+# scores, cascade, routage, pool de processus), le même que pour les outils en ligne de commande
+app.scorer = build_scorer(app.config, app.registry)
+
+# /predict : regroupement optionnel des requêtes concurrentes en micro-lots
+app.predictor = app.scorer
+if app.config['PREDICT_BATCHING']:
+    app.predictor = MicroBatcher(app.scorer,
+                                 max_batch_size=app.config['PREDICT_MAX_BATCH_SIZE'],
+                                 max_latency_ms=app.config['PREDICT_MAX_LATENCY_MS'])
+
+# Journal d'audit des verdicts de /predict et /analyze_csv (variantes par lots, en flux et
+# tâches de fond comprises), écrit par lots en arrière-plan
+app.audit = None
+if app.config['AUDIT_LOG'] or app.config['AUDIT_DB']:
+    app.audit = AuditLog(app.config['AUDIT_LOG'],
+                         compress=app.config['AUDIT_LOG_COMPRESS'],
+                         app=app if app.config['AUDIT_DB'] else None,
+                         flush_rows=app.config['AUDIT_FLUSH_ROWS'],
+                         flush_interval=app.config['AUDIT_FLUSH_SECONDS'],
+                         max_queue=app.config['AUDIT_MAX_QUEUE'],
+                         rotate_bytes=app.config['AUDIT_ROTATE_MB'] * 2**20,
+                         rotate_seconds=app.config['AUDIT_ROTATE_HOURS'] * 3600,
+                         backups=app.config['AUDIT_BACKUPS'])
+
+# /predict/stream : flux NDJSON continus des capteurs, scorés par micro-lots (files bornées)
+app.stream = StreamIngestor(app.scorer,
+                            max_batch_size=app.config['STREAM_MAX_BATCH_SIZE'],
+                            max_latency_ms=app.config['STREAM_MAX_LATENCY_MS'],
+                            max_queue=app.config['STREAM_MAX_QUEUE'],
+                            max_sessions=app.config['STREAM_MAX_SESSIONS'],
+                            max_line_bytes=app.config['STREAM_MAX_LINE_BYTES'],
+                            audit=app.audit)
+
+# Avec gunicorn --preload, ceci s'exécute dans le master : les modèles sklearn/LightGBM
+# sont partagés en copy-on-write ; les modèles Keras sont chargés dans chaque worker (post_fork)
+if app.config['PRELOAD_MODELS']:
+    preload_shared(app.registry)
+# Copies en colonnes (Arrow IPC) des CSV déjà analysés, par empreinte du contenu
+app.columnar = ColumnarCache(os.path.join('uploads', 'columnar')) if app.config['COLUMNAR_CACHE'] else None
+
+# Résultats de /analyze_csv par contenu d'upload, invalidés si un fichier de modèle change
+app.result_cache = None
+if app.config['RESULT_CACHE_ENTRIES']:
+    app.result_cache = ResultCache(app.registry,
+                                   max_entries=app.config['RESULT_CACHE_ENTRIES'],
+                                   max_mb=app.config['RESULT_CACHE_MB'])
+
+app.jobs = AnalysisJobs(app, app.scorer,
+                        max_workers=app.config['ANALYSIS_WORKERS'],
+                        chunk_rows=app.config['CSV_CHUNK_ROWS'],
+                        insert_batch=app.config['DETECTION_INSERT_BATCH'],
+                        cache=app.columnar,
+                        audit=app.audit)
   
 
 # @app.route('/')
@@ -62,59 +102,113 @@ except Exception as e:
 @app.route('/predict', methods=['POST'])
 def predict():
     try:
-        # Récupérer les données du formulaire
-        data = request.form.to_dict()
-        data_to_predict = [float(data[feature]) for feature in data.keys()]
-
-        # Liste des noms de caractéristiques utilisés lors de l'entraînement du modèle
-        feature_names = [
-            'Unnamed: 0', 'Source Port', 'Destination Port', 'Protocol', 'Flow Duration', 'Total Fwd Packets',
-            'Total Backward Packets', 'Total Length of Fwd Packets', 'Total Length of Bwd Packets',
-            'Fwd Packet Length Max', 'Fwd Packet Length Min', 'Fwd Packet Length Mean',
-            'Fwd Packet Length Std', 'Bwd Packet Length Max', 'Bwd Packet Length Min',
-            'Bwd Packet Length Mean', 'Bwd Packet Length Std', 'Flow Bytes/s', 'Flow Packets/s',
-            'Flow IAT Mean', 'Flow IAT Std', 'Flow IAT Max', 'Flow IAT Min', 'Fwd IAT Total', 'Fwd IAT Mean',
-            'Fwd IAT Std', 'Fwd IAT Max', 'Fwd IAT Min', 'Bwd IAT Total', 'Bwd IAT Mean', 'Bwd IAT Std',
-            'Bwd IAT Max', 'Bwd IAT Min', 'Bwd Header Length', 'Fwd Packets/s', 'Bwd Packets/s',
-            'Min Packet Length', 'Max Packet Length', 'Packet Length Mean', 'Packet Length Std',
-            'Packet Length Variance', 'Average Packet Size', 'Avg Fwd Segment Size', 'Avg Bwd Segment Size',
-            'Subflow Fwd Packets', 'Subflow Fwd Bytes', 'Subflow Bwd Packets', 'Subflow Bwd Bytes',
-            'Init Fwd Win Byts', 'Init Bwd Win Byts', 'Fwd Act Data Pkts', 'Fwd Seg Size Min', 'Active Mean',
-            'Active Std', 'Active Max', 'Active Min', 'Idle Mean', 'Idle Std', 'Idle Max', 'Idle Min'
-        ]
-
-        # Convertir les données en DataFrame pandas
-        data_to_predict_df = pd.DataFrame([data_to_predict], columns=feature_names)
-
-        # Faire une prédiction avec l'ensemble
-        if not models_loaded:
+        # Récupérer les caractéristiques (objet JSON ou formulaire, noms du schéma)
+        data = request.get_json() if request.is_json else request.form.to_dict()
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Objet JSON attendu'}), 400
+
+        if not app.predictor.ready():
             return jsonify({'error': 'Modèles non disponibles'}), 500
-            
-        # Préprocessing
-        X_scaled = scaler.transform(data_to_predict_df)
-        
-        # Prédictions de chaque modèle
-        pred_dnn = model_dnn.predict(X_scaled, verbose=0)[0][0]
-        pred_cnn = model_cnn.predict(X_scaled.reshape(1, -1, 1), verbose=0)[0][0]
-        pred_group = model_group.predict_proba(X_scaled)[0][1]
-        
-        # Ensemble final (moyenne pondérée)
-        ensemble_pred = (pred_dnn * 0.4 + pred_cnn * 0.3 + pred_group * 0.3)
-        final_prediction = 1 if ensemble_pred > 0.5 else 0
-        
+
+        # Prédiction avec l'ensemble partagé avec /analyze_csv ; mêmes règles que
+        # /predict/batch : noms inconnus ignorés et signalés, caractéristiques absentes à 0
+        row, protocol, unknown, missing = features_from_mapping(data)
+        result = app.predictor.score_one(row, protocol)
+        if app.audit:
+            app.audit.log_prediction(data, result, remote_addr=request.remote_addr)
+        return jsonify({**result, 'missing_features': missing, 'unknown_features': unknown})
+    except Exception as e:
+        # Renvoyer une erreur en cas d'exception
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/models/status')
+def models_status():
+    # État de chaque modèle : présent sur disque, chargé, temps de chargement, erreur ;
+    # succès / échecs des caches d'uploads et de résultats
+    return jsonify({
+        'ready': app.scorer.ready(),
+        'models': app.registry.status(),
+        'columnar_cache': app.columnar.metrics() if app.columnar else {'enabled': False},
+        'result_cache': app.result_cache.metrics() if app.result_cache else None,
+        'score_cache': app.scorer.cache.metrics() if app.scorer.cache else None
+    })
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    # Plusieurs flux en un seul appel : JSON, .npy (application/x-npy) ou Arrow IPC
+    try:
+        if not app.scorer.ready():
+            return jsonify({'error': 'Modèles non disponibles'}), 500
+
+        if request.mimetype in ARROW_MIMETYPES:
+            payload = matrix_from_arrow(request.get_data())
+        elif request.mimetype in NPY_MIMETYPES:
+            # Noms des colonnes d'un tableau 2D simple (sinon ordre du schéma)
+            names = request.headers.get('X-Feature-Names')
+            payload = matrix_from_npy(request.get_data(), names.split(',') if names else None)
+        else:
+            payload = matrix_from_json(request.get_json(force=True))
+        X = payload.X
+
+        if len(X) > app.config['PREDICT_MAX_FLOWS']:
+            return jsonify({'error': f"Trop de flux : {len(X)} > {app.config['PREDICT_MAX_FLOWS']}"}), 413
+
+        # La colonne Protocol, si elle est envoyée, sert au routage web / non-web
+        scores = app.scorer.score_batch(X, payload.protocols)
+        if app.audit:
+            app.audit.log_batch('/predict/batch', X, scores, protocols=payload.protocols,
+                                remote_addr=request.remote_addr)
         return jsonify({
-            'prediction': final_prediction,
-            'confidence': float(ensemble_pred),
+            'count': len(X),
+            'predictions': scores['prediction'].tolist(),
+            'confidences': scores['confidence'].tolist(),
             'individual_scores': {
-                'dnn': float(pred_dnn),
-                'cnn': float(pred_cnn), 
-                'lightgbm': float(pred_group)
-            }
+                key: [None if np.isnan(v) else v for v in scores[key].tolist()]
+                for key in SCORE_KEYS.values()
+            },
+            'missing_features': payload.missing,
+            'unknown_features': payload.unknown,
+            'dedup_ratio': dedup_ratio(scores['dedup']),
+            'early_exit_ratio': early_exit_ratio(scores['cascade']),
+            # Mode routé (SCORING_ROUTING) : partition et score d'anomalie de chaque flux
+            **({'routes': scores['route'].tolist(),
+                'anomaly_scores': [None if np.isnan(v) else v for v in scores['anomaly_score'].tolist()]}
+               if 'route' in scores else {})
         })
+    except PayloadError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        # Renvoyer une erreur en cas d'exception
         return jsonify({'error': str(e)}), 500
 
+@app.route('/predict/stream', methods=['POST'])
+def predict_stream():
+    # Corps NDJSON (chunked) : un enregistrement de flux par ligne, un verdict renvoyé par ligne,
+    # au fil des micro-lots ; ?attacks_only=1 ne renvoie que les attaques
+    if not app.stream.ready():
+        return jsonify({'error': 'Modèles non disponibles'}), 500
+    if not app.stream.available():
+        return jsonify({'error': 'Trop de flux ouverts'}), 503
+
+    attacks_only = request.args.get('attacks_only', 0, type=int) == 1
+    lines = app.stream.lines(request.stream, attacks_only=attacks_only, remote_addr=request.remote_addr)
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+@app.route('/predict/metrics')
+def predict_metrics():
+    # Profondeur de file et taille moyenne des micro-lots (si PREDICT_BATCHING est actif),
+    # part des flux sortis tôt de la cascade (si SCORING_CASCADE est actif),
+    # activité de /predict/stream et du journal d'audit
+    extra = {'scorer': app.scorer.metrics(), 'stream': app.stream.metrics(),
+             'audit': app.audit.metrics() if app.audit else None}
+    if not isinstance(app.predictor, MicroBatcher):
+        return jsonify({'batching': False, **extra})
+    return jsonify({'batching': True, **app.predictor.metrics(), **extra})
+
+@app.route('/models/memory')
+def models_memory():
+    # Mémoire du worker qui traite la requête (RSS, PSS, partagée / privée)
+    return jsonify(memory_report(app.registry))
+
 # Initialiser Flask-Migrate
 Migrate(app, db)
 
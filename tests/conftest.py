@@ -0,0 +1,24 @@
+# -*- encoding: utf-8 -*-
+"""
+Shared fixtures: a Flask app on an in-memory SQLite database.
+"""
+
+import pytest
+
+from apps import create_app, db
+from apps.config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+@pytest.fixture
+def app():
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-
+
+import json
+import os
+
+import numpy as np
+
+from apps.ids.audit import AuditLog
+from apps.ids.schema import FEATURES, N_FEATURES
+
+
+def scores(n):
+    return {'prediction': np.arange(n) % 2, 'confidence': np.linspace(0.1, 0.9, n),
+            'dnn': np.full(n, 0.5), 'cnn': np.full(n, np.nan), 'lightgbm': np.zeros(n)}
+
+
+def written(log):
+    log.close()
+    with open(log.path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_batches_are_written_one_line_per_flow(tmp_path):
+    log = AuditLog(str(tmp_path / 'audit.jsonl'), flush_interval=0.05)
+    X = np.arange(3 * N_FEATURES, dtype=np.float32).reshape(3, N_FEATURES)
+    log.log_batch('/predict/stream', X, scores(3), records=[4, 5, 7], protocols=np.array([6, 17, 6]),
+                  remote_addr='10.0.0.1')
+
+    records = written(log)
+    assert [record['record'] for record in records] == [4, 5, 7]
+    assert records[1]['features'] == dict(zip(FEATURES, X[1].tolist()))
+    assert records[1]['protocol'] == 17 and records[1]['remote_addr'] == '10.0.0.1'
+    assert records[2]['individual_scores']['cnn'] is None
+    assert log.metrics()['lines'] == 3
+
+
+def test_analysis_chunks_keep_their_record_numbers(tmp_path):
+    log = AuditLog(str(tmp_path / 'audit.jsonl'), flush_interval=0.05)
+    columns = {'prediction': np.array([0, 1]), 'confidence': np.array([0.2, 0.8]), 'protocol': None,
+               'flow_duration': np.array([1.0, 2.0]), 'total_packets': np.array([3.0, 4.0])}
+    log.log_analysis(None, 'a.csv', columns, offset=100, endpoint='/analyze_csv/stream', user_id=1)
+
+    records = written(log)
+    assert [record['record'] for record in records] == [100, 101]
+    assert records[0]['endpoint'] == '/analyze_csv/stream' and records[0]['analysis_id'] is None
+
+
+def test_retention_covers_every_process(tmp_path):
+    # Rotated files of an exited worker and the live file of another one
+    old = [tmp_path / f'audit-111.2026010{day}T000000.jsonl' for day in range(1, 4)]
+    live = tmp_path / 'audit-222.jsonl'
+    for mtime, path in enumerate(old + [live], start=1):
+        path.write_text('{}\n')
+        os.utime(path, (mtime, mtime))
+
+    log = AuditLog(str(tmp_path / 'audit-{pid}.jsonl'), flush_interval=0.05, backups=2)
+    log.log_batch('/predict/batch', np.zeros((1, N_FEATURES)), scores(1))
+    written(log)
+    log._rotate()
+
+    rotated = sorted(path.name for path in tmp_path.glob('audit-*.*.jsonl'))
+    assert len(rotated) == 2 and old[-1].name in rotated
+    assert any(name.startswith(f'audit-{os.getpid()}.') for name in rotated)
+    assert live.exists()
@@ -0,0 +1,216 @@
+# -*- encoding: utf-8 -*-
+
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from apps.ids.flows import (CLOSE_TIMEOUT, EVICT_FRACTION, FLAG_FEATURES, SWEEP_INTERVAL, FlowBatch,
+                            FlowTable)
+from apps.ids.packets import ACK, FIN, PSH, RST, SYN, TCP, UDP, URG, Packet
+from apps.ids.schema import FEATURE_INDEX, N_FEATURES
+
+
+def make_packets(n=6000, seed=7):
+    """Random traffic between a few hundred endpoint pairs, both directions, IPv4 and IPv6."""
+
+    rng = np.random.default_rng(seed)
+    hosts = [f'10.0.{i // 250}.{i % 250 + 1}' for i in range(40)] + [f'2001:db8::{i:x}' for i in range(1, 6)]
+    pairs = []
+    for _ in range(300):
+        family = rng.integers(2)
+        a, b = rng.choice(40, size=2, replace=False) if family == 0 else 40 + rng.choice(5, size=2, replace=False)
+        proto = TCP if rng.random() < 0.8 else UDP
+        pairs.append((hosts[a], hosts[b], int(rng.integers(1024, 65535)), int(rng.choice([22, 53, 80, 443])), proto))
+
+    packets, ts = [], 1000.0
+    for _ in range(n):
+        # Mostly short gaps, sometimes long enough to hit the idle timeout
+        ts += rng.exponential(0.02) if rng.random() < 0.995 else rng.uniform(5, 12)
+        src, dst, sport, dport, proto = pairs[rng.integers(len(pairs))]
+        if rng.random() < 0.4:
+            src, dst, sport, dport = dst, src, dport, sport
+        if proto == TCP:
+            flags = int(rng.choice([ACK, ACK | PSH, SYN, ACK | URG, ACK | FIN], p=[0.6, 0.25, 0.05, 0.02, 0.08]))
+            flags |= RST if rng.random() < 0.005 else 0
+            header, window = int(rng.choice([20, 32])), int(rng.integers(0, 65535))
+        else:
+            flags, header, window = 0, 8, -1
+        payload = int(rng.choice([0, rng.integers(1, 1500)]))
+        packets.append(Packet(round(ts, 6), src, dst, sport, dport, proto, payload, header, flags, window))
+    return packets
+
+
+class ReferenceFlow:
+    def __init__(self, packet):
+        self.first = packet
+        self.packets = []
+        self.forward = []
+        self.fin_fwd = self.fin_bwd = False
+
+    @property
+    def start(self):
+        return self.first.ts
+
+    @property
+    def last(self):
+        return self.packets[-1].ts
+
+    def add(self, packet):
+        forward = (packet.src, packet.sport) == (self.first.src, self.first.sport)
+        self.packets.append(packet)
+        self.forward.append(forward)
+        if packet.flags & FIN:
+            if forward:
+                self.fin_fwd = True
+            else:
+                self.fin_bwd = True
+
+    def key(self):
+        p = self.first
+        return (p.src, p.sport, p.dst, p.dport, p.proto, p.ts)
+
+    def features(self):
+        """The 70 features computed from the flow's packets, one statistic at a time."""
+
+        def stats(values):
+            values = np.asarray(values, dtype=np.float64)
+            if not len(values):
+                return 0, 0.0, 0.0, 0.0, 0.0, 0.0
+            std = values.std(ddof=1) if len(values) > 1 else 0.0
+            return len(values), values.sum(), values.mean(), std, values.min(), values.max()
+
+        packets, forward = self.packets, self.forward
+        fwd = [p for p, f in zip(packets, forward) if f]
+        bwd = [p for p, f in zip(packets, forward) if not f]
+        duration = self.last - self.start
+
+        def per_second(count):
+            return count / duration if duration > 0 else 0.0
+
+        n, total, mean, std, low, high = stats([p.payload for p in packets])
+        fn, ftotal, fmean, fstd, flow, fhigh = stats([p.payload for p in fwd])
+        bn, btotal, bmean, bstd, blow, bhigh = stats([p.payload for p in bwd])
+        _, _, imean, istd, ilow, ihigh = stats(np.diff([p.ts for p in packets]) * 1e6)
+        _, fitotal, fimean, fistd, filow, fihigh = stats(np.diff([p.ts for p in fwd]) * 1e6)
+        _, bitotal, bimean, bistd, bilow, bihigh = stats(np.diff([p.ts for p in bwd]) * 1e6)
+
+        values = {
+            'Destination Port': self.first.dport, 'Flow Duration': duration * 1e6,
+            'Total Fwd Packets': fn, 'Total Backward Packets': bn,
+            'Total Length of Fwd Packets': ftotal, 'Total Length of Bwd Packets': btotal,
+            'Fwd Packet Length Max': fhigh, 'Fwd Packet Length Min': flow,
+            'Fwd Packet Length Mean': fmean, 'Fwd Packet Length Std': fstd,
+            'Bwd Packet Length Max': bhigh, 'Bwd Packet Length Min': blow,
+            'Bwd Packet Length Mean': bmean, 'Bwd Packet Length Std': bstd,
+            'Flow Bytes/s': per_second(total), 'Flow Packets/s': per_second(n),
+            'Flow IAT Mean': imean, 'Flow IAT Std': istd, 'Flow IAT Max': ihigh, 'Flow IAT Min': ilow,
+            'Fwd IAT Total': fitotal, 'Fwd IAT Mean': fimean, 'Fwd IAT Std': fistd,
+            'Fwd IAT Max': fihigh, 'Fwd IAT Min': filow,
+            'Bwd IAT Total': bitotal, 'Bwd IAT Mean': bimean, 'Bwd IAT Std': bistd,
+            'Bwd IAT Max': bihigh, 'Bwd IAT Min': bilow,
+            'Fwd PSH Flags': sum(bool(p.flags & PSH) for p in fwd),
+            'Bwd PSH Flags': sum(bool(p.flags & PSH) for p in bwd),
+            'Fwd URG Flags': sum(bool(p.flags & URG) for p in fwd),
+            'Bwd URG Flags': sum(bool(p.flags & URG) for p in bwd),
+            'Fwd Header Length': sum(p.header for p in fwd), 'Bwd Header Length': sum(p.header for p in bwd),
+            'Fwd Packets/s': per_second(fn), 'Bwd Packets/s': per_second(bn),
+            'Min Packet Length': low, 'Max Packet Length': high,
+            'Packet Length Mean': mean, 'Packet Length Std': std, 'Packet Length Variance': std ** 2,
+            'Down/Up Ratio': bn // fn, 'Average Packet Size': total / n,
+            'Avg Fwd Segment Size': fmean, 'Avg Bwd Segment Size': bmean,
+            'Fwd Header Length.1': sum(p.header for p in fwd),
+            'Subflow Fwd Packets': fn, 'Subflow Fwd Bytes': ftotal,
+            'Subflow Bwd Packets': bn, 'Subflow Bwd Bytes': btotal,
+            'Init_Win_bytes_forward': fwd[0].window if fwd else -1,
+            'Init_Win_bytes_backward': bwd[0].window if bwd else -1,
+            'act_data_pkt_fwd': sum(p.payload > 0 for p in fwd),
+            'min_seg_size_forward': min((p.header for p in fwd), default=0),
+        }
+        for flag, feature in FLAG_FEATURES:
+            values[feature] = sum(bool(p.flags & flag) for p in packets)
+
+        row = np.zeros(N_FEATURES)
+        for feature, value in values.items():
+            row[FEATURE_INDEX[feature]] = value
+        return row
+
+
+class ReferenceTable:
+    """The FlowTable completion rules, keeping every packet of every flow."""
+
+    def __init__(self, idle_timeout, active_timeout, max_flows):
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.max_flows = max_flows
+        self.flows = OrderedDict()
+        self.done = []
+        self.last_sweep = None
+
+    def add(self, packet):
+        if self.last_sweep is None:
+            self.last_sweep = packet.ts
+        elif packet.ts - self.last_sweep >= SWEEP_INTERVAL:
+            self.expire(packet.ts)
+
+        a, b = (packet.src, packet.sport), (packet.dst, packet.dport)
+        key = (packet.proto,) + ((a, b) if a <= b else (b, a))
+        flow = self.flows.get(key)
+        if flow is not None and (packet.ts - flow.last > self.idle_timeout
+                                 or packet.ts - flow.start > self.active_timeout):
+            self.done.append(self.flows.pop(key))
+            flow = None
+        if flow is None:
+            if len(self.flows) == self.max_flows:
+                for _ in range(max(1, int(self.max_flows * EVICT_FRACTION))):
+                    self.done.append(self.flows.popitem(last=False)[1])
+            flow = self.flows[key] = ReferenceFlow(packet)
+        else:
+            self.flows.move_to_end(key)
+        flow.add(packet)
+        if packet.flags & RST:
+            self.done.append(self.flows.pop(key))
+
+    def expire(self, now):
+        self.last_sweep = now
+        for key, flow in list(self.flows.items()):
+            closed = flow.fin_fwd and flow.fin_bwd
+            if (now - flow.last > (CLOSE_TIMEOUT if closed else self.idle_timeout)
+                    or now - flow.start > self.active_timeout):
+                self.done.append(self.flows.pop(key))
+
+    def flush(self):
+        self.done.extend(self.flows.values())
+        self.flows.clear()
+        return self.done
+
+
+@pytest.mark.parametrize('max_flows', [100000, 64])
+def test_flow_table_matches_the_reference(max_flows):
+    packets = make_packets()
+    options = dict(idle_timeout=5.0, active_timeout=20.0, max_flows=max_flows)
+
+    table = FlowTable(**options)
+    batches = []
+    for packet in packets:
+        batches += table.add(packet)
+    batches += table.flush()
+    batch = FlowBatch.concat(batches)
+
+    reference = ReferenceTable(**options)
+    for packet in packets:
+        reference.add(packet)
+    expected = {flow.key(): flow for flow in reference.flush()}
+
+    info = batch.info
+    keys = [(info['src'][i], info['sport'][i], info['dst'][i], info['dport'][i], info['protocol'][i], info['start'][i])
+            for i in range(len(batch))]
+    assert sorted(keys) == sorted(expected)
+    assert table.metrics()['completed_flows'] == len(expected)
+    if max_flows == 64:
+        assert table.metrics()['evicted_flows'] > 0
+
+    X = np.array([expected[key].features() for key in keys])
+    np.testing.assert_allclose(batch.X, X, rtol=1e-9, atol=1e-6)
+    np.testing.assert_array_equal(batch.protocols, [key[4] for key in keys])
+    assert info['packets'] == [len(expected[key].packets) for key in keys]
@@ -0,0 +1,63 @@
+# -*- encoding: utf-8 -*-
+
+import numpy as np
+
+from apps import db
+from apps.ids.jobs import AnalysisJobs
+from apps.ids.persistence import load_detections
+from apps.ids.schema import FEATURES
+from apps.models import AnalysisResult
+
+
+class FailingScorer:
+    """Scores chunks until the failing one (counted from 0)."""
+
+    dtype = np.float64
+
+    def __init__(self, fail_at):
+        self.fail_at = fail_at
+        self.calls = 0
+
+    def score_batch(self, X, protocols=None):
+        self.calls += 1
+        if self.calls > self.fail_at:
+            raise RuntimeError('model crashed')
+        n = len(X)
+        return {'prediction': np.arange(n) % 2, 'confidence': np.full(n, 0.7),
+                'dnn': np.full(n, 0.7), 'cnn': np.full(n, 0.7), 'lightgbm': np.full(n, 0.7),
+                'dedup': {'rows': n, 'unique': n, 'cache_hits': 0},
+                'cascade': {'rows': n, 'early_exits': 0}}
+
+
+def write_csv(path, rows):
+    with open(path, 'w') as f:
+        f.write(','.join(FEATURES) + '\n')
+        for i in range(rows):
+            f.write(','.join([str(i)] * len(FEATURES)) + '\n')
+    return str(path)
+
+
+def run_job(app, path, scorer):
+    # Run in the test's thread rather than on the job pool
+    jobs = AnalysisJobs(app, scorer, chunk_rows=4)
+    job = AnalysisResult(filename='flows.csv', upload_path=path, status='queued')
+    db.session.add(job)
+    db.session.commit()
+    jobs._run(job.id)
+    jobs.executor.shutdown()
+    db.session.expire_all()
+    return db.session.get(AnalysisResult, job.id)
+
+
+def test_finished_job(app, tmp_path):
+    job = run_job(app, write_csv(tmp_path / 'flows.csv', 10), FailingScorer(fail_at=10))
+    assert job.status == 'done' and job.processed_records == 10
+    assert job.attacks_detected == 5 and job.benign_traffic == 5
+    assert len(load_detections(job.id)) == 10
+
+
+def test_failed_job_keeps_no_partial_results(app, tmp_path):
+    job = run_job(app, write_csv(tmp_path / 'flows.csv', 10), FailingScorer(fail_at=2))
+    assert job.status == 'failed' and job.error == 'model crashed'
+    assert job.processed_records == job.attacks_detected == job.benign_traffic == 0
+    assert load_detections(job.id) == []
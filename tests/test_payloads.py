@@ -0,0 +1,149 @@
+# -*- encoding: utf-8 -*-
+
+import io
+import json
+
+import numpy as np
+import pytest
+
+from apps.ids.payloads import PayloadError, matrix_from_arrow, matrix_from_json, matrix_from_npy
+from apps.ids.schema import FEATURE_INDEX, FEATURES, N_FEATURES, features_from_mapping
+from apps.ids.stream import parse_record
+
+# A flow as sensors send it: aliases, Protocol and columns the models do not use
+FLOW = {'Destination Port': 80, 'Flow Duration': 1200.5, 'Tot Fwd Pkts': 3, 'Protocol': 6,
+        'Active Mean': 0.0, 'Idle Max': 12.0}
+
+
+def npy_bytes(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def check_flow(X, protocols, missing, unknown):
+    assert X.shape == (1, N_FEATURES)
+    assert X[0, FEATURE_INDEX['Destination Port']] == 80
+    assert X[0, FEATURE_INDEX['Flow Duration']] == 1200.5
+    assert X[0, FEATURE_INDEX['Total Fwd Packets']] == 3
+    assert X.sum() == 80 + 1200.5 + 3
+    assert list(protocols) == [6]
+    assert sorted(unknown) == ['Active Mean', 'Idle Max']
+    assert len(missing) == N_FEATURES - 3 and 'Flow Duration' not in missing
+
+
+def test_single_flow_policy():
+    row, protocol, unknown, missing = features_from_mapping(FLOW)
+    check_flow(row, [protocol], missing, unknown)
+
+
+def test_json_objects_follow_the_single_flow_policy():
+    check_flow(*matrix_from_json([FLOW]))
+
+
+def test_json_compact_follows_the_single_flow_policy():
+    check_flow(*matrix_from_json({'features': list(FLOW), 'flows': [list(FLOW.values())]}))
+
+
+def test_structured_npy_follows_the_single_flow_policy():
+    dtype = [(name, 'f8') for name in FLOW]
+    array = np.array([tuple(FLOW.values())], dtype=dtype)
+    check_flow(*matrix_from_npy(npy_bytes(array)))
+
+
+def test_arrow_follows_the_single_flow_policy():
+    pa = pytest.importorskip('pyarrow')
+    table = pa.table({name: [value] for name, value in FLOW.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    check_flow(*matrix_from_arrow(sink.getvalue().to_pybytes()))
+
+
+def test_stream_records_follow_the_single_flow_policy():
+    row, protocol, record_id, unknown, missing = parse_record(json.dumps({'id': 'a1', **FLOW}).encode())
+    assert record_id == 'a1'
+    check_flow(row, [protocol], missing, unknown)
+
+
+# Non-finite values (as CICFlowMeter writes them for zero-duration flows) are zeroed
+NON_FINITE = {'Flow Bytes/s': 'Infinity', 'Flow Packets/s': float('-inf'), 'Flow IAT Mean': float('nan'),
+              'Flow Duration': 5}
+
+
+def check_finite(X):
+    assert np.isfinite(X).all()
+    assert X[0, FEATURE_INDEX['Flow Duration']] == 5 and X.sum() == 5
+
+
+def test_single_flow_non_finite_values():
+    check_finite(features_from_mapping(NON_FINITE)[0])
+
+
+def test_json_non_finite_values():
+    check_finite(matrix_from_json([NON_FINITE]).X)
+    check_finite(matrix_from_json({'features': list(NON_FINITE), 'flows': [list(NON_FINITE.values())]}).X)
+
+
+def test_npy_non_finite_values():
+    dtype = [(name, 'f8') for name in NON_FINITE]
+    array = np.array([tuple(float(value) for value in NON_FINITE.values())], dtype=dtype)
+    check_finite(matrix_from_npy(npy_bytes(array)).X)
+
+    plain = np.zeros((1, N_FEATURES))
+    plain[0, FEATURE_INDEX['Flow Duration']] = 5
+    plain[0, FEATURE_INDEX['Flow Bytes/s']] = np.inf
+    check_finite(matrix_from_npy(npy_bytes(plain)).X)
+
+
+def test_arrow_non_finite_values():
+    pa = pytest.importorskip('pyarrow')
+    table = pa.table({name: [float(value)] for name, value in NON_FINITE.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    check_finite(matrix_from_arrow(sink.getvalue().to_pybytes()).X)
+
+
+def test_stream_non_finite_values():
+    check_finite(parse_record(json.dumps(NON_FINITE).encode())[0])
+    row = [0.0] * N_FEATURES
+    row[FEATURE_INDEX['Flow Duration']], row[FEATURE_INDEX['Flow Bytes/s']] = 5, float('inf')
+    check_finite(parse_record(json.dumps(row).encode())[0])
+
+
+def test_plain_npy_in_schema_order():
+    X = np.arange(2 * N_FEATURES, dtype=np.float32).reshape(2, N_FEATURES)
+    payload = matrix_from_npy(npy_bytes(X))
+    assert payload.X.dtype == np.float64 and np.array_equal(payload.X, X)
+    assert payload.protocols is None and payload.missing == [] and payload.unknown == []
+
+
+def test_textual_protocols_are_kept():
+    payload = matrix_from_json({'features': ['Protocol', 'Destination Port'], 'flows': [['TCP', 443], ['udp', 53]]})
+    assert payload.protocols == ['TCP', 'udp']
+    assert payload.X[:, FEATURE_INDEX['Destination Port']].tolist() == [443, 53]
+
+
+def test_empty_payload():
+    payload = matrix_from_json({'features': FEATURES, 'flows': []})
+    assert payload.X.shape == (0, N_FEATURES)
+
+
+@pytest.mark.parametrize('payload, message', [
+    ({'features': ['Flow Duration', 'flow duration'], 'flows': [[1, 2]]}, 'Duplicate'),
+    ({'features': ['Flow Duration', 'Tot Fwd Pkts'], 'flows': [[1]]}, 'Expected 2 values'),
+    ({'features': ['Flow Duration'], 'flows': [[1], [2, 3]]}, 'Expected 1 values'),
+    ({'features': ['Flow Duration'], 'flows': [1, 2]}, 'Expected 1 values'),
+    ({'features': ['Flow Duration'], 'flows': [['fast']]}, 'numbers'),
+    ({'flows': [[1, 2]]}, 'must be objects'),
+    ({'rows': []}, '"flows"'),
+])
+def test_invalid_payloads(payload, message):
+    with pytest.raises(PayloadError, match=message):
+        matrix_from_json(payload)
+
+
+def test_invalid_stream_record():
+    with pytest.raises(ValueError, match='Feature count mismatch'):
+        parse_record(b'[1, 2]')
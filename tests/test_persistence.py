@@ -0,0 +1,87 @@
+# -*- encoding: utf-8 -*-
+
+import pytest
+
+from apps import db
+from apps.ids.persistence import (decode_cursor, load_detections, query_analyses, query_detections,
+                                  save_detections)
+from apps.models import AnalysisResult
+
+PROTOCOLS = ('6', '17')
+
+
+def make_results(n):
+    # Confidences repeat (ties on the sort column) and are not in record order
+    return [{'record': i, 'prediction': int(i % 3 == 0), 'confidence': (i * 7 % 10) / 10,
+             'protocol': PROTOCOLS[i % 2], 'flow_duration': float(i), 'total_packets': i}
+            for i in range(n)]
+
+
+@pytest.fixture
+def analysis(app):
+    analysis = AnalysisResult(filename='a.csv', total_records=53, user_id=1)
+    db.session.add(analysis)
+    db.session.commit()
+    save_detections(analysis.id, make_results(53), batch_size=10)
+    return analysis
+
+
+def all_pages(analysis_id, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        records, cursor = query_detections(analysis_id, cursor=cursor, limit=limit, **filters)
+        pages.append(records)
+        if cursor is None:
+            return pages
+
+
+def test_save_and_load_keep_file_order(analysis):
+    assert load_detections(analysis.id) == make_results(53)
+
+
+@pytest.mark.parametrize('sort', ['record', 'confidence'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_cover_every_record_once_in_order(analysis, sort, descending):
+    pages = all_pages(analysis.id, limit=7, sort=sort, descending=descending)
+    records = [record for page in pages for record in page]
+
+    assert [len(page) for page in pages] == [7] * 7 + [4]
+    assert sorted(record['record'] for record in records) == list(range(53))
+    keys = [(record[sort], record['record']) for record in records]
+    assert keys == sorted(keys, reverse=descending)
+
+
+def test_last_full_page_has_no_cursor(analysis):
+    records, cursor = query_detections(analysis.id, limit=53)
+    assert len(records) == 53 and cursor is None
+
+
+def test_filters_apply_on_every_page(analysis):
+    filters = dict(prediction=1, min_confidence=0.2, max_confidence=0.8, protocol='6')
+    records = [record for page in all_pages(analysis.id, limit=2, **filters) for record in page]
+
+    expected = [result['record'] for result in make_results(53)
+                if result['prediction'] and 0.2 <= result['confidence'] <= 0.8 and result['protocol'] == '6']
+    assert [record['record'] for record in records] == expected
+    assert expected
+
+
+def test_invalid_sort_and_cursor_are_rejected(analysis):
+    with pytest.raises(ValueError):
+        query_detections(analysis.id, sort='prediction')
+    with pytest.raises(ValueError):
+        query_detections(analysis.id, cursor='not a cursor')
+    with pytest.raises(ValueError):
+        decode_cursor('WzFd')  # [1]: wrong length
+
+
+def test_analyses_newest_first_per_user(app):
+    for i in range(5):
+        db.session.add(AnalysisResult(filename=f'{i}.csv', total_records=0, user_id=1 + i % 2))
+    db.session.commit()
+
+    first, cursor = query_analyses(1, limit=2)
+    rest, end = query_analyses(1, cursor=cursor, limit=2)
+
+    assert [a.filename for a in first + rest] == ['4.csv', '2.csv', '0.csv']
+    assert end is None
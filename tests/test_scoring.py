@@ -0,0 +1,190 @@
+# -*- encoding: utf-8 -*-
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+
+from apps.ids.batching import MicroBatcher
+from apps.ids.registry import ModelUnavailable
+from apps.ids.result_cache import ScoreCache
+from apps.ids.routing import RoutedScorer
+from apps.ids.schema import FEATURE_INDEX, N_FEATURES
+from apps.ids.scoring import SCORE_FIELDS, EnsembleScorer, dedup_rows, row_hashes
+
+FIELDS = ('prediction', 'confidence', 'dnn', 'cnn', 'lightgbm')
+
+
+def sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+class Dense:
+    """Stand-in for the Keras models: each row's score depends on that row only
+    (a BLAS matmul may round differently with the batch layout)."""
+
+    def __init__(self, seed):
+        self.w = np.random.default_rng(seed).normal(size=N_FEATURES) * 3
+
+    def predict_on_batch(self, X):
+        X = np.asarray(X).reshape(len(X), -1)
+        return sigmoid((X * self.w).sum(axis=1) - self.w.sum() / 2)[:, None]
+
+
+class Forest(Dense):
+    """Stand-in for the LightGBM classifier."""
+
+    def predict_proba(self, X):
+        p = self.predict_on_batch(X)[:, 0]
+        return np.column_stack([1.0 - p, p])
+
+
+class Registry:
+    def __init__(self, missing=()):
+        rng = np.random.default_rng(1)
+        scaler = MinMaxScaler().fit(rng.uniform(0, 1000, size=(50, N_FEATURES)))
+        self.models = {'scaler': scaler, 'dnn': Dense(2), 'cnn': Dense(3), 'group': Forest(4)}
+        for name in missing:
+            del self.models[name]
+
+    def available(self, name):
+        return name in self.models
+
+    def get(self, name):
+        if name not in self.models:
+            raise ModelUnavailable(name)
+        return self.models[name]
+
+    def fingerprint(self):
+        return 'fake'
+
+
+def flows(n_distinct=200, n_rows=1000, seed=5):
+    rng = np.random.default_rng(seed)
+    distinct = rng.uniform(0, 1000, size=(n_distinct, N_FEATURES))
+    return distinct[rng.integers(0, n_distinct, size=n_rows)]
+
+
+def assert_same_scores(a, b):
+    for field in FIELDS:
+        np.testing.assert_array_equal(a[field], b[field])
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_dedup_matches_scoring_every_row(dtype):
+    X = flows()
+    full = EnsembleScorer(Registry(), dedup=False, dtype=dtype).score_batch(X)
+    dedup = EnsembleScorer(Registry(), dedup=True, dtype=dtype).score_batch(X)
+
+    assert_same_scores(full, dedup)
+    assert dedup['dedup']['rows'] == 1000
+    assert dedup['dedup']['unique'] == len(np.unique(X, axis=0))
+
+
+def test_dedup_of_given_rows():
+    X = flows()
+    rows = np.arange(0, 1000, 3)
+    full = EnsembleScorer(Registry(), dedup=False).score_batch(X[rows])
+    dedup = EnsembleScorer(Registry()).score_batch(X, rows=rows)
+    assert_same_scores(full, dedup)
+
+
+def test_score_cache_matches_scoring_every_row():
+    registry = Registry()
+    scorer = EnsembleScorer(registry, cache=ScoreCache(registry, SCORE_FIELDS))
+    X = flows()
+    first = scorer.score_batch(X[:600])
+    second = scorer.score_batch(X[400:])
+
+    reference = EnsembleScorer(Registry(), dedup=False)
+    assert_same_scores(first, reference.score_batch(X[:600]))
+    assert_same_scores(second, reference.score_batch(X[400:]))
+    assert second['dedup']['cache_hits'] > 0
+
+
+def test_dedup_with_a_degraded_ensemble():
+    X = flows()
+    full = EnsembleScorer(Registry(missing=['cnn']), dedup=False).score_batch(X)
+    dedup = EnsembleScorer(Registry(missing=['cnn'])).score_batch(X)
+    assert_same_scores(full, dedup)
+    assert np.isnan(dedup['cnn']).all()
+
+
+def test_zero_signs_and_nan_are_distinct_rows():
+    X = np.zeros((4, N_FEATURES))
+    X[1, 0] = -0.0
+    X[2, 0] = np.nan
+    X[3, 0] = np.nan
+    first, inverse = dedup_rows(row_hashes(X))
+    # Rows are compared by their bits
+    assert len(first) == 3
+    assert inverse[2] == inverse[3] != inverse[0] != inverse[1]
+
+
+def test_second_hash_separates_first_hash_collisions():
+    hashes = np.array([[1, 10], [1, 11], [2, 12], [1, 10]], dtype=np.uint64)
+    first, inverse = dedup_rows(hashes)
+    assert len(first) == 3
+    assert inverse[0] == inverse[3] and len({inverse[0], inverse[1], inverse[2]}) == 3
+    np.testing.assert_array_equal(hashes[first[inverse]], hashes)
+
+
+@pytest.mark.parametrize('order', [('group', 'dnn', 'cnn'), ('cnn', 'dnn', 'group'), ('dnn', 'group', 'cnn')])
+@pytest.mark.parametrize('missing', [(), ('dnn',), ('group',)])
+def test_cascade_labels_match_the_full_ensemble(order, missing):
+    X = flows(n_distinct=1000, n_rows=1000, seed=6)
+    full = EnsembleScorer(Registry(missing), dedup=False).score_batch(X)
+    cascade = EnsembleScorer(Registry(missing), dedup=False, cascade=True, cascade_order=order).score_batch(X)
+
+    np.testing.assert_array_equal(cascade['prediction'], full['prediction'])
+    if not missing:
+        assert 0 < cascade['cascade']['early_exits'] < 1000
+
+    # Rows that ran every member get the full ensemble confidence
+    ran_all = np.ones(1000, dtype=bool)
+    for key in ('dnn', 'cnn', 'lightgbm'):
+        if not np.isnan(full[key]).all():
+            ran_all &= ~np.isnan(cascade[key])
+    assert ran_all.any()
+    np.testing.assert_array_equal(cascade['confidence'][ran_all], full['confidence'][ran_all])
+
+    # Early exits: partial average on the same side of the threshold, skipped members NaN
+    exited = ~ran_all
+    assert ((cascade['confidence'][exited] > 0.5) == (full['confidence'][exited] > 0.5)).all()
+    assert cascade['cascade']['early_exits'] == exited.sum()
+
+
+class Constant:
+    def __init__(self, score):
+        self.score = score
+
+    def predict_on_batch(self, X):
+        return np.full((len(X), 1), self.score)
+
+    def predict_proba(self, X):
+        return np.column_stack([np.full(len(X), 1.0 - self.score), np.full(len(X), self.score)])
+
+
+@pytest.mark.parametrize('group, dnn, cnn', [
+    (1.0, 0.5, 0.0),     # 0.3 + 0.2 + 0 = 0.5: not above the threshold
+    (1.0, 0.5, 1e-12),   # just above it, decided by the last member
+    (0.0, 1.0, 2 / 3),   # 0 + 0.4 + 0.2 = 0.6
+    (1.0, 1.0, 0.0),     # 0.7 once the DNN ran: exits before the CNN
+])
+def test_cascade_near_the_threshold(group, dnn, cnn):
+    registry = Registry()
+    registry.models.update({'group': Constant(group), 'dnn': Constant(dnn), 'cnn': Constant(cnn)})
+    X = flows(n_rows=10)
+    full = EnsembleScorer(registry, dedup=False).score_batch(X)
+    cascade = EnsembleScorer(registry, dedup=False, cascade=True).score_batch(X)
+    np.testing.assert_array_equal(cascade['prediction'], full['prediction'])
+
+
+def test_single_flows_are_routed_with_their_protocol():
+    row = np.zeros(N_FEATURES)
+    row[FEATURE_INDEX['Destination Port']] = 443
+    scorer = RoutedScorer(Registry(), prefilter_threshold=None)
+
+    assert scorer.score_one(row)['route'] == 'web'
+    assert scorer.score_one(row, 'TCP')['route'] == 'web'
+    assert scorer.score_one(row, 17)['route'] == 'non_web'
+    assert MicroBatcher(scorer, max_latency_ms=1).score_one(row, 17)['route'] == 'non_web'
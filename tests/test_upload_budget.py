@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-
+
+import os
+
+from apps import db
+from apps.home.routes import enforce_upload_budget
+from apps.ids.columnar import enforce_disk_budget
+from apps.models import AnalysisResult
+
+MB = 2**20
+
+
+def write(path, size, mtime):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_only_candidates_are_deleted(tmp_path):
+    shipped = write(str(tmp_path / 'sample.csv'), 4 * MB, 1)
+    old = write(str(tmp_path / 'old.csv'), 2 * MB, 2)
+    kept = write(str(tmp_path / 'queued.csv'), 2 * MB, 3)
+    new = write(str(tmp_path / 'new.csv'), 2 * MB, 4)
+
+    deleted = enforce_disk_budget([old, kept, new], 3 * MB, keep=[kept, new])
+    assert deleted == [os.path.abspath(old)]
+    assert os.path.exists(shipped) and os.path.exists(kept) and os.path.exists(new)
+
+
+def test_unbounded_budget(tmp_path):
+    path = write(str(tmp_path / 'a.csv'), MB, 1)
+    assert enforce_disk_budget([path], 0) == []
+    assert os.path.exists(path)
+
+
+class Cache:
+    def __init__(self, root):
+        self.root = root
+
+
+def test_upload_budget(app, tmp_path):
+    uploads = tmp_path / 'uploads'
+    shipped = write(str(uploads / 'sample_ddos_test.csv'), 4 * MB, 1)
+    done = write(str(uploads / 'done.csv'), 2 * MB, 2)
+    columnar = write(str(uploads / 'columnar' / 'ab.arrow'), 2 * MB, 3)
+    queued = write(str(uploads / 'queued.csv'), 2 * MB, 4)
+    new = write(str(uploads / 'new.csv'), 2 * MB, 5)
+
+    db.session.add_all([AnalysisResult(filename='done.csv', upload_path=done, status='done'),
+                        AnalysisResult(filename='queued.csv', upload_path=queued, status='queued')])
+    db.session.commit()
+
+    app.config['UPLOADS_MAX_MB'] = 5
+    app.columnar = Cache(str(uploads / 'columnar'))
+    with app.test_request_context():
+        enforce_upload_budget(new)
+
+    assert not os.path.exists(done) and not os.path.exists(columnar)
+    assert os.path.exists(shipped) and os.path.exists(queued) and os.path.exists(new)
+    # The finished analysis no longer points at its deleted upload
+    assert AnalysisResult.query.filter_by(filename='done.csv').one().upload_path is None
+    assert AnalysisResult.query.filter_by(filename='queued.csv').one().upload_path == queued